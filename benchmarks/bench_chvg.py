@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+'''
+Benchmarks each stage of comic_html_view_generator against a synthetic comic
+library, reporting the time taken, files/s, MB/s and peak memory use of each
+stage as JSON, so that runs can be compared with one another.
+
+Run from the root of the repository with: ::
+
+    python benchmarks/bench_chvg.py --archives 50 --pages 40 --output run.json
+
+Each stage runs in a fresh child process, so that the peak RSS reported for a
+stage is that of the stage alone. Stages run in order against the same
+directories, as each one relies on the output of the stages before it.
+'''
+from os import path
+import multiprocessing
+import platform
+import argparse
+import random
+import shutil
+import tempfile
+import json
+import time
+import sys
+import os
+
+import zipfile
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where peak RSS isn't reported.
+    resource = None
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from comic_html_view_generator import chvg  # noqa: E402
+
+STAGES = (
+    'scan_filetrees',
+    'mirror_unzip_cbz',
+    'mirror_images_directory',
+    'create_comic_display_htmlfiles',
+    'create_comic_browse_htmlfiles',
+    'embed_images',
+)
+
+IMAGE_SUFFIXES = ('.jpg', '.png', '.gif')
+
+
+def generate_library(
+    source_path,
+    archives=20,
+    pages=30,
+    page_size=64 * 1024,
+    depth=2,
+    loose_dirs=5,
+    stored_every=2,
+    seed=0,
+):
+    '''Creates a synthetic comic library in `source_path`: `archives` CBZ
+    files of `pages` pages each, spread across directories nested `depth`
+    deep, plus `loose_dirs` directories of `pages` loose images each. Every
+    `stored_every`-th CBZ file is stored rather than deflated. Pages are
+    random bytes around `page_size` long, which, like real images, barely
+    compress. Returns a dictionary describing the library.'''
+    rng = random.Random(seed)
+
+    def page_bytes():
+        size = rng.randint(page_size // 2, page_size * 3 // 2)
+        return rng.getrandbits(size * 8).to_bytes(size, 'little')
+
+    def nested_dir(index):
+        parts = [f'series{index % 5:02}']
+        parts.extend(f'arc{(index // 5) % (level + 2):02}' for level in range(depth - 1))
+        return path.join(source_path, *parts)
+
+    total_files = 0
+    total_bytes = 0
+    for index in range(archives):
+        dirname = nested_dir(index)
+        os.makedirs(dirname, exist_ok=True)
+        compression = zipfile.ZIP_DEFLATED
+        if stored_every and index % stored_every == 0:
+            compression = zipfile.ZIP_STORED
+        zpath = path.join(dirname, f'volume{index:04}.cbz')
+        with zipfile.ZipFile(zpath, 'w', compression=compression) as zfp:
+            for page in range(pages):
+                suffix = IMAGE_SUFFIXES[page % len(IMAGE_SUFFIXES)]
+                zfp.writestr(f'page{page:04}{suffix}', page_bytes())
+        total_files += 1
+        total_bytes += os.stat(zpath).st_size
+    for index in range(loose_dirs):
+        dirname = path.join(nested_dir(index), f'loose{index:04}')
+        os.makedirs(dirname, exist_ok=True)
+        for page in range(pages):
+            suffix = IMAGE_SUFFIXES[page % len(IMAGE_SUFFIXES)]
+            data = page_bytes()
+            with open(path.join(dirname, f'page{page:04}{suffix}'), 'wb') as imgfile:
+                imgfile.write(data)
+            total_files += 1
+            total_bytes += len(data)
+    return {
+        'archives': archives,
+        'pages': pages,
+        'page_size': page_size,
+        'depth': depth,
+        'loose_dirs': loose_dirs,
+        'stored_every': stored_every,
+        'seed': seed,
+        'files': total_files,
+        'bytes': total_bytes,
+    }
+
+
+def _files_under(root, match):
+    '''Returns the number of files beneath `root` whose names satisfy `match`,
+    and their total size in bytes.'''
+    files = 0
+    size = 0
+    for dirpath, _, filenames in os.walk(root):
+        for fname in filenames:
+            if match(fname):
+                files += 1
+                size += os.stat(path.join(dirpath, fname)).st_size
+    return files, size
+
+
+def run_stage(stage, source_path, dest_path, jobs, use_mmap=False):
+    '''Runs a single stage, returning the number of files and bytes the stage
+    produced (or, for `scan_filetrees`, the CBZ files and images found).'''
+    if stage == 'scan_filetrees':
+        trees = chvg.scan_filetrees(source_path)
+        return sum(len(files) for tree in trees for files in tree.values()), 0
+    if stage == 'mirror_unzip_cbz':
+        tree = chvg.mirror_unzip_cbz(source_path, dest_path, jobs=jobs, use_mmap=use_mmap)
+        return _sum_tree(dest_path, tree)
+    if stage == 'mirror_images_directory':
+        tree = chvg.mirror_images_directory(source_path, dest_path)
+        return _sum_tree(dest_path, tree)
+    if stage == 'create_comic_display_htmlfiles':
+        chvg.create_comic_display_htmlfiles(dest_path)
+        return _files_under(dest_path, lambda fname: fname == 'index.html')
+    if stage == 'create_comic_browse_htmlfiles':
+        chvg.create_comic_browse_htmlfiles(dest_path)
+        return _files_under(dest_path, lambda fname: fname.startswith('BROWSE_COMIC_HERE'))
+    if stage == 'embed_images':
+        chvg.create_comic_display_htmlfiles(dest_path, embed_images=True)
+        return _files_under(dest_path, lambda fname: fname == 'index.html')
+    raise ValueError(f"unknown stage {stage!r}")
+
+
+def _sum_tree(root, tree):
+    '''Returns the number of files listed in the file tree `tree` (as
+    returned by `build_filetree()`) and their total size in bytes.'''
+    files = 0
+    size = 0
+    for reltpth, filenames in tree.items():
+        for fname in filenames:
+            files += 1
+            size += os.stat(path.join(root, reltpth, fname)).st_size
+    return files, size
+
+
+def _peak_rss_bytes():
+    '''Returns the peak RSS of this process or any of its waited-for children
+    (such as the workers of a pool), in bytes.'''
+    if resource is None:
+        return None
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # ru_maxrss is in bytes on macOS, but kilobytes elsewhere.
+    if sys.platform == 'darwin':
+        return peak
+    return peak * 1024
+
+
+def _stage_worker(conn, stage, source_path, dest_path, jobs, use_mmap):
+    start = time.perf_counter()
+    files, size = run_stage(stage, source_path, dest_path, jobs, use_mmap)
+    seconds = time.perf_counter() - start
+    conn.send((seconds, files, size, _peak_rss_bytes()))
+    conn.close()
+
+
+def time_stage(stage, source_path, dest_path, jobs=1, use_mmap=False):
+    '''Runs `stage` in a fresh child process, returning a dictionary of the
+    time it took, the files and bytes it produced, its throughput, and its
+    peak RSS.'''
+    ctx = multiprocessing.get_context('spawn')
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    proc = ctx.Process(
+        target=_stage_worker, args=(child_conn, stage, source_path, dest_path, jobs, use_mmap)
+    )
+    proc.start()
+    child_conn.close()
+    try:
+        seconds, files, size, peak_rss = parent_conn.recv()
+    except EOFError:
+        proc.join()
+        raise RuntimeError(f"stage {stage!r} failed with exit code {proc.exitcode}")
+    proc.join()
+    return {
+        'stage': stage,
+        'seconds': round(seconds, 6),
+        'files': files,
+        'bytes': size,
+        'files_per_s': round(files / seconds, 2) if seconds else None,
+        'mb_per_s': round(size / seconds / 1e6, 2) if seconds and size else None,
+        'peak_rss_bytes': peak_rss,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='''
+        Benchmarks each stage of comic_html_view_generator against a synthetic
+        comic library, and reports the results as JSON.
+    '''
+    )
+    parser.add_argument('--archives', type=int, default=20, help='Number of CBZ files.')
+    parser.add_argument('--pages', type=int, default=30, help='Pages per CBZ file or folder.')
+    parser.add_argument(
+        '--page-size', type=int, default=64 * 1024, help='Average size of a page in bytes.'
+    )
+    parser.add_argument('--depth', type=int, default=2, help='How deeply to nest directories.')
+    parser.add_argument(
+        '--loose-dirs', type=int, default=5, help='Number of folders of loose images.'
+    )
+    parser.add_argument(
+        '--stored-every',
+        type=int,
+        default=2,
+        help='Every Nth CBZ file is stored rather than deflated; 0 deflates all of them.'
+    )
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the generated library.')
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=1, help="Passed as 'jobs' to mirror_unzip_cbz()."
+    )
+    parser.add_argument(
+        '--mmap',
+        action='store_true',
+        help="Passed as 'use_mmap' to mirror_unzip_cbz()."
+    )
+    parser.add_argument(
+        '--stages',
+        nargs='+',
+        choices=STAGES,
+        default=list(STAGES),
+        help='The stages to run, in order. Defaults to all of them.'
+    )
+    parser.add_argument(
+        '--workdir',
+        default=None,
+        help='''Directory to generate the library and its output in. Defaults
+        to a temporary directory, which is removed afterwards.'''
+    )
+    parser.add_argument('--output', default=None, help='Write the JSON here instead of stdout.')
+    args = parser.parse_args()
+
+    workdir = args.workdir
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix='bench_chvg_')
+    source_path = path.join(workdir, 'source')
+    dest_path = path.join(workdir, 'dest')
+    for dirname in (source_path, dest_path):
+        if path.exists(dirname):
+            shutil.rmtree(dirname)
+    try:
+        library = generate_library(
+            source_path,
+            archives=args.archives,
+            pages=args.pages,
+            page_size=args.page_size,
+            depth=args.depth,
+            loose_dirs=args.loose_dirs,
+            stored_every=args.stored_every,
+            seed=args.seed,
+        )
+        results = [
+            time_stage(stage, source_path, dest_path, args.jobs, args.mmap)
+            for stage in args.stages
+        ]
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'jobs': args.jobs,
+        'mmap': args.mmap,
+        'library': library,
+        'stages': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w') as outfile:
+            outfile.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+'''
+Compares the speed of `sort_nicely()` with that of the implementation it
+replaced, sorting a list of synthetic page filenames, and reports the results
+as JSON.
+
+Run from the root of the repository with: ::
+
+    python benchmarks/bench_sort_nicely.py --names 100000
+'''
+from os import path
+import argparse
+import random
+import json
+import sys
+import re
+
+import timeit
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from comic_html_view_generator import chvg  # noqa: E402
+
+
+def original_sort_nicely(l):
+    '''The implementation of `sort_nicely()` before keys were precompiled.'''
+    convert = lambda text: int(text) if text.isdigit() else text
+    alphanum_key = lambda key: [convert(c) for c in re.split('([0-9]+)', key)]
+    return sorted(l, key=alphanum_key)
+
+
+def generate_names(count, seed=0):
+    '''Returns `count` unique filenames, shaped like the pages of comics
+    (such as 'Series 12/v03/c045/p017.jpg'), in a random order.'''
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < count:
+        names.add(
+            f'Series {rng.randint(1, 200)}/v{rng.randint(1, 30):02}/'
+            f'c{rng.randint(1, 300):03}/p{rng.randint(1, 60):03}.jpg'
+        )
+    names = sorted(names)
+    rng.shuffle(names)
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks sort_nicely() against the implementation it replaced.'
+    )
+    parser.add_argument('--names', type=int, default=100000, help='Number of names to sort.')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs of each, keeping the best.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the generated names.')
+    args = parser.parse_args()
+
+    names = generate_names(args.names, seed=args.seed)
+    assert original_sort_nicely(names) == chvg.sort_nicely(names)
+    # Fill the memo once, as a run sorts the same folders in several stages.
+    chvg.sort_nicely(names, memoize=True)
+    candidates = {
+        'original': lambda: original_sort_nicely(names),
+        'sort_nicely': lambda: chvg.sort_nicely(names),
+        'sort_nicely_memoized': lambda: chvg.sort_nicely(names, memoize=True),
+    }
+    results = dict()
+    for name, candidate in candidates.items():
+        results[name] = round(min(timeit.repeat(candidate, number=1, repeat=args.repeat)), 6)
+    report = {
+        'names': args.names,
+        'seconds': results,
+        'speedup': {
+            name: round(results['original'] / seconds, 2)
+            for name, seconds in results.items() if name != 'original'
+        },
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
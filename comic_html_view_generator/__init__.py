@@ -9,9 +9,31 @@ comics books which have had a readable HTML file generated from them.
 from .chvg import (
     create_comic_display_htmlfiles,
     create_comic_browse_htmlfiles,
+    generate_thumbnails,
     build_filetree,
+    scan_filetrees,
+    merge_filetrees,
     clean_namelist,
+    NameFilter,
     create_image_datauri,
+    image_dimensions,
+    write_image_datauri,
+    DataURICache,
+    write_html_page,
+    write_shared_assets,
+    PageCompressor,
+    Transcoder,
+    TierGenerator,
     mirror_unzip_cbz,
+    extract_cbz,
+    index_cbz,
+    open_archive_member,
+    serve,
+    BuildManifest,
+    Stats,
     mirror_images_directory,
+    copy_image_file,
+    ContentStore,
+    run_pipeline,
+    SourceWatcher,
 )
@@ -1,23 +1,58 @@
 #!/usr/bin/env python3
 from os import path
 from datetime import datetime, timezone
-from urllib.parse import quote
+from urllib.parse import quote, urlsplit
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import mimetypes
 import argparse
+import asyncio
+import collections
+import contextlib
+import errno
+import functools
 import pathlib
 import base64
+import gzip
+import bisect
+import hashlib
+import http
+import http.server
+import io
+import json
+import mmap
 import shutil
+import struct
 import sys
 import os
 import re
+import threading
+import time
 
 import zipfile
+import zlib
 
-PREAMBLE = '''
-<!DOCTYPE html>
-<html>
-<style>
-* {
+try:
+    import fcntl
+except ImportError:
+    # Only needed for reflinks, which aren't available where fcntl isn't.
+    fcntl = None
+
+try:
+    from PIL import Image
+except ImportError:
+    # Pillow is optional, and only needed to generate thumbnails.
+    Image = None
+
+try:
+    import brotli
+except ImportError:
+    # Brotli is optional, and only needed to precompress pages with it.
+    brotli = None
+
+# The CSS of every page, and the JavaScript of the pages of comics which views
+# them as a slideshow. Pages either include them inline (between PREAMBLE and
+# POST_INDEX) or link to them as shared assets; see write_shared_assets().
+STYLESHEET = '''* {
     margin: 0;
     padding: 0;
     font-family: Consolas, "Inconsolata", Menlo, Monaco, Lucida Console, Liberation Mono, DejaVu Sans Mono, Bitstream Vera Sans Mono, Courier New, monospace, serif;
@@ -36,6 +71,10 @@ h1 {
 .center-fit {
     max-width: 100%;
     max-height: 99vh;
+    /* Keeps the shape given by the width and height attributes as the image
+    is scaled to fit. */
+    height: auto;
+    object-fit: contain;
     margin: auto;
 }
 
@@ -134,9 +173,10 @@ h1 {
 }
 
 
-</style>
 '''
 
+PREAMBLE = '\n<!DOCTYPE html>\n<html>\n<style>\n' + STYLESHEET + '</style>\n'
+
 INDEX_TEMPLATE = '''
 <head>
     <meta charset=utf-8 />
@@ -157,8 +197,10 @@ INDEX_TEMPLATE = '''
 </div>
 </body>
 '''
-POST_INDEX = '''
-<script type="text/javascript">
+VIEWER_SCRIPT = '''
+// The number of pages after the one being viewed which are fetched ahead of
+// time, so that turning to them doesn't wait on the network.
+const PREFETCH_PAGES = 2;
 
 /*
 Returns a list of strings, each a path to an image, taken from the 'src'
@@ -168,25 +210,88 @@ with that 'src' attribute on the page; later 'img' with the same 'src' as
 earlier 'img' already in the list will not be added to the list.
 */
 function find_all_images(queryStr = '.imgbox img') {
-	var srcs = {};
+	var srcs = new Set();
 	var allimgs = [];
 	var allElems = document.querySelectorAll(queryStr);
 	for (var i = 0; i < allElems.length; i++) {
-		var el = allElems[i];
-		if (el.src in srcs) {
+		// Read 'src' only once, as each read of an embedded image copies it.
+		var src = image_key(allElems[i]);
+		if (srcs.has(src)) {
 			continue;
 		}
-		allimgs.push(el.src);
-		srcs[el.src] = 1;
+		allimgs.push(src);
+		srcs.add(src);
 	}
 	return allimgs;
 }
 
+/*
+Returns a Map from the key of each image with smaller copies to choose from
+(see image_key) to its 'srcset' and 'sizes' attributes, so the slideshow can
+offer the same choice.
+*/
+function find_image_srcsets(queryStr = '.imgbox img[srcset]') {
+	let srcsets = new Map();
+	for (let el of document.querySelectorAll(queryStr)) {
+		srcsets.set(image_key(el), {srcset: el.getAttribute('srcset'), sizes: el.getAttribute('sizes')});
+	}
+	return srcsets;
+}
+
 function getImgPath(url) {
+	if (url.startsWith('#')) {
+		return url.slice(1);
+	}
 	var u = new URL(url);
 	return u.pathname;
 }
 
+/*
+Returns the key the viewer knows an image element by: its 'src', or for an
+embedded image whose data is deferred until it's about to be viewed, a short
+key such as '#embedded-3'.
+*/
+function image_key(el) {
+	if (el.dataset.embedded !== undefined) {
+		return '#embedded-' + el.dataset.embedded;
+	}
+	return el.src;
+}
+
+/*
+Returns the URL of the image known by the key 'key' (see image_key). The data
+URIs of deferred images are kept as the text of 'embedded-data-N' elements.
+*/
+function image_url(key) {
+	if (key.startsWith('#embedded-')) {
+		let id = 'embedded-data-' + key.slice('#embedded-'.length);
+		return document.getElementById(id).textContent;
+	}
+	return key;
+}
+
+/*
+Gives each embedded image whose data was deferred its data URI once it's
+nearly scrolled into view, so the browser only decodes the images being read.
+*/
+function load_deferred_images(queryStr = '.imgbox img[data-embedded]') {
+	let imgs = document.querySelectorAll(queryStr);
+	let load = (img) => { img.src = image_url(image_key(img)); };
+	if (!('IntersectionObserver' in window)) {
+		imgs.forEach(load);
+		return;
+	}
+	let observer = new IntersectionObserver((entries) => {
+		for (let entry of entries) {
+			if (entry.isIntersecting) {
+				load(entry.target);
+				observer.unobserve(entry.target);
+			}
+		}
+	}, {rootMargin: '100% 0px'});
+	imgs.forEach((img) => observer.observe(img));
+}
+
 function parse_hash() {
 	let conf = {};
 	conf.pageview = false;
@@ -256,15 +361,28 @@ let ImagesPageSlideshow = class {
 	@param rightbutton - Element which, when clicked/tapped, causes the view to
 		move to the next image in the list, like going to the next page in a
 		book.
-	@param srclist - A list of strings, each string a path to an image.
+	@param srclist - A list of strings, each string a path to an image (or
+		the key of a deferred embedded image; see image_key).
+	@param srcsets - A Map from the images in srclist which have smaller
+		copies to their 'srcset' and 'sizes', as from find_image_srcsets.
 	*/
-	constructor(parentview, imageview, closebutton, leftbutton, rightbutton, srclist) {
+	constructor(parentview, imageview, closebutton, leftbutton, rightbutton, srclist, srcsets) {
 		this.parentview = parentview;
 		this.imageview = imageview;
 		this.closebutton = closebutton;
 		this.leftbutton = leftbutton;
 		this.rightbutton = rightbutton;
 		this.srclist = srclist;
+		this.srcsets = srcsets || new Map();
+		// The index within srclist of each image, and of the one being viewed,
+		// so turning a page never searches the list.
+		this.srcindex = new Map();
+		for (var i = 0; i < srclist.length; i++) {
+			this.srcindex.set(srclist[i], i);
+		}
+		this.current = -1;
+		// Images being fetched ahead of time, by their index in srclist.
+		this.prefetched = new Map();
 
 		this.fader = new Fadeout(imageview, [closebutton], [leftbutton, rightbutton]);
 		this.fader.state = this.state;
@@ -283,25 +401,62 @@ let ImagesPageSlideshow = class {
 	}
 
 	previousPage(event) {
-		let currentSrc = this.imageview.src;
-		let currentPageIndex = this.srclist.indexOf(currentSrc);
-		if (currentPageIndex === 0) {
+		if (this.current <= 0) {
 			return;
 		}
-		let newsrc = this.srclist[currentPageIndex-1];
-		this.imageview.src = newsrc;
-		window.location.hash = `#pageview:${getImgPath(newsrc)}`;
+		this.showPage(this.current-1);
 	}
 
 	nextPage(event) {
-		let currentSrc = this.imageview.src;
-		let currentPageIndex = this.srclist.indexOf(currentSrc);
-		if (currentPageIndex === this.srclist.length-1) {
+		if (this.current === this.srclist.length-1) {
 			return;
 		}
-		let newsrc = this.srclist[currentPageIndex+1];
-		this.imageview.src = newsrc;
+		this.showPage(this.current+1);
+	}
+
+	/* Shows the image at 'index' in the srclist, then starts fetching the
+	 * pages after it.
+	 */
+	showPage(index) {
+		this.current = index;
+		let newsrc = this.srclist[index];
+		this.setSource(this.imageview, newsrc);
 		window.location.hash = `#pageview:${getImgPath(newsrc)}`;
+		this.prefetch(index);
+	}
+
+	/* Fetches the PREFETCH_PAGES images after the one at 'index' in the
+	 * srclist, so the browser has them cached by the time they're shown.
+	 */
+	prefetch(index) {
+		for (let i of Array.from(this.prefetched.keys())) {
+			if (i <= index) {
+				this.prefetched.delete(i);
+			}
+		}
+		let last = Math.min(index + PREFETCH_PAGES, this.srclist.length - 1);
+		for (let i = index + 1; i <= last; i++) {
+			let src = this.srclist[i];
+			// Embedded images are already loaded along with the page.
+			if (this.prefetched.has(i) || src.startsWith('data:') || src.startsWith('#')) {
+				continue;
+			}
+			let img = new Image();
+			this.setSource(img, src);
+			this.prefetched.set(i, img);
+		}
+	}
+
+	/* Points the image element 'img' at the image known by 'key', letting
+	 * the browser choose the copy which suits the size of the viewport when
+	 * the image has smaller copies.
+	 */
+	setSource(img, key) {
+		let tiers = this.srcsets.get(key);
+		// Set before 'src', so that only the chosen copy is fetched.
+		img.sizes = tiers ? tiers.sizes : '';
+		img.srcset = tiers ? tiers.srcset : '';
+		img.src = image_url(key);
 	}
 
 	close() {
@@ -314,7 +469,7 @@ let ImagesPageSlideshow = class {
 		this.parentview.style.display = "none";
 		document.querySelector('body').classList.remove('modal-open');
 		window.scrollTo(0, this._scrollY);
-		let currentSrc = this.imageview.src;
+		let currentSrc = this.srclist[this.current];
 		window.location.hash = `#${getImgPath(currentSrc)}`;
 	}
 
@@ -335,13 +490,11 @@ let ImagesPageSlideshow = class {
 		if (this.state === "visible") {
 			return;
 		}
-		let newPageIndex = this.srclist.indexOf(path);
-		if (newPageIndex === -1) {
+		let newPageIndex = this.srcindex.get(path);
+		if (newPageIndex === undefined) {
 			throw `Image at path '${path}' is not present in list of images`
 		}
-		let newsrc = this.srclist[newPageIndex];
-		this.imageview.src = newsrc;
-		window.location.hash = `#pageview:${getImgPath(newsrc)}`;
+		this.showPage(newPageIndex);
 		this.open();
 	}
 
@@ -354,6 +507,7 @@ document.slideshow = new ImagesPageSlideshow(
 	document.querySelector('#lefthalf'),
 	document.querySelector('#righthalf'),
 	find_all_images(),
+	find_image_srcsets(),
 );
 console.log(document.slideshow);
 var slideshow = document.slideshow;
@@ -363,11 +517,11 @@ var slideshow = document.slideshow;
 var _imgelems = document.querySelectorAll('.imgbox > img');
 for (var i = 0; i < _imgelems.length; i++) {
 	let imgelem = _imgelems[i];
-	var src = getImgPath(imgelem.src);
+	var src = getImgPath(image_key(imgelem));
 	let imglabel = imgelem.parentNode.querySelector('p');
 	imgelem.addEventListener('click', function(event){
 		event.preventDefault();
-		document.slideshow.openImg(imgelem.src);
+		document.slideshow.openImg(image_key(imgelem));
 	});
 
 	imgelem.setAttribute('id', src);
@@ -383,24 +537,265 @@ for (var i = 0; i < _imgelems.length; i++) {
 	bar.appendChild(imgelem);
 }
 
+load_deferred_images();
+
 let _hashinfo = parse_hash();
-if (_hashinfo.pageview === true) {
+if (_hashinfo.pageview === true && _hashinfo.imgpath.startsWith('embedded-')) {
+	document.slideshow.openImg('#' + _hashinfo.imgpath);
+} else if (_hashinfo.pageview === true) {
 	let imgurl = new URL(_hashinfo.imgpath, window.location.protocol + "//" + window.location.host + window.location.pathname);
 	document.slideshow.openImg(imgurl.href);
 }
 
 
-</script>
-</html>
 '''
 
+POST_INDEX = '\n<script type="text/javascript">\n' + VIEWER_SCRIPT + '</script>\n</html>\n'
+SHARED_PREAMBLE = '\n<!DOCTYPE html>\n<html>\n<link rel="stylesheet" href="{stylesheet}">\n'
+SHARED_POST_INDEX = '\n<script type="text/javascript" src="{script}"></script>\n</html>\n'
+
 DEFAULT_IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff']
+DEFAULT_ARCHIVE_EXTENSIONS = ['.cbz', '.zip']
+DEFAULT_BLOCKED_NAMES = ['.DS_Store', 'Thumbs.db', '__MACOSX', 'desktop.ini']
+
+# The folders of CBZ files and of images found by a single scan of a directory
+# tree; see scan_filetrees().
+FileTrees = collections.namedtuple('FileTrees', ['archives', 'images'])
+
+# The kinds of worker pool which mirror_unzip_cbz() can extract CBZ files with.
+EXECUTOR_KINDS = ('process', 'thread')
+
+# The size in bytes of the buffer images are copied through as they're
+# extracted or copied into the destination directory.
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# The size in bytes from which mirror_unzip_cbz() splits the images of a CBZ
+# file between its workers, rather than giving the whole file to one.
+SPLIT_ARCHIVE_SIZE = 256 * 1024 * 1024
+
+# The number of bytes of an image which are base64 encoded at a time when
+# writing a data URI; a multiple of 3, so that chunks encode without padding.
+DATAURI_CHUNK_SIZE = 3 * 64 * 1024
+
+# Name of the directory within the destination directory where generated
+# files which aren't pages of comics (such as cached data URIs) are kept.
+CACHE_DIRNAME = '.chvg_cache'
+
+# The number of images at the top of each index.html which are loaded straight
+# away; those after them are only loaded as they're scrolled to.
+EAGER_PAGES = 3
+
+# The number of images from each folder which are previewed in
+# BROWSE_COMIC_HERE.html
+BROWSE_PREVIEW_COUNT = 3
+
+# The ways the listing in BROWSE_COMIC_HERE.html may be split into several
+# pages; see create_comic_browse_htmlfiles().
+BROWSE_MODES = ('single', 'toplevel', 'paged')
+BROWSE_PAGE_SIZE = 500
+
+# The shard which lists the images at the root of the tree in the 'toplevel'
+# browse mode, as they're in no top level directory.
+TOPLEVEL_BROWSE_SHARD = '(top level)'
+
+# The formats thumbnails may be saved as, and the file suffix for each.
+THUMBNAIL_FORMATS = {'webp': '.webp', 'jpeg': '.jpg', 'png': '.png'}
+
+# The formats a Transcoder may transcode images to, and the suffix of each.
+TRANSCODE_FORMATS = {'webp': '.webp', 'avif': '.avif'}
+
+# Name of the file within CACHE_DIRNAME in which a Transcoder records the
+# settings images were last transcoded with.
+TRANSCODE_SETTINGS_FILENAME = 'transcode.json'
+
+# The widths in pixels of the smaller copies of each image made by
+# TierGenerator, for browsers to choose between with 'srcset'.
+DEFAULT_TIER_WIDTHS = (480, 960, 1600)
+
+# The suffixes of images which browsers can show, whose smaller copies are
+# made in the same format. Copies of other images (such as TIFF and BMP
+# pages) are made as JPEGs.
+TIER_WEB_SUFFIXES = ('.jpg', '.jpeg', '.png', '.webp', '.avif')
+
+# The ways copy_image_file() can copy images into the destination directory.
+LINK_MODES = ('copy', 'hardlink', 'reflink', 'symlink', 'auto')
+
+# The ioctl request number which clones a file on Linux; see ioctl_ficlone(2).
+FICLONE = 0x40049409
+
+# Name of the file which index_cbz() saves in place of the extracted images of
+# a CBZ file, recording where each image lies within the CBZ file.
+ARCHIVE_INDEX_FILENAME = '.chvg_archive.json'
+
+# The layout of the local file header which precedes each member of a zip file.
+ZIP_LOCAL_HEADER_FORMAT = '<4s2B4HL2L2H'
+ZIP_LOCAL_HEADER_SIZE = struct.calcsize(ZIP_LOCAL_HEADER_FORMAT)
+
+# What's recorded by functions which accept a Stats object as `stats`.
+STATS_COUNTERS = {
+    'archives_opened': 'CBZ files opened to extract or index their images',
+    'archives_skipped': 'CBZ files skipped as unchanged since the last run',
+    'files_extracted': 'images extracted from CBZ files',
+    'files_copied': 'images copied from folders (including by reflink)',
+    'files_linked': 'images hard or symbolically linked from folders',
+    'files_skipped': 'images not extracted or copied as they were up to date',
+    'files_deduplicated': 'images linked to an identical image already in the content store',
+    'bytes_deduplicated': 'bytes not written as they were already in the content store',
+    'bytes_read': 'bytes read from CBZ files (compressed) and image folders',
+    'bytes_written': 'bytes of images and HTML written into the destination',
+    'pages_written': 'HTML files written',
+    'pages_skipped': 'HTML files not written as they were up to date',
+    'datauris_encoded': 'images base64 encoded into data URIs',
+    'datauri_cache_hits': 'data URIs copied from the data URI cache',
+    'thumbnails_written': 'thumbnails created',
+    'thumbnails_skipped': 'thumbnails not created as they were up to date',
+    'files_transcoded': 'images transcoded into a smaller format',
+    'transcodes_skipped': 'images not transcoded as they were up to date',
+    'tiers_written': 'smaller copies of images created for srcset',
+    'tiers_skipped': 'smaller copies of images not created as they were up to date',
+    'tiers_removed': 'smaller copies of images removed as they were no longer used',
+    'sidecars_written': 'precompressed copies of pages written',
+    'sidecars_skipped': 'precompressed copies of pages not written as they were up to date',
+}
+STATS_TIMERS = {
+    'extract': 'reading and decompressing images from CBZ files, and writing them',
+    'copy': 'copying or linking images from folders',
+    'base64': 'encoding images as data URIs, or copying them from the cache',
+    'compress': 'compressing pages into precompressed copies',
+}
+
+# The ways pages may include STYLESHEET and VIEWER_SCRIPT; see
+# write_shared_assets().
+ASSET_MODES = ('inline', 'shared')
+
+# The names of the files, in the root of the destination directory, which hold
+# STYLESHEET and VIEWER_SCRIPT when they're shared; see write_shared_assets().
+SharedAssets = collections.namedtuple('SharedAssets', ['stylesheet', 'script'])
+SHARED_ASSET_PATTERN = re.compile(r'^chvg\.[0-9a-f]{16}\.(css|js)$')
+
+# The formats a PageCompressor may precompress pages in, and the suffix added to
+# the name of a page for each.
+PRECOMPRESS_FORMATS = {'gzip': '.gz', 'brotli': '.br'}
+
+# The number of items which may wait between two stages of run_pipeline().
+PIPELINE_QUEUE_SIZE = 16
+
+# How often, in seconds, a SourceWatcher checks the source directory for
+# changes, and for how long the source must go unchanged before the changes are
+# handled, so that a burst of changes is handled all at once.
+WATCH_INTERVAL = 2.0
+WATCH_DEBOUNCE = 5.0
+
+# Name of the file in the destination directory which records what was built
+# by previous runs, allowing unchanged comics to be skipped.
+MANIFEST_FILENAME = '.chvg_manifest.json'
 
 
 def dbg_p(*args, **kwargs):
     '''A debug-print function'''
-    now = datetime.now().astimezone()
-    print(now.isoformat(), *args, **kwargs, file=sys.stderr)
+    now = time.time()
+    second = int(now)
+    date, utcoffset = _timestamp_parts(second)
+    print(f'{date}.{int((now - second) * 1e6):06}{utcoffset}', *args, **kwargs, file=sys.stderr)
+
+
+@functools.lru_cache(maxsize=1)
+def _timestamp_parts(second):
+    '''Returns the local date and time of `second` (seconds since the epoch)
+    in ISO 8601 format, split into the part before the fraction of a second
+    and the UTC offset after it. Looking up the local timezone is slow, and
+    `dbg_p()` is often called many times a second, so the parts of the
+    current second are kept.'''
+    stamp = datetime.fromtimestamp(second).astimezone().isoformat()
+    return stamp[:19], stamp[19:]
+
+
+class Stats:
+    '''Counters and timers describing the work done during a run, for finding
+    out where a run spends its time. Counters (such as `'bytes_written'`)
+    and timers (in seconds, such as `'extract'`) are each identified by name.
+
+    Functions which accept a `stats` argument add to it as they work; see
+    `STATS_COUNTERS` and `STATS_TIMERS` for what they record. `main()` also
+    times each stage of a run under `'stage:<name>'`, and `mirror_unzip_cbz()`
+    times each CBZ file under `'archive:<relative path>'`.
+
+    Every addition is also passed to each hook added with `add_hook()`, as
+    `hook(kind, name, value)` where `kind` is `'count'` or `'time'`, so that
+    the numbers can be fed into other metrics systems as they're produced.
+    Hooks may be called from several threads at once.
+    '''
+
+    def __init__(self):
+        self.counters = collections.Counter()
+        self.timers = collections.Counter()
+        self.hooks = list()
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook):
+        '''Adds `hook` to be called with each addition to the stats.'''
+        self.hooks.append(hook)
+
+    def count(self, name, value=1):
+        '''Adds `value` to the counter `name`.'''
+        with self._lock:
+            self.counters[name] += value
+        for hook in self.hooks:
+            hook('count', name, value)
+
+    def add_time(self, name, seconds):
+        '''Adds `seconds` to the timer `name`.'''
+        with self._lock:
+            self.timers[name] += seconds
+        for hook in self.hooks:
+            hook('time', name, seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        '''A context manager which adds the time spent within it to the timer
+        `name`.'''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def merge(self, counters=None, timers=None):
+        '''Adds the counters and timers from other stats, given as
+        dictionaries, such as those collected by a worker of a pool.'''
+        for name, value in (counters or dict()).items():
+            self.count(name, value)
+        for name, seconds in (timers or dict()).items():
+            self.add_time(name, seconds)
+
+    def as_dict(self):
+        '''Returns the stats as a JSON-serializable dictionary.'''
+        with self._lock:
+            return {
+                'counters': dict(sorted(self.counters.items())),
+                'timers': {name: round(secs, 6) for name, secs in sorted(self.timers.items())},
+            }
+
+    def save(self, full_path):
+        '''Writes the stats to `full_path` as JSON.'''
+        with open(full_path, 'w') as statsfile:
+            json.dump(self.as_dict(), statsfile, indent=2)
+            statsfile.write('\n')
+
+
+@contextlib.contextmanager
+def _stage(stats, name, verbose=False):
+    '''Times the stage `name` of a run in `stats` (if it isn't None), logging
+    how long it took when `verbose` is set.'''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        if stats is not None:
+            stats.add_time('stage:' + name, seconds)
+        if verbose:
+            dbg_p(f"finished {name} in {seconds:.3f}s")
 
 
 def clean_namelist(namelist, allowed_extensions=None, blocked_names=None):
@@ -413,8 +808,9 @@ def clean_namelist(namelist, allowed_extensions=None, blocked_names=None):
     2. Each entry must not contain any of the strings present in the
        `blocked_names` parameter.
 
-    Note that all string comparisons are done case-insensitively by
-    lowercasing all strings at comparison time.
+    Note that all string comparisons are done case-insensitively. The
+    entries are filtered by a `NameFilter`, which is built once for each
+    combination of `allowed_extensions` and `blocked_names` and then reused.
 
     :param namelist: List of string names of files in a zipfile. Produced by
         `ZipFile.namelist()`
@@ -428,23 +824,61 @@ def clean_namelist(namelist, allowed_extensions=None, blocked_names=None):
     if allowed_extensions is None:
         allowed_extensions = DEFAULT_IMAGE_EXTENSIONS
     if blocked_names is None:
-        blocked_names = ['.DS_Store', 'Thumbs.db', '__MACOSX', 'desktop.ini']
-    newnamelist = list()
-    for x in namelist:
-        skip = False
-        for bad in blocked_names:
-            if bad.lower() in x.lower():
-                skip = True
-        if skip: continue
+        blocked_names = DEFAULT_BLOCKED_NAMES
+    return _name_filter(tuple(allowed_extensions), tuple(blocked_names)).filter(namelist)
+
+
+class NameFilter:
+    '''A filter of filenames, compiled once so that it can be applied to many
+    names cheaply. A name is allowed if it ends in one of the suffixes in
+    `allowed_extensions` and doesn't contain any of the strings in
+    `blocked_names`, ignoring case.
+
+    Each name is lowercased once. Its extension (from its last '.') is then
+    looked up in a set of the allowed extensions, and the blocked names are
+    all searched for at once with a single regular expression. Allowed
+    suffixes which aren't a single extension (such as `'.tar.gz'`, or `'png'`
+    without a dot) are matched against the end of the name instead.
+    '''
+
+    def __init__(self, allowed_extensions=None, blocked_names=None):
+        if allowed_extensions is None:
+            allowed_extensions = DEFAULT_IMAGE_EXTENSIONS
+        if blocked_names is None:
+            blocked_names = DEFAULT_BLOCKED_NAMES
+        suffixes = set(x.lower() for x in allowed_extensions)
+        self.extensions = frozenset(
+            x for x in suffixes if x.startswith('.') and x.count('.') == 1
+        )
+        self.other_suffixes = tuple(sorted(suffixes - self.extensions))
+        self.blocked = None
+        if blocked_names:
+            self.blocked = re.compile('|'.join(re.escape(x.lower()) for x in blocked_names))
+
+    def allows(self, name):
+        '''Returns True if the filter allows `name`.'''
+        return self.allows_lowered(name.lower())
+
+    def allows_lowered(self, lowered):
+        '''Like `allows()`, for a name which has already been lowercased.'''
+        dot = lowered.rfind('.')
+        if dot < 0 or lowered[dot:] not in self.extensions:
+            if not (self.other_suffixes and lowered.endswith(self.other_suffixes)):
+                return False
+        return self.blocked is None or self.blocked.search(lowered) is None
+
+    def filter(self, names):
+        '''Returns a list of the names in `names` which the filter allows,
+        in the same order.'''
+        allows_lowered = self.allows_lowered
+        return [x for x in names if allows_lowered(x.lower())]
 
-        skip = True
-        for req in allowed_extensions:
-            if x.lower().endswith(req.lower()):
-                skip = False
-        if skip: continue
 
-        newnamelist.append(x)
-    return newnamelist
+@functools.lru_cache(maxsize=32)
+def _name_filter(allowed_extensions, blocked_names):
+    '''Returns a NameFilter, built once for each combination of arguments,
+    which must be tuples.'''
+    return NameFilter(allowed_extensions, blocked_names)
 
 
 def build_filetree(source_path, suffix_allowlist=None):
@@ -479,24 +913,90 @@ def build_filetree(source_path, suffix_allowlist=None):
     '''
     if suffix_allowlist is None:
         suffix_allowlist = DEFAULT_IMAGE_EXTENSIONS
-    desired_files = dict()
-    for dirpath, _, files in os.walk(source_path):
-        reltpth = dirpath.replace(source_path, '')
-        reltpth = reltpth.lstrip('/')
-        zfiles = list()
-        for fs in files:
-            for suffix in suffix_allowlist:
-                if fs.lower().endswith(suffix):
-                    zfiles.append(fs)
-        if not zfiles: continue
-
-        if not reltpth in desired_files:
-            desired_files[reltpth] = list()
-        desired_files[reltpth].extend(zfiles)
-    # We want to sort files in directories by their human-indexed numerical file name
-    for reltpth in list(desired_files.keys()):
-        desired_files[reltpth] = sort_nicely(desired_files[reltpth])
-    return desired_files
+    return _scan_filetrees(source_path, [suffix_allowlist])[0]
+
+
+def scan_filetrees(source_path, archive_suffixes=None, image_suffixes=None):
+    '''Walks the directory tree at `source_path` a single time, returning a
+    `FileTrees` tuple of two dictionaries in the same form as those returned
+    by `build_filetree()`: `archives`, listing the CBZ files in each folder,
+    and `images`, listing the images in each folder. By default the suffixes
+    of CBZ files are `['.cbz', '.zip']` and the suffixes of images are those
+    in `DEFAULT_IMAGE_EXTENSIONS`.
+
+    The result may be passed as the `filetree` parameter of the other
+    functions, which saves each of them walking the tree again: ::
+
+        trees = scan_filetrees('/foo')
+        mirror_unzip_cbz('/foo', '/bar', filetree=trees.archives)
+    '''
+    if archive_suffixes is None:
+        archive_suffixes = DEFAULT_ARCHIVE_EXTENSIONS
+    if image_suffixes is None:
+        image_suffixes = DEFAULT_IMAGE_EXTENSIONS
+    return FileTrees(*_scan_filetrees(source_path, [archive_suffixes, image_suffixes]))
+
+
+def _scan_filetrees(source_path, suffix_allowlists):
+    '''Walks the directory tree at `source_path` with `os.scandir()`,
+    returning one dictionary (in the form returned by `build_filetree()`) for
+    each list of suffixes in `suffix_allowlists`. A file is placed in the
+    dictionary of the first list holding one of its suffixes. Like
+    `os.walk()`, symbolic links to directories are not followed. Directories
+    named `CACHE_DIRNAME` are skipped, as the images within them (such as
+    thumbnails) aren't pages of comics.'''
+    filters = [_name_filter(tuple(sfx), ()) for sfx in suffix_allowlists]
+    trees = [dict() for _ in filters]
+    pending = ['']
+    while pending:
+        reltpth = pending.pop()
+        try:
+            entries = list(os.scandir(path.join(source_path, reltpth)))
+        except OSError:
+            continue
+        found = [list() for _ in filters]
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                if not entry.is_symlink() and entry.name != CACHE_DIRNAME:
+                    pending.append(path.join(reltpth, entry.name))
+                continue
+            lowered = entry.name.lower()
+            for idx, name_filter in enumerate(filters):
+                if name_filter.allows_lowered(lowered):
+                    found[idx].append(entry.name)
+                    break
+        for tree, files in zip(trees, found):
+            # We want files in directories sorted by their human-indexed
+            # numerical file name
+            if files:
+                tree[reltpth] = sort_nicely(files)
+    return trees
+
+
+def merge_filetrees(*filetrees):
+    '''Combines dictionaries in the form returned by `build_filetree()` into
+    one, such as the trees returned by `mirror_unzip_cbz()` and
+    `mirror_images_directory()`. Files listed in more than one tree are only
+    listed once in the result.'''
+    merged = dict()
+    for tree in filetrees:
+        for reltpth, files in tree.items():
+            merged.setdefault(reltpth, set()).update(files)
+    return {reltpth: sort_nicely(files) for reltpth, files in merged.items()}
+
+
+def _filetree_from_paths(root, full_paths):
+    '''Builds a dictionary in the form returned by `build_filetree()` from a
+    list of full paths to files beneath the directory `root`.'''
+    tree = dict()
+    for full_path in full_paths:
+        reltpth, fname = path.split(path.relpath(full_path, root))
+        tree.setdefault(reltpth, list()).append(fname)
+    return {reltpth: sort_nicely(files) for reltpth, files in tree.items()}
 
 
 def create_image_datauri(full_imagepath):
@@ -506,7 +1006,10 @@ def create_image_datauri(full_imagepath):
     page with a "src" param like this `<img src="./path_to_img.png">`, an image
     may be directly embedded into the HTML via a data URI in the "src" param
     containing the binary contents of the image but base64 encoded. This
-    function is for creating said "data URIs".'''
+    function is for creating said "data URIs".
+
+    The whole data URI is held in memory; `write_image_datauri()` writes the
+    same data URI straight into a file instead.'''
     mtype, _ = mimetypes.guess_type(full_imagepath)
     b64data = None
     with open(full_imagepath, 'rb') as img:
@@ -516,7 +1019,235 @@ def create_image_datauri(full_imagepath):
     return datauri
 
 
-def mirror_unzip_cbz(source_path, dest_path, maintain_existing_images=False, verbose=False):
+def write_image_datauri(
+    full_imagepath, outfile, cache=None, chunk_size=DATAURI_CHUNK_SIZE, stats=None
+):
+    '''Writes the same data URI as `create_image_datauri()` into the open text
+    file `outfile`. The image is read and base64 encoded `chunk_size` bytes at
+    a time, so only a single chunk is ever held in memory. `chunk_size` must be
+    a multiple of 3, so that each encoded chunk can be written as is.
+
+    If a `DataURICache` is provided as `cache`, a data URI encoded by an
+    earlier call is copied from the cache rather than encoded again, and a
+    newly encoded data URI is stored in the cache as it's written.'''
+    if chunk_size % 3:
+        raise ValueError(f"chunk_size must be a multiple of 3, not {chunk_size}")
+    if stats is None:
+        _write_image_datauri(full_imagepath, outfile, cache, chunk_size)
+        return
+    with stats.timer('base64'):
+        cached = _write_image_datauri(full_imagepath, outfile, cache, chunk_size)
+    stats.count('datauri_cache_hits' if cached else 'datauris_encoded')
+
+
+def _write_image_datauri(full_imagepath, outfile, cache, chunk_size):
+    '''Writes the data URI for `write_image_datauri()`, returning True if it
+    was found in `cache`.'''
+    if cache is not None:
+        return cache.write(full_imagepath, outfile, chunk_size=chunk_size)
+    for piece in _encode_datauri(full_imagepath, chunk_size):
+        outfile.write(piece)
+    return False
+
+
+def _encode_datauri(full_imagepath, chunk_size):
+    '''Yields the pieces of the data URI for the image at `full_imagepath`,
+    encoding `chunk_size` bytes of the image at a time.'''
+    mtype, _ = mimetypes.guess_type(full_imagepath)
+    yield f'data:{mtype};charset=utf-8;base64,'
+    with open(full_imagepath, 'rb') as img:
+        for chunk in iter(lambda: img.read(chunk_size), b''):
+            yield base64.b64encode(chunk).decode('ascii')
+
+
+class DataURICache:
+    '''A directory of data URIs which have already been encoded, so that each
+    image only needs to be base64 encoded once, both within a run (such as
+    when an image is embedded in its "index.html" and in the
+    "BROWSE_COMIC_HERE.html" file) and across runs.
+
+    Entries are addressed by the full path, size and modification time of the
+    image they were encoded from, so an image which changes is encoded again.
+    Entries for images which have since changed are never read again, but are
+    not removed; deleting `cache_dir` empties the cache.
+    '''
+
+    def __init__(self, cache_dir):
+        self.cache_dir = path.abspath(cache_dir)
+
+    def entry_path(self, full_imagepath):
+        '''Returns the path where the data URI of the image at
+        `full_imagepath` is stored.'''
+        full_imagepath = path.abspath(full_imagepath)
+        st = os.stat(full_imagepath)
+        key = _hash_signature(full_imagepath, st.st_size, st.st_mtime_ns)
+        return path.join(self.cache_dir, key[:2], key + '.b64')
+
+    def write(self, full_imagepath, outfile, chunk_size=DATAURI_CHUNK_SIZE):
+        '''Writes the data URI of the image at `full_imagepath` into the open
+        text file `outfile`, encoding and storing it first if it isn't in the
+        cache. Returns True if it was already in the cache.'''
+        entry_path = self.entry_path(full_imagepath)
+        try:
+            cached = open(entry_path, 'r')
+        except FileNotFoundError:
+            pass
+        else:
+            with cached:
+                shutil.copyfileobj(cached, outfile, chunk_size)
+            return True
+        pathlib.Path(path.dirname(entry_path)).mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file which is moved into place once complete,
+        # so an interrupted run never leaves a truncated entry.
+        tmp_path = f'{entry_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as entry:
+            for piece in _encode_datauri(full_imagepath, chunk_size):
+                entry.write(piece)
+                outfile.write(piece)
+        os.replace(tmp_path, entry_path)
+        return False
+
+
+class BuildManifest:
+    '''A record, saved in the destination directory, of what a previous run
+    produced and what it produced it from. Each entry is stored under a string
+    key (such as `'cbz:path/to/volume01.cbz'`) and holds the signature of the
+    source the entry was built from, along with the paths (relative to the
+    destination directory) of the files which were produced from it.
+
+    The signature of a file is its size and modification time. When
+    `hash_contents` is set, the SHA-256 of its contents is also stored, and a
+    file whose size and modification time have changed but whose contents
+    haven't is still considered unchanged.
+
+    Entries are only written to disk when `save()` is called. Deleting the
+    manifest file causes the next run to rebuild everything.
+    '''
+    VERSION = 1
+
+    def __init__(self, root, hash_contents=False):
+        self.root = path.abspath(root)
+        self.hash_contents = hash_contents
+        self.entries = dict()
+        # Relative paths of destination directories whose contents were
+        # written to during this run.
+        self.changed_dirs = set()
+
+    @property
+    def manifest_path(self):
+        return path.join(self.root, MANIFEST_FILENAME)
+
+    @classmethod
+    def load(cls, root, hash_contents=False):
+        '''Returns the BuildManifest saved within the directory `root`, or an
+        empty BuildManifest if there isn't one or it can't be read.'''
+        manifest = cls(root, hash_contents=hash_contents)
+        try:
+            with open(manifest.manifest_path, 'r') as mfile:
+                saved = json.load(mfile)
+        except (OSError, ValueError):
+            return manifest
+        if saved.get('version') == cls.VERSION:
+            manifest.entries = saved.get('entries', dict())
+        return manifest
+
+    def save(self):
+        '''Writes the manifest to disk. The manifest file is replaced in one
+        step, so an interrupted save never leaves a truncated manifest.'''
+        pathlib.Path(self.root).mkdir(parents=True, exist_ok=True)
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as mfile:
+            json.dump({'version': self.VERSION, 'entries': self.entries}, mfile)
+        os.replace(tmp_path, self.manifest_path)
+
+    def source_of(self, key):
+        '''Returns the signature recorded for `key`, or None.'''
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        return entry['source']
+
+    def outputs_of(self, key):
+        '''Returns the list of outputs recorded for `key`.'''
+        entry = self.entries.get(key)
+        if entry is None:
+            return list()
+        return entry['outputs']
+
+    def is_current(self, key, signature):
+        '''Returns True if `key` was last recorded with `signature`.'''
+        return key in self.entries and self.source_of(key) == signature
+
+    def compare_file(self, full_path, previous):
+        '''Returns a tuple of `(unchanged, signature)`, where `signature` is
+        the signature of the file at `full_path` and `unchanged` is True if
+        that file matches the `previous` signature.'''
+        st = os.stat(full_path)
+        signature = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+        if previous is None:
+            if self.hash_contents:
+                signature['sha256'] = _hash_file(full_path)
+            return False, signature
+        if previous['size'] == st.st_size and previous['mtime_ns'] == st.st_mtime_ns:
+            if 'sha256' in previous:
+                signature['sha256'] = previous['sha256']
+            return True, signature
+        if not self.hash_contents:
+            return False, signature
+        signature['sha256'] = _hash_file(full_path)
+        return signature['sha256'] == previous.get('sha256'), signature
+
+    def check_file(self, key, full_path):
+        '''Like `compare_file()`, comparing against the signature recorded for
+        `key`.'''
+        return self.compare_file(full_path, self.source_of(key))
+
+    def record(self, key, signature, outputs):
+        '''Records that `outputs` were produced from a source with
+        `signature`. Returns the outputs previously recorded for `key` which
+        are not in `outputs`, so the caller may remove them.'''
+        previous = self.outputs_of(key)
+        self.entries[key] = {'source': signature, 'outputs': list(outputs)}
+        current = set(outputs)
+        return [x for x in previous if x not in current]
+
+    def mark_changed(self, reltpth):
+        '''Notes that files within the destination directory `reltpth` were
+        written to during this run.'''
+        self.changed_dirs.add(reltpth)
+
+
+def _hash_file(full_path, bufsize=1024 * 1024):
+    '''Returns the hex SHA-256 digest of the contents of the file at
+    `full_path`.'''
+    digest = hashlib.sha256()
+    with open(full_path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(bufsize), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _hash_signature(*parts):
+    '''Returns a short, stable digest of the JSON-serializable `parts`.'''
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def mirror_unzip_cbz(
+    source_path,
+    dest_path,
+    maintain_existing_images=False,
+    verbose=False,
+    jobs=1,
+    executor='process',
+    manifest=None,
+    filetree=None,
+    extract=True,
+    stats=None,
+    store=None,
+    split_size=SPLIT_ARCHIVE_SIZE,
+    bufsize=COPY_BUFFER_SIZE,
+    use_mmap=False,
+):
     ''' Replicates a directory structure with CBZ files in it into a new
     location, but with the CBZ files expanded into directories with only the
     images from each CBZ. So if we have a `source_path` to a folder with the
@@ -551,7 +1282,45 @@ def mirror_unzip_cbz(source_path, dest_path, maintain_existing_images=False, ver
                     img01.png
                 issue04/
                     img01.png
+
+    The extraction of each archive is independent of every other archive, so
+    when `jobs` is greater than 1 the archives are extracted concurrently.
+    Archives of at least `split_size` bytes (unless it's None) are also split
+    into as many slices of their images as there are `jobs`, each extracted
+    by a worker with its own handle on the archive, so a single huge archive
+    doesn't leave the other workers idle while it's extracted. By
+    default a pool of processes is used, since DEFLATE decompression is CPU
+    bound; passing `executor='thread'` uses a pool of threads instead, which
+    is cheaper when most archives are stored (uncompressed) and the run is
+    bound by I/O. The files written are the same regardless of `jobs`, and
+    when `verbose` is set the log lines of each archive are printed together
+    and in the same order as a serial run would print them.
+
+    If a `BuildManifest` is provided as `manifest`, CBZ files which haven't
+    changed since the manifest was last saved are not opened at all.
+
+    The CBZ files to extract are found with `build_filetree()`, unless a
+    dictionary of that form is passed as `filetree`. Returns a dictionary of
+    the same form, listing the images in `dest_path` which were extracted (or
+    which were kept, if they're unchanged), so that later stages need not walk
+    `dest_path` to find them.
+
+    If `extract` is False, the images are not extracted at all. Instead, each
+    CBZ file is indexed with `index_cbz()`, which creates the directories the
+    images would have been extracted into, and the returned dictionary lists
+    the images as though they had been. Those images can then be viewed
+    through `serve()`, which reads them straight out of the CBZ files.
+
+    If a `ContentStore` is provided as `store`, images are extracted by way
+    of it, and `bufsize` and `use_mmap` are as for `extract_cbz()`.
+
+    If a `Stats` is provided as `stats`, the work done is added to it, and
+    each CBZ file is timed under `'archive:<relative path>'`. Workers of a
+    pool collect their own stats, which are added to `stats` as each CBZ
+    file is finished.
     '''
+    if executor not in EXECUTOR_KINDS:
+        raise ValueError(f"executor must be one of {EXECUTOR_KINDS}, not {executor!r}")
     if verbose:
         dbg_p(f"extracting cbz files from '{source_path}' into '{dest_path}'")
     # Get a directory structure of all folders with cbz files in them, as a
@@ -561,7 +1330,9 @@ def mirror_unzip_cbz(source_path, dest_path, maintain_existing_images=False, ver
     # for all these relative paths.
     source_path = path.abspath(source_path)
     dest_path = path.abspath(dest_path)
-    cbz_folders = build_filetree(source_path, suffix_allowlist=['.cbz', '.zip'])
+    cbz_folders = filetree
+    if cbz_folders is None:
+        cbz_folders = build_filetree(source_path, suffix_allowlist=DEFAULT_ARCHIVE_EXTENSIONS)
     if verbose:
         for pth, files in cbz_folders.items():
             dbg_p(f"{pth}:")
@@ -571,48 +1342,691 @@ def mirror_unzip_cbz(source_path, dest_path, maintain_existing_images=False, ver
     # Actually create the mirrored directory structure, then create directories
     # for each zipfile, then unzip all images into the directory for each
     # zipfile.
+    extractions = list()
+    manifest_entries = list()
+    archive_names = list()
+    written = list()
     for reltpth, zfiles in cbz_folders.items():
         full_oldpath = path.join(source_path, reltpth)
         full_newpath = path.join(dest_path, reltpth)
-        if verbose:
-            dbg_p(f"\textracting cbz files from subdir '{full_oldpath}' into '{full_newpath}'")
         pathlib.Path(full_newpath).mkdir(parents=True, exist_ok=True)
+        subdir_logline = f"\textracting cbz files from subdir '{full_oldpath}' into '{full_newpath}'"
         for zfname in zfiles:
-            full_path_to_zf = path.join(full_oldpath, zfname)
+            extraction, manifest_entry, outputs = _plan_cbz_extraction(
+                source_path,
+                dest_path,
+                reltpth,
+                zfname,
+                maintain_existing_images=maintain_existing_images,
+                verbose=verbose,
+                manifest=manifest,
+                extract=extract,
+                stats=stats,
+                store=store,
+                bufsize=bufsize,
+                use_mmap=use_mmap,
+            )
+            if extraction is None:
+                written.extend(outputs)
+                continue
+            if verbose and subdir_logline:
+                extraction[0].insert(0, subdir_logline)
+                subdir_logline = None
+            extractions.append(extraction)
+            manifest_entries.append(manifest_entry)
+            archive_names.append(path.join(reltpth, zfname))
+
+    pool = None
+    parts = [[e] for e in extractions]
+    if jobs is not None and jobs > 1:
+        parts = [_split_extraction(e, split_size, jobs) for e in extractions]
+    if jobs is None or jobs <= 1 or sum(len(x) for x in parts) <= 1:
+        # Log as each CBZ file is extracted, rather than once it's finished.
+        results = ([_extract_cbz_buffered(e, log=dbg_p)] for e in extractions)
+    else:
+        pool_cls = ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+        pool = pool_cls(max_workers=jobs)
+        # map() yields results in submission order, so the buffered log lines
+        # of each archive are printed where a serial run would have printed
+        # them, and never interleaved with the lines of another archive.
+        flat_results = pool.map(_extract_cbz_buffered, [x for y in parts for x in y])
+        results = ([next(flat_results) for _ in x] for x in parts)
+    try:
+        for archive_name, manifest_entry, result in zip(archive_names, manifest_entries, results):
+            written.extend(
+                _finish_cbz_extraction(
+                    archive_name,
+                    manifest_entry,
+                    _merge_extraction_results(result),
+                    manifest,
+                    stats,
+                )
+            )
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return _filetree_from_paths(dest_path, written)
+
+
+def _plan_cbz_extraction(
+    source_path,
+    dest_path,
+    reltpth,
+    zfname,
+    maintain_existing_images=False,
+    verbose=False,
+    manifest=None,
+    extract=True,
+    stats=None,
+    store=None,
+    bufsize=COPY_BUFFER_SIZE,
+    use_mmap=False,
+):
+    '''Works out how `mirror_unzip_cbz()` is to extract the CBZ file `zfname`
+    in the folder `reltpth` of `source_path`. Returns a tuple of
+    `(extraction, manifest_entry, outputs)`. If the CBZ file hasn't changed
+    since `manifest` was saved, `extraction` is None and `outputs` lists the
+    full paths of the images kept from before. Otherwise, `extraction` is to
+    be passed to `_extract_cbz_buffered()`, and its result along with
+    `manifest_entry` to `_finish_cbz_extraction()`.'''
+    full_path_to_zf = path.join(source_path, reltpth, zfname)
 
-            # We want the name of the folder where we'll put the images to be
-            # the same as the name of the zipped file itself, but without the
-            # file extension
-            foldername_for_images = '.'.join(path.split(full_path_to_zf)[-1].split('.')[:-1])
-            full_new_imgspath = path.join(full_newpath, foldername_for_images)
+    # We want the name of the folder where we'll put the images to be
+    # the same as the name of the zipped file itself, but without the
+    # file extension
+    foldername_for_images = '.'.join(zfname.split('.')[:-1])
+    full_new_imgspath = path.join(dest_path, reltpth, foldername_for_images)
+    archive_index = path.join(full_new_imgspath, ARCHIVE_INDEX_FILENAME)
+    mode = 'extract' if extract else 'index'
+    manifest_entry = None
+    if manifest is not None:
+        key = 'cbz:' + path.join(reltpth, zfname)
+        unchanged, signature = manifest.check_file(key, full_path_to_zf)
+        # A CBZ file which was indexed must be extracted when indexing is
+        # turned off, and the other way around.
+        unchanged = unchanged and manifest.source_of(key).get('mode', 'extract') == mode
+        signature['mode'] = mode
+        outputs = [path.join(manifest.root, x) for x in manifest.outputs_of(key)]
+        if unchanged:
+            # Images of indexed CBZ files exist only within the CBZ file.
+            expected = outputs if extract else [archive_index]
+            unchanged = path.isdir(full_new_imgspath) and all(path.isfile(x) for x in expected)
+        if unchanged:
             if verbose:
-                dbg_p(f"\t\tzfname               : {zfname}")
-                dbg_p(f"\t\tfull path to zipfile : {full_path_to_zf}")
-                dbg_p(f"\t\tfoldername_for_images: {foldername_for_images}")
-                dbg_p(f"\t\tfull_new_imgspath    : {full_new_imgspath}")
-            pathlib.Path(full_new_imgspath).mkdir(parents=True, exist_ok=True)
-            zfp = zipfile.ZipFile(full_path_to_zf)
-            for compr_img_path in clean_namelist(zfp.namelist()):
-                # Ensure that we maintain the directory structure within the
-                # zip file in addition to the files themselves.
-                compr_img_dirname = path.dirname(compr_img_path)
-                full_new_image_dirname = path.join(full_new_imgspath, compr_img_dirname)
-                full_new_image_path = path.join(full_new_imgspath, compr_img_path)
-                if verbose:
-                    dbg_p(f"\t\t\tcompr_img_path         : {compr_img_path}")
-                    dbg_p(f"\t\t\tcompr_img_dirname      : {compr_img_dirname}")
-                    dbg_p(f"\t\t\tfull_new_image_dirname : {full_new_image_dirname}")
-                    dbg_p(f"\t\t\tfull_new_image_path    : {full_new_image_path}")
-                if maintain_existing_images:
-                    if path.isfile(full_new_image_path):
-                        continue
+                dbg_p(f"\tskipping unchanged cbz file '{full_path_to_zf}'")
+            if stats is not None:
+                stats.count('archives_skipped')
+                stats.count('files_skipped', len(outputs))
+            return None, None, outputs
+        manifest_entry = (key, signature)
+    if extract and path.isfile(archive_index):
+        # The images are about to be extracted, so they're no longer to be
+        # read out of the CBZ file when served.
+        os.remove(archive_index)
+    loglines = list()
+    if verbose:
+        loglines.append(f"\t\tzfname               : {zfname}")
+        loglines.append(f"\t\tfull path to zipfile : {full_path_to_zf}")
+        loglines.append(f"\t\tfoldername_for_images: {foldername_for_images}")
+        loglines.append(f"\t\tfull_new_imgspath    : {full_new_imgspath}")
+    options = {'store': store}
+    if extract:
+        options.update(bufsize=bufsize, use_mmap=use_mmap)
+    extraction = (
+        loglines,
+        extract_cbz if extract else index_cbz,
+        full_path_to_zf,
+        full_new_imgspath,
+        maintain_existing_images,
+        verbose,
+        options,
+    )
+    return extraction, manifest_entry, list()
+
+
+def _finish_cbz_extraction(archive_name, manifest_entry, result, manifest=None, stats=None):
+    '''Handles the `result` of `_extract_cbz_buffered()` for the CBZ file
+    `archive_name`: prints its log lines, adds its stats to `stats`, and
+    records it in `manifest`. Returns the full paths of the images
+    extracted.'''
+    loglines, outputs, counters, timers, seconds = result
+    for line in loglines:
+        dbg_p(line)
+    if stats is not None:
+        stats.merge(counters, timers)
+        stats.add_time('archive:' + archive_name, seconds)
+    if manifest_entry is not None:
+        key, signature = manifest_entry
+        relative_outputs = [path.relpath(x, manifest.root) for x in outputs]
+        _remove_stale_outputs(manifest, manifest.record(key, signature, relative_outputs))
+        for reltpth in set(path.dirname(x) for x in relative_outputs):
+            manifest.mark_changed(reltpth)
+    return outputs
+
+
+def extract_cbz(
+    full_path_to_zf,
+    full_new_imgspath,
+    maintain_existing_images=False,
+    verbose=False,
+    log=None,
+    stats=None,
+    store=None,
+    members=None,
+    bufsize=COPY_BUFFER_SIZE,
+    use_mmap=False,
+):
+    '''Extracts the images within the single CBZ file `full_path_to_zf` into
+    the directory `full_new_imgspath`, maintaining the directory structure
+    within the CBZ file. Only the files allowed by `clean_namelist()` are
+    extracted, or only those named in `members` if it's given (such as to
+    extract a slice of a large CBZ file). When `verbose` is set, each log
+    line is passed to `log`, which defaults to `dbg_p`. Returns the list of
+    full paths to the images which are now in `full_new_imgspath`.
+
+    If `maintain_existing_images` is set, images which were already extracted
+    are kept rather than extracted again, so long as they're the same size
+    and have the same CRC as the image in the CBZ file (see
+    `_member_is_current()`).
+
+    If a `ContentStore` is provided as `store`, each image is extracted by
+    way of it with `ContentStore.put()`, so an image identical to one already
+    stored is linked to rather than written again.
+
+    Images are copied out `bufsize` bytes at a time. If `use_mmap` is set,
+    the CBZ file is memory mapped, and each stored (uncompressed) image is
+    written straight from its slice of the map in a single call, after its
+    CRC is checked; compressed images are still read through `zipfile`.
+
+    If a `Stats` is provided as `stats`, the work done is added to it.'''
+    if log is None:
+        log = dbg_p
+    if stats is None:
+        stats = Stats()
+    start = time.perf_counter()
+    pathlib.Path(full_new_imgspath).mkdir(parents=True, exist_ok=True)
+    with contextlib.ExitStack() as stack:
+        zfp = stack.enter_context(zipfile.ZipFile(full_path_to_zf))
+        stats.count('archives_opened')
+        mapped = None
+        if use_mmap:
+            rawfp = stack.enter_context(open(full_path_to_zf, 'rb'))
+            mapped = stack.enter_context(mmap.mmap(rawfp.fileno(), 0, access=mmap.ACCESS_READ))
+        outputs = _extract_members(
+            zfp,
+            mapped,
+            full_new_imgspath,
+            clean_namelist(zfp.namelist()) if members is None else members,
+            maintain_existing_images=maintain_existing_images,
+            verbose=verbose,
+            log=log,
+            stats=stats,
+            store=store,
+            bufsize=bufsize,
+        )
+    stats.add_time('extract', time.perf_counter() - start)
+    return outputs
+
+
+def _extract_members(
+    zfp,
+    mapped,
+    full_new_imgspath,
+    members,
+    maintain_existing_images=False,
+    verbose=False,
+    log=None,
+    stats=None,
+    store=None,
+    bufsize=COPY_BUFFER_SIZE,
+):
+    '''Extracts `members` of the open zip file `zfp` (which is memory mapped
+    as `mapped`, unless it's None) for `extract_cbz()`, returning the list of
+    full paths to the images.'''
+    outputs = list()
+    for compr_img_path in members:
+        # Ensure that we maintain the directory structure within the
+        # zip file in addition to the files themselves.
+        compr_img_dirname = path.dirname(compr_img_path)
+        full_new_image_dirname = path.join(full_new_imgspath, compr_img_dirname)
+        full_new_image_path = path.join(full_new_imgspath, compr_img_path)
+        if verbose:
+            log(f"\t\t\tcompr_img_path         : {compr_img_path}")
+            log(f"\t\t\tcompr_img_dirname      : {compr_img_dirname}")
+            log(f"\t\t\tfull_new_image_dirname : {full_new_image_dirname}")
+            log(f"\t\t\tfull_new_image_path    : {full_new_image_path}")
+        outputs.append(full_new_image_path)
+        info = zfp.getinfo(compr_img_path)
+        if maintain_existing_images:
+            if _member_is_current(info, full_new_image_path):
+                stats.count('files_skipped')
+                continue
+
+        pathlib.Path(full_new_image_dirname).mkdir(parents=True, exist_ok=True)
+        stats.count('files_extracted')
+        stats.count('bytes_read', info.compress_size)
+        if (
+            mapped is not None and info.compress_type == zipfile.ZIP_STORED
+            and not info.flag_bits & 0x1
+        ):
+            offset = _member_data_offset(mapped, info)
+            if offset + info.file_size > len(mapped):
+                raise zipfile.BadZipFile(f"Truncated file {info.filename!r}")
+            with memoryview(mapped) as whole, whole[offset:offset + info.file_size] as data:
+                if zlib.crc32(data) != info.CRC:
+                    raise zipfile.BadZipFile(f"Bad CRC-32 for file {info.filename!r}")
+                _write_extracted(data, full_new_image_path, store, bufsize, stats)
+            continue
+        with zfp.open(info) as source:
+            _write_extracted(source, full_new_image_path, store, bufsize, stats)
+    return outputs
+
+
+def _write_extracted(source, full_new_image_path, store, bufsize, stats):
+    '''Writes an image being extracted, read from either the file object or
+    the bytes-like object `source`, to `full_new_image_path`, by way of
+    `store` if it isn't None.'''
+    if store is not None:
+        store.put(source, full_new_image_path, stats=stats, bufsize=bufsize)
+        return
+    # Remove what's there rather than writing over it, as it may be a link
+    # into a content store from an earlier run.
+    if path.lexists(full_new_image_path):
+        os.remove(full_new_image_path)
+    with open(full_new_image_path, 'wb') as target:
+        if isinstance(source, memoryview):
+            target.write(source)
+            size = len(source)
+        else:
+            # Have to manually copy only the file out of it's old location and into the new one.
+            shutil.copyfileobj(source, target, bufsize)
+            size = target.tell()
+    stats.count('bytes_written', size)
+
+
+def _member_data_offset(fp, info):
+    '''Returns the offset within the zip file open as `fp` (a file object or
+    memory map) of the data of the member described by `info`. The local
+    header before each member's data may hold a different 'extra' field than
+    the central directory, so it must be read to learn where the data
+    starts.'''
+    fp.seek(info.header_offset)
+    header = struct.unpack(ZIP_LOCAL_HEADER_FORMAT, fp.read(ZIP_LOCAL_HEADER_SIZE))
+    return info.header_offset + ZIP_LOCAL_HEADER_SIZE + header[-2] + header[-1]
+
+
+def _member_is_current(info, full_new_image_path, bufsize=1024 * 1024):
+    '''Returns True if the file at `full_new_image_path` holds the same bytes
+    as the zip member described by `info`. The size and CRC recorded in the
+    zip file are compared to those of the existing file, so the member itself
+    is never decompressed, and the existing file is only read if its size is
+    right.'''
+    try:
+        if os.stat(full_new_image_path).st_size != info.file_size:
+            return False
+        crc = 0
+        with open(full_new_image_path, 'rb') as existing:
+            for chunk in iter(lambda: existing.read(bufsize), b''):
+                crc = zlib.crc32(chunk, crc)
+    except OSError:
+        return False
+    return crc == info.CRC
+
+
+def _extract_cbz_buffered(extraction, log=None):
+    '''Runs `extract_cbz()` (or `index_cbz()`) within a worker of a pool.
+    Rather than printing them, the log lines for the CBZ file are collected
+    and returned alongside the paths of the extracted images, so the caller
+    can print them all at once. If `log` is provided, lines are passed to it
+    instead. The counters and timers of the work done are returned as well,
+    along with the time taken, as a worker's `Stats` can't be shared with the
+    caller.'''
+    loglines, extract_fn, *args, options = extraction
+    stats = Stats()
+    if log is not None:
+        for line in loglines:
+            log(line)
+        loglines = list()
+    else:
+        loglines = list(loglines)
+        log = loglines.append
+    start = time.perf_counter()
+    outputs = extract_fn(*args, log=log, stats=stats, **options)
+    seconds = time.perf_counter() - start
+    return loglines, outputs, dict(stats.counters), dict(stats.timers), seconds
+
+
+def _split_extraction(extraction, split_size, parts):
+    '''Splits `extraction` (as returned by `_plan_cbz_extraction()`) into at
+    most `parts` extractions of contiguous, disjoint slices of the images in
+    the CBZ file, of roughly equal uncompressed size, if the CBZ file is at
+    least `split_size` bytes. Returns a list of the extractions, which is
+    just `[extraction]` if it isn't split. Only the first slice keeps the
+    log lines of the CBZ file.'''
+    loglines, extract_fn, full_path_to_zf, *args, options = extraction
+    if extract_fn is not extract_cbz or split_size is None or parts <= 1:
+        return [extraction]
+    if os.stat(full_path_to_zf).st_size < split_size:
+        return [extraction]
+    with zipfile.ZipFile(full_path_to_zf) as zfp:
+        infos = [zfp.getinfo(x) for x in clean_namelist(zfp.namelist())]
+    parts = min(parts, len(infos))
+    if parts <= 1:
+        return [extraction]
+    target = sum(x.file_size for x in infos) / parts
+    slices = [list()]
+    done = 0
+    for info in infos:
+        # Start the next slice once this one has its share.
+        if done >= target * len(slices) and len(slices) < parts:
+            slices.append(list())
+        slices[-1].append(info.filename)
+        done += info.file_size
+    return [
+        (
+            loglines if not idx else list(),
+            extract_fn,
+            full_path_to_zf,
+            *args,
+            dict(options, members=members),
+        ) for idx, members in enumerate(slices)
+    ]
+
+
+def _merge_extraction_results(results):
+    '''Combines the results of `_extract_cbz_buffered()` for the slices of a
+    single CBZ file (see `_split_extraction()`), in order, into the result the
+    whole CBZ file would have had. The slices are extracted at the same time,
+    so the time taken is that of the slowest.'''
+    if len(results) == 1:
+        return results[0]
+    loglines, outputs = list(), list()
+    counters, timers = collections.Counter(), collections.Counter()
+    for part_loglines, part_outputs, part_counters, part_timers, _ in results:
+        loglines.extend(part_loglines)
+        outputs.extend(part_outputs)
+        counters.update(part_counters)
+        timers.update(part_timers)
+    seconds = max(x[-1] for x in results)
+    return loglines, outputs, dict(counters), dict(timers), seconds
+
+
+def index_cbz(
+    full_path_to_zf,
+    full_new_imgspath,
+    maintain_existing_images=False,
+    verbose=False,
+    log=None,
+    stats=None,
+    store=None,
+):
+    '''The counterpart of `extract_cbz()` which doesn't extract anything.
+    Instead, the directories the images would be extracted into are created,
+    and an index of where the images allowed by `clean_namelist()` are within
+    the CBZ file is saved in `full_new_imgspath` as `ARCHIVE_INDEX_FILENAME`.
+    The index records the offset of the (possibly compressed) bytes of each
+    image, so that `serve()` can read an image by seeking straight to it.
+    Returns the list of full paths where the images would have been
+    extracted to.
+
+    `maintain_existing_images` and `store` are accepted for symmetry with
+    `extract_cbz()` and have no effect.'''
+    if log is None:
+        log = dbg_p
+    if stats is not None:
+        stats.count('archives_opened')
+    pathlib.Path(full_new_imgspath).mkdir(parents=True, exist_ok=True)
+    st = os.stat(full_path_to_zf)
+    members = dict()
+    outputs = list()
+    with zipfile.ZipFile(full_path_to_zf) as zfp, open(full_path_to_zf, 'rb') as rawfp:
+        for compr_img_path in clean_namelist(zfp.namelist()):
+            info = zfp.getinfo(compr_img_path)
+            full_new_image_path = path.join(full_new_imgspath, compr_img_path)
+            if verbose:
+                log(f"\t\t\tindexing compr_img_path : {compr_img_path}")
+            members[compr_img_path] = {
+                'offset': _member_data_offset(rawfp, info),
+                'compress_type': info.compress_type,
+                'compress_size': info.compress_size,
+                'file_size': info.file_size,
+                'crc': info.CRC,
+            }
+            pathlib.Path(path.dirname(full_new_image_path)).mkdir(parents=True, exist_ok=True)
+            outputs.append(full_new_image_path)
+    archive_index = {
+        'archive': path.abspath(full_path_to_zf),
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'members': members,
+    }
+    with open(path.join(full_new_imgspath, ARCHIVE_INDEX_FILENAME), 'w') as indexfile:
+        json.dump(archive_index, indexfile)
+    return outputs
+
+
+def open_archive_member(archive_index, member, start=0, stop=None):
+    '''Opens the image `member` of the CBZ file described by `archive_index`
+    (as saved by `index_cbz()`) for reading, returning a binary file object.
+    Stored and deflated members are read by seeking straight to their data;
+    if the CBZ file has changed since it was indexed, or the member uses
+    another kind of compression, the member is found with `zipfile` instead.
+
+    Only the bytes of the image from `start` up to `stop` (or its end) are
+    read, such as to answer a request for a range of it. Stored members are
+    read from `start` by seeking straight to it. The CRC of the image is
+    checked once it has been read in full, and `zipfile.BadZipFile` raised if
+    it doesn't match.'''
+    info = archive_index['members'][member]
+    archive = archive_index['archive']
+    st = os.stat(archive)
+    unchanged = st.st_size == archive_index['size'] and st.st_mtime_ns == archive_index['mtime_ns']
+    if unchanged and info['compress_type'] in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+        return _ArchiveMemberReader(archive, info, start=start, stop=stop)
+    zfp = zipfile.ZipFile(archive)
+    # The member remains readable after the ZipFile is closed, and closes the
+    # CBZ file once it's closed itself.
+    member_fp = zfp.open(member)
+    zfp.close()
+    if start == 0 and stop is None:
+        return member_fp
+    with member_fp:
+        member_fp.seek(start)
+        return io.BytesIO(member_fp.read(None if stop is None else stop - start))
+
+
+class _ArchiveMemberReader(io.RawIOBase):
+    '''A readable file object over the bytes from `start` up to `stop` of a
+    single stored or deflated member of a zip file, whose data begins at the
+    offset recorded by `index_cbz()`. When the whole member is read, its CRC
+    is checked at the end, as `zipfile.ZipExtFile` does.'''
+
+    def __init__(self, archive, info, start=0, stop=None):
+        self._name = archive
+        self._fp = open(archive, 'rb')
+        offset = info['offset']
+        self._remaining_raw = info['compress_size']
+        self._decompressor = None
+        # The bytes of decompressed data still to be skipped, to reach `start`.
+        self._skip = start
+        if info['compress_type'] == zipfile.ZIP_DEFLATED:
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        else:
+            offset += start
+            self._remaining_raw -= start
+            self._skip = 0
+        self._fp.seek(offset)
+        if stop is None:
+            stop = info['file_size']
+        self._remaining = stop - start
+        # Indexes saved by earlier versions have no CRC to check.
+        self._crc = 0
+        self._expected_crc = None
+        if start == 0 and stop == info['file_size']:
+            self._expected_crc = info.get('crc')
+        self._pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        while not self._pending and self._remaining > 0:
+            if self._remaining_raw:
+                chunk = self._fp.read(min(max(len(buf), 64 * 1024), self._remaining_raw))
+                if not chunk:
+                    break
+                self._remaining_raw -= len(chunk)
+                if self._decompressor is None:
+                    data = chunk
+                else:
+                    data = self._decompressor.decompress(chunk)
+            elif self._decompressor is not None:
+                data = self._decompressor.flush()
+                self._decompressor = None
+            else:
+                break
+            if self._skip:
+                skipped = min(self._skip, len(data))
+                data = data[skipped:]
+                self._skip -= skipped
+            self._pending = data[:self._remaining]
+            self._remaining -= len(self._pending)
+            if self._expected_crc is not None:
+                self._crc = zlib.crc32(self._pending, self._crc)
+                if self._remaining == 0 and self._crc != self._expected_crc:
+                    raise zipfile.BadZipFile(f"Bad CRC-32 for a member of {self._name!r}")
+        count = min(len(buf), len(self._pending))
+        buf[:count] = self._pending[:count]
+        self._pending = self._pending[count:]
+        return count
+
+    def close(self):
+        self._fp.close()
+        super().close()
+
+
+class ArchiveRequestHandler(http.server.SimpleHTTPRequestHandler):
+    '''Serves the files of a directory like `SimpleHTTPRequestHandler`, and
+    also serves images which were indexed by `index_cbz()` (rather than
+    extracted) by reading them out of their CBZ files. A request for a
+    single range of the bytes of such an image (with a 'Range' header) is
+    answered with just that range. Shared assets (see
+    `write_shared_assets()`) are served to be cached for as long as possible,
+    as their contents never change.'''
+
+    def end_headers(self):
+        name = path.basename(urlsplit(self.path).path)
+        if SHARED_ASSET_PATTERN.match(name) and path.isfile(self.translate_path(self.path)):
+            self.send_header('Cache-Control', 'public, max-age=31536000, immutable')
+        super().end_headers()
 
-                pathlib.Path(full_new_image_dirname).mkdir(parents=True, exist_ok=True)
-                # Have to manually copy only the file out of it's old location and into the new one.
-                source = zfp.open(compr_img_path)
-                target = open(full_new_image_path, 'wb')
-                with source, target:
-                    shutil.copyfileobj(source, target)
+    def send_head(self):
+        full_path = self.translate_path(self.path)
+        if path.exists(full_path):
+            return super().send_head()
+        found = _find_archive_member(self.directory, full_path)
+        if found is None:
+            return super().send_head()
+        archive_index, member = found
+        size = archive_index['members'][member]['file_size']
+        try:
+            byte_range = _parse_byte_range(self.headers.get('Range'), size)
+        except ValueError:
+            self.send_response(http.HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+        start, stop = byte_range or (0, None)
+        try:
+            member_fp = open_archive_member(archive_index, member, start=start, stop=stop)
+        except (OSError, KeyError, zipfile.BadZipFile):
+            self.send_error(http.HTTPStatus.NOT_FOUND, "File not found")
+            return None
+        if byte_range is None:
+            self.send_response(http.HTTPStatus.OK)
+            self.send_header("Content-Length", str(size))
+        else:
+            self.send_response(http.HTTPStatus.PARTIAL_CONTENT)
+            self.send_header("Content-Range", f"bytes {start}-{stop - 1}/{size}")
+            self.send_header("Content-Length", str(stop - start))
+        self.send_header("Content-type", self.guess_type(member))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        return member_fp
+
+
+def _parse_byte_range(header, size):
+    '''Returns the `(start, stop)` of the range of bytes asked for by the
+    'Range' header `header` of a request for a file of `size` bytes, or None
+    if the whole file is to be sent (as when there is no header, or it asks
+    for several ranges). Raises ValueError if the range can't be satisfied.'''
+    match = re.fullmatch(r'\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*', header or '')
+    if match is None or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        # A suffix range, of the last so many bytes.
+        start = max(0, size - int(last))
+        stop = size
+    else:
+        start = int(first)
+        stop = size if last == '' else min(size, int(last) + 1)
+    if start >= size or start >= stop:
+        raise ValueError(f"cannot satisfy the range {header!r} of {size} bytes")
+    return start, stop
+
+
+def _find_archive_member(root, full_path):
+    '''Looks for the archive index (saved by `index_cbz()`) nearest to
+    `full_path` within `root`, returning a tuple of the index and the name of
+    the member at `full_path`, or None if `full_path` isn't an indexed
+    image.'''
+    root = path.abspath(root)
+    dirname = path.dirname(full_path)
+    while dirname.startswith(root):
+        index_path = path.join(dirname, ARCHIVE_INDEX_FILENAME)
+        if path.isfile(index_path):
+            archive_index = _load_archive_index(index_path, os.stat(index_path).st_mtime_ns)
+            member = path.relpath(full_path, dirname).replace(os.sep, '/')
+            if member in archive_index['members']:
+                return archive_index, member
+            return None
+        if dirname == root:
+            break
+        dirname = path.dirname(dirname)
+    return None
+
+
+@functools.lru_cache(maxsize=256)
+def _load_archive_index(index_path, mtime_ns):
+    '''Reads an archive index; cached on `mtime_ns` so a changed index is
+    read again.'''
+    with open(index_path, 'r') as indexfile:
+        return json.load(indexfile)
+
+
+def serve(dest_path, host='127.0.0.1', port=8000):
+    '''Serves the directory `dest_path` over HTTP at `host` and `port` until
+    interrupted, including the images of CBZ files which were indexed rather
+    than extracted. See `mirror_unzip_cbz()`.'''
+    handler = functools.partial(ArchiveRequestHandler, directory=path.abspath(dest_path))
+    with http.server.ThreadingHTTPServer((host, port), handler) as httpd:
+        dbg_p(f"serving '{dest_path}' at http://{host}:{httpd.server_address[1]}/")
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def _remove_stale_outputs(manifest, stale_outputs):
+    '''Deletes the files, relative to the root of `manifest`, which an earlier
+    run produced but which the current run no longer produces.'''
+    for relpath in stale_outputs:
+        full_path = path.join(manifest.root, relpath)
+        if path.isfile(full_path):
+            os.remove(full_path)
+        manifest.mark_changed(path.dirname(relpath))
 
 
 def mirror_images_directory(
@@ -620,7 +2034,13 @@ def mirror_images_directory(
     dest_path,
     maintain_existing_images=False,
     extensions_allowlist=None,
-    verbose=False
+    verbose=False,
+    manifest=None,
+    filetree=None,
+    link_mode='copy',
+    stats=None,
+    store=None,
+    bufsize=COPY_BUFFER_SIZE,
 ):
     ''' Replicate a directory structure with images in it into a new location,
     but with only the images. By default copies files with the following
@@ -632,6 +2052,24 @@ def mirror_images_directory(
         .gif
         .bmp
         .tiff
+
+    If a `BuildManifest` is provided as `manifest`, only the images which have
+    been added or changed since the manifest was last saved are copied, and
+    copies of images which have been removed from the source are deleted.
+
+    The images to copy are found with `build_filetree()`, unless a dictionary
+    of that form is passed as `filetree`. Returns a dictionary of the same
+    form listing the images in `dest_path` which were copied (or kept).
+
+    Each image is copied with `copy_image_file()`, according to `link_mode`
+    and `bufsize`.
+    If `maintain_existing_images` is set, images which were already copied
+    are kept, so long as they have the same size and modification time as the
+    image in `source_path`, or are the stored copy of it (see
+    `_copy_is_current()`). If a `ContentStore` is provided as `store`, images
+    are copied by way of it.
+
+    If a `Stats` is provided as `stats`, the work done is added to it.
     '''
     if verbose:
         dbg_p(f"copying images from '{source_path}' into '{dest_path}'")
@@ -640,91 +2078,1452 @@ def mirror_images_directory(
     source_path = path.abspath(source_path)
     dest_path = path.abspath(dest_path)
 
-    image_folders = build_filetree(source_path, suffix_allowlist=extensions_allowlist)
+    image_folders = filetree
+    if image_folders is None:
+        image_folders = build_filetree(source_path, suffix_allowlist=extensions_allowlist)
 
+    written = dict()
     for reltpth, imgfiles in image_folders.items():
-        full_oldpath = path.join(source_path, reltpth)
-        full_newpath = path.join(dest_path, reltpth)
-        if verbose:
-            dbg_p(f"\tcopying images from subdir '{full_oldpath}' into '{full_newpath}'")
-        pathlib.Path(full_newpath).mkdir(parents=True, exist_ok=True)
+        written[reltpth] = list(imgfiles)
+        _mirror_image_folder(
+            source_path,
+            dest_path,
+            reltpth,
+            imgfiles,
+            maintain_existing_images=maintain_existing_images,
+            verbose=verbose,
+            manifest=manifest,
+            link_mode=link_mode,
+            stats=stats,
+            store=store,
+            bufsize=bufsize,
+        )
+    return written
+
+
+def _mirror_image_folder(
+    source_path,
+    dest_path,
+    reltpth,
+    imgfiles,
+    maintain_existing_images=False,
+    verbose=False,
+    manifest=None,
+    link_mode='copy',
+    stats=None,
+    store=None,
+    bufsize=COPY_BUFFER_SIZE,
+):
+    '''Copies the images `imgfiles` in the folder `reltpth` of `source_path`
+    into the same folder of `dest_path`, for `mirror_images_directory()`.'''
+    full_oldpath = path.join(source_path, reltpth)
+    full_newpath = path.join(dest_path, reltpth)
+    to_copy = imgfiles
+    if manifest is not None:
+        manifest_key = 'images:' + reltpth
+        previous = manifest.source_of(manifest_key) or dict()
+        signature = dict()
+        to_copy = list()
         for imgfname in imgfiles:
-            # existing image file
-            full_path_to_imgf = path.join(full_oldpath, imgfname)
+            unchanged, signature[imgfname] = manifest.compare_file(
+                path.join(full_oldpath, imgfname), previous.get(imgfname)
+            )
+            # Copies which were deleted or cut short since are made again.
+            if not unchanged or not _size_is(
+                path.join(full_newpath, imgfname), signature[imgfname]['size']
+            ):
+                to_copy.append(imgfname)
+        if stats is not None:
+            stats.count('files_skipped', len(imgfiles) - len(to_copy))
+        if not to_copy and len(signature) == len(previous) and path.isdir(full_newpath):
+            if verbose:
+                dbg_p(f"\tskipping unchanged images in subdir '{full_oldpath}'")
+            return
+    if verbose:
+        dbg_p(f"\tcopying images from subdir '{full_oldpath}' into '{full_newpath}'")
+    pathlib.Path(full_newpath).mkdir(parents=True, exist_ok=True)
+    for imgfname in to_copy:
+        # existing image file
+        full_path_to_imgf = path.join(full_oldpath, imgfname)
 
-            full_new_image_path = path.join(full_newpath, imgfname)
-            if maintain_existing_images:
-                if path.isfile(full_new_image_path):
-                    continue
-            if full_new_image_path == full_path_to_imgf:
-                dbg_p(
-                    f"ERR: Cannot copy file {full_path_to_imgf} into itself; skipping copy operation"
-                )
+        full_new_image_path = path.join(full_newpath, imgfname)
+        if maintain_existing_images:
+            if _copy_is_current(full_path_to_imgf, full_new_image_path, store, bufsize):
+                if stats is not None:
+                    stats.count('files_skipped')
                 continue
-            with open(full_path_to_imgf,
-                      'rb') as sourceimg, open(full_new_image_path, 'wb') as destimg:
-                shutil.copyfileobj(sourceimg, destimg)
+        if full_new_image_path == full_path_to_imgf:
+            dbg_p(
+                f"ERR: Cannot copy file {full_path_to_imgf} into itself; skipping copy operation"
+            )
+            continue
+        copy_image_file(
+            full_path_to_imgf,
+            full_new_image_path,
+            link_mode=link_mode,
+            stats=stats,
+            store=store,
+            bufsize=bufsize,
+        )
+    if manifest is not None:
+        outputs = [path.relpath(path.join(full_newpath, x), manifest.root) for x in imgfiles]
+        _remove_stale_outputs(manifest, manifest.record(manifest_key, signature, outputs))
+        if to_copy:
+            manifest.mark_changed(path.relpath(full_newpath, manifest.root))
 
 
-def sort_nicely(l):
+def _size_is(full_path, size):
+    '''Returns True if the file at `full_path` exists and is `size` bytes
+    long.'''
+    try:
+        return os.stat(full_path).st_size == size
+    except OSError:
+        return False
+
+
+def _copy_is_current(full_path, full_new_path, store=None, bufsize=COPY_BUFFER_SIZE):
+    '''Returns True if the file at `full_new_path` has the same size and
+    modification time as the one at `full_path`. Copies made by
+    `copy_image_file()` are given the modification time of the original, and
+    links share it, so this holds for an up to date copy, while a copy which
+    was cut short or whose original has changed since is caught.
+
+    An image linked to an identical one already in the `ContentStore`
+    `store` shares the modification time of whichever image was stored
+    first, so if the times differ, it's current if it's still the stored
+    copy of the contents of `full_path` (see `ContentStore.holds()`).'''
+    try:
+        st = os.stat(full_path)
+        new_st = os.stat(full_new_path)
+    except OSError:
+        return False
+    if st.st_size != new_st.st_size:
+        return False
+    if st.st_mtime_ns == new_st.st_mtime_ns:
+        return True
+    return store is not None and new_st.st_nlink > 1 and store.holds(
+        full_path, full_new_path, bufsize
+    )
+
+
+def copy_image_file(
+    full_path, full_new_path, link_mode='copy', stats=None, store=None, bufsize=COPY_BUFFER_SIZE
+):
+    '''Copies the file at `full_path` to `full_new_path`, replacing any file
+    already there. A copy is given the modification time of the original. How
+    the copy is made depends on `link_mode`:
+
+    - `'copy'` reads and writes every byte through Python, `bufsize` bytes at
+      a time.
+    - `'hardlink'` creates a hard link, using no extra space. Both paths must
+      be on the same filesystem, and changing one changes the other.
+    - `'reflink'` creates a copy-on-write clone, which is instant and uses no
+      extra space until either file is changed. Requires a filesystem with
+      support for it, such as btrfs or XFS.
+    - `'symlink'` creates a symbolic link to `full_path`.
+    - `'auto'` tries a reflink, then falls back to copying within the kernel
+      with `os.copy_file_range()` or `os.sendfile()`, then to `'copy'`.
+
+    With `'copy'`, if a `ContentStore` is provided as `store`, the file is
+    copied by way of it with `ContentStore.put()`. An image identical to one
+    already stored is then linked to it, and shares its modification time.
+
+    Raises OSError if the requested `link_mode` isn't possible. If a `Stats`
+    is provided as `stats`, the copy is added to it.
+    '''
+    if link_mode not in LINK_MODES:
+        raise ValueError(f"link_mode must be one of {LINK_MODES}, not {link_mode!r}")
+    if store is not None and link_mode == 'copy':
+        timer = contextlib.nullcontext() if stats is None else stats.timer('copy')
+        with timer, open(full_path, 'rb') as sourceimg:
+            mtime_ns = os.fstat(sourceimg.fileno()).st_mtime_ns
+            size = store.put(
+                sourceimg, full_new_path, mtime_ns=mtime_ns, stats=stats, bufsize=bufsize
+            )
+        if stats is not None:
+            stats.count('files_copied')
+            stats.count('bytes_read', size)
+        return
+    if stats is None:
+        _copy_image_file(full_path, full_new_path, link_mode, bufsize)
+        return
+    with stats.timer('copy'):
+        size = _copy_image_file(full_path, full_new_path, link_mode, bufsize)
+    if size is None:
+        stats.count('files_linked')
+        return
+    stats.count('files_copied')
+    stats.count('bytes_read', size)
+    stats.count('bytes_written', size)
+
+
+def _copy_image_file(full_path, full_new_path, link_mode, bufsize=COPY_BUFFER_SIZE):
+    '''Makes the copy for `copy_image_file()`, returning the number of bytes
+    copied, or None if a link was made instead.'''
+    # Remove what's there rather than writing over it, as it may be a link to
+    # the source from an earlier run.
+    if path.lexists(full_new_path):
+        os.remove(full_new_path)
+    if link_mode == 'hardlink':
+        os.link(full_path, full_new_path)
+        return None
+    if link_mode == 'symlink':
+        os.symlink(path.abspath(full_path), full_new_path)
+        return None
+    if link_mode == 'reflink':
+        return _copy_with(_reflink, full_path, full_new_path)
+    copy_fileobj = functools.partial(_copy_fileobj, bufsize=bufsize)
+    if link_mode == 'copy':
+        return _copy_with(copy_fileobj, full_path, full_new_path)
+    for strategy in (_reflink, _copy_file_range, _sendfile):
+        try:
+            return _copy_with(strategy, full_path, full_new_path)
+        except OSError:
+            continue
+    return _copy_with(copy_fileobj, full_path, full_new_path)
+
+
+def _copy_with(strategy, full_path, full_new_path):
+    '''Opens both files and copies between them with `strategy`, removing the
+    partially written copy if it fails. Returns the size of the copy.'''
+    with open(full_path, 'rb') as sourceimg, open(full_new_path, 'wb') as destimg:
+        try:
+            strategy(sourceimg, destimg)
+        except BaseException:
+            destimg.close()
+            os.remove(full_new_path)
+            raise
+        st = os.fstat(sourceimg.fileno())
+    os.utime(full_new_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    return st.st_size
+
+
+def _copy_fileobj(sourceimg, destimg, bufsize=COPY_BUFFER_SIZE):
+    shutil.copyfileobj(sourceimg, destimg, bufsize)
+
+
+def _reflink(sourceimg, destimg):
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "reflinks are not supported on this platform")
+    fcntl.ioctl(destimg.fileno(), FICLONE, sourceimg.fileno())
+
+
+def _copy_file_range(sourceimg, destimg):
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError(errno.EOPNOTSUPP, "os.copy_file_range() is not available")
+    remaining = os.fstat(sourceimg.fileno()).st_size
+    while remaining > 0:
+        copied = os.copy_file_range(sourceimg.fileno(), destimg.fileno(), remaining)
+        if copied == 0:
+            break
+        remaining -= copied
+
+
+def _sendfile(sourceimg, destimg):
+    if not hasattr(os, 'sendfile'):
+        raise OSError(errno.EOPNOTSUPP, "os.sendfile() is not available")
+    size = os.fstat(sourceimg.fileno()).st_size
+    offset = 0
+    while offset < size:
+        sent = os.sendfile(destimg.fileno(), sourceimg.fileno(), offset, size - offset)
+        if sent == 0:
+            break
+        offset += sent
+
+
+class ContentStore:
+    '''A store of images kept within a destination directory at `root`, in
+    which each distinct image is kept once, named by the SHA-256 of its
+    contents. The images extracted or copied into the destination through
+    `put()` are hard links to the stored copies, so the credit pages, adverts
+    and covers repeated across many volumes only take up space once.
+
+    Stored copies which nothing links to any more are deleted by `prune()`,
+    and `savings()` reports how much space the store saves.'''
+
+    def __init__(self, root):
+        self.root = path.abspath(root)
+
+    def path_of(self, digest, suffix=''):
+        '''Returns the full path of the stored copy of the image whose
+        SHA-256 is the hex string `digest`.'''
+        return path.join(self.root, digest[:2], digest + suffix.lower())
+
+    def put(self, source, full_new_path, mtime_ns=None, stats=None, bufsize=COPY_BUFFER_SIZE):
+        '''Copies the contents of the file object `source` (or of the bytes-like
+        object `source`, such as a memoryview) to `full_new_path` by way of the
+        store, replacing any file already there. The contents
+        are hashed as they're copied into the store, so they're only read
+        once; if an identical image was already stored, the new copy is
+        dropped and `full_new_path` is linked to the one already there. A
+        newly stored image is given the modification time `mtime_ns`, if it's
+        provided. Returns the size of the image.
+
+        If the link can't be made (such as on a filesystem without hard
+        links), `full_new_path` is given a copy of the stored image instead.
+        If a `Stats` is provided as `stats`, the work done is added to it.'''
+        pathlib.Path(self.root).mkdir(parents=True, exist_ok=True)
+        tmp_path = path.join(self.root, f'incoming.{os.getpid()}.{threading.get_ident()}.tmp')
+        digest = hashlib.sha256()
+        size = 0
+        if hasattr(source, 'read'):
+            chunks = iter(lambda: source.read(bufsize), b'')
+        else:
+            chunks = (source[i:i + bufsize] for i in range(0, len(source), bufsize))
+        try:
+            with open(tmp_path, 'wb') as target:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    target.write(chunk)
+                    size += len(chunk)
+            stored_path = self.path_of(digest.hexdigest(), path.splitext(full_new_path)[1])
+            if mtime_ns is not None:
+                os.utime(tmp_path, ns=(mtime_ns, mtime_ns))
+            pathlib.Path(stored_path).parent.mkdir(exist_ok=True)
+            # Linking fails if the image is already stored, even by another
+            # worker storing the same image at the same moment, whereas
+            # replacing it would leave links to the first copy orphaned.
+            try:
+                os.link(tmp_path, stored_path)
+                duplicate = False
+            except FileExistsError:
+                duplicate = True
+            except OSError:
+                # Without hard links, nothing links to the stored copy, so
+                # it's safe to replace.
+                duplicate = path.isfile(stored_path)
+                if not duplicate:
+                    os.replace(tmp_path, stored_path)
+            if path.exists(tmp_path):
+                os.remove(tmp_path)
+        except BaseException:
+            if path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        _link_stored(stored_path, full_new_path)
+        if stats is not None:
+            if duplicate:
+                stats.count('files_deduplicated')
+                stats.count('bytes_deduplicated', size)
+            else:
+                stats.count('bytes_written', size)
+        return size
+
+    def holds(self, full_path, full_new_path, bufsize=COPY_BUFFER_SIZE):
+        '''Returns True if `full_new_path` is linked to the stored copy of the
+        contents of the file at `full_path`. The file at `full_path` is
+        hashed, but nothing is written.'''
+        stored_path = self.path_of(
+            _hash_file(full_path, bufsize), path.splitext(full_new_path)[1]
+        )
+        try:
+            return path.samefile(stored_path, full_new_path)
+        except OSError:
+            return False
+
+    def _stored_files(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for fname in filenames:
+                if not fname.endswith('.tmp'):
+                    yield path.join(dirpath, fname)
+
+    def prune(self):
+        '''Deletes the stored images which no image in the destination links
+        to any more, returning the number deleted.'''
+        removed = 0
+        for full_path in self._stored_files():
+            if os.stat(full_path).st_nlink == 1:
+                os.remove(full_path)
+                removed += 1
+        return removed
+
+    def savings(self):
+        '''Returns a tuple of `(images, bytes)`: the number of images in the
+        destination which share a stored copy with another, and the number of
+        bytes this saves compared with each having its own copy.'''
+        images = 0
+        saved = 0
+        for full_path in self._stored_files():
+            st = os.stat(full_path)
+            if st.st_nlink > 2:
+                images += st.st_nlink - 1
+                saved += (st.st_nlink - 2) * st.st_size
+        return images, saved
+
+
+def _link_stored(stored_path, full_new_path):
+    '''Replaces whatever is at `full_new_path` with a hard link to the
+    stored image at `stored_path`, or with a copy of it if it can't be
+    linked to.'''
+    tmp_path = f'{full_new_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        os.link(stored_path, tmp_path)
+    except OSError:
+        shutil.copyfile(stored_path, tmp_path)
+    os.replace(tmp_path, full_new_path)
+
+
+def sort_nicely(l, memoize=False):
     '''Sort the given list in the way that humans expect.
     Taken from the codinghorror blog post:
         https://blog.codinghorror.com/sorting-for-humans-natural-sort-order/
+
+    Each string is sorted by its `natural_sort_key()`. When `memoize` is set,
+    the keys are kept between calls, which speeds up sorting the same strings
+    more than once (such as the folders of a library, which are sorted by
+    each stage of a run).
     '''
-    convert = lambda text: int(text) if text.isdigit() else text
-    alphanum_key = lambda key: [convert(c) for c in re.split('([0-9]+)', key)]
-    return sorted(l, key=alphanum_key)
+    return sorted(l, key=_memoized_natural_sort_key if memoize else natural_sort_key)
+
+
+def natural_sort_key(name):
+    '''Returns a key which sorts `name` in the way that humans expect, with
+    each run of the digits 0-9 compared as a number, so that 'a2' sorts
+    before 'a10'.
+
+    The key is `name` with each number rewritten so that plain string
+    comparison orders numbers by value: a NUL character (which sorts before
+    any text, as a shorter piece of text would), then a character counting
+    the digits of the number without its leading zeros, then those digits.
+    Comparing two such strings is much faster than comparing lists of text
+    and numbers, and never compares a number with text. `name` itself is
+    kept in the key to break ties between names like 'a01' and 'a1'.'''
+    return _NATURAL_SORT_SUB(_natural_sort_number, name), name
+
+
+def _natural_sort_number(match):
+    digits = match.group().lstrip('0') or '0'
+    return f'\x00{chr(len(digits))}{digits}'
 
 
-def create_comic_display_htmlfiles(source_path, embed_images=False, verbose=False):
+_NATURAL_SORT_SUB = re.compile('[0-9]+').sub
+_memoized_natural_sort_key = functools.lru_cache(maxsize=1 << 17)(natural_sort_key)
+
+
+def create_comic_display_htmlfiles(
+    source_path,
+    embed_images=False,
+    verbose=False,
+    manifest=None,
+    filetree=None,
+    datauri_cache=None,
+    stats=None,
+    assets=None,
+    defer_embedded=False,
+    compressor=None,
+    tier_widths=None,
+):
     '''Finds directories with images in them, then creates "index.html" files
     in each directory which embed those images in alphanumeric order. Does not
     create an "overall" HTML file for listing and browsing all the folders of
-    images.'''
+    images.
+
+    If a `BuildManifest` is provided as `manifest`, an "index.html" file is
+    only written if its list of images or its link to the next directory has
+    changed since the manifest was last saved, or if the images in its
+    directory were written to during this run (as their sizes, or when
+    `embed_images` is set their contents, are part of the page).
+
+    The directories are found with `build_filetree()`, unless a dictionary of
+    that form is passed as `filetree`.
+
+    When `embed_images` is set, images are streamed into each page as data
+    URIs, reusing those already encoded in `datauri_cache` if it's provided.
+    If `defer_embedded` is also set, each data URI is only given to its image
+    once the image is about to be viewed, so that opening a page doesn't
+    decode every image at once.
+
+    Each page includes its CSS and JavaScript, unless the `SharedAssets`
+    returned by `write_shared_assets()` are passed as `assets`, in which case
+    each page links to them instead.
+
+    If a `PageCompressor` is provided as `compressor`, each page (whether it
+    was written or skipped) is passed to it to be precompressed.
+
+    If `tier_widths` (such as the `widths` of a `TierGenerator`) is given,
+    each image which has smaller copies of those widths offers them to the
+    browser with 'srcset', unless `embed_images` is set.
+
+    If a `Stats` is provided as `stats`, the work done is added to it.'''
     if verbose:
         dbg_p(
             "creating index.html files for viewing images like comic books, "
             f"based on image dirs in {source_path}",
         )
-    image_folders = build_filetree(source_path, suffix_allowlist=DEFAULT_IMAGE_EXTENSIONS)
-    ordered_keys = sort_nicely(image_folders.keys())
+    image_folders = filetree
+    if image_folders is None:
+        image_folders = build_filetree(source_path, suffix_allowlist=DEFAULT_IMAGE_EXTENSIONS)
+    ordered_keys = sort_nicely(image_folders.keys(), memoize=True)
     for idx in range(len(ordered_keys)):
-        reltpth = ordered_keys[idx]
-        imgfiles = image_folders[reltpth]
-        full_dir_path = path.join(source_path, reltpth)
-        if verbose:
-            dbg_p(f"\tcreating index.html in folder '{full_dir_path}'")
-        linefmt = '<div style="text-align:center;" class="imgbox"><img src="{}" style="margin-top: 40px;" class="center-fit"><p>{}</p></div>'
-        make_image_url = lambda imgpath: quote(imgpath)
-        if embed_images:
-            make_image_url = lambda imgpath, fp=full_dir_path: create_image_datauri(
-                path.join(fp, imgpath)
-            )
-        imghtml = "\n".join([linefmt.format(make_image_url(x), x) for x in imgfiles])
-        # Link to the next directory of comics if there are more
+        next_reltpth = None
         if idx < len(ordered_keys) - 1:
-            relative_path_to_next = path.relpath(ordered_keys[idx + 1], reltpth)
+            next_reltpth = ordered_keys[idx + 1]
+        _write_display_page(
+            source_path,
+            ordered_keys[idx],
+            image_folders[ordered_keys[idx]],
+            next_reltpth,
+            embed_images=embed_images,
+            verbose=verbose,
+            manifest=manifest,
+            datauri_cache=datauri_cache,
+            stats=stats,
+            assets=assets,
+            defer_embedded=defer_embedded,
+            compressor=compressor,
+            tier_widths=tier_widths,
+        )
+
+
+def _write_display_page(
+    source_path,
+    reltpth,
+    imgfiles,
+    next_reltpth,
+    embed_images=False,
+    verbose=False,
+    manifest=None,
+    datauri_cache=None,
+    stats=None,
+    assets=None,
+    defer_embedded=False,
+    compressor=None,
+    tier_widths=None,
+):
+    '''Writes the "index.html" file of the folder `reltpth` (holding the
+    images `imgfiles`) for `create_comic_display_htmlfiles()`, linking to the
+    folder `next_reltpth` unless it's None.'''
+    full_dir_path = path.join(source_path, reltpth)
+    page_path = path.join(full_dir_path, 'index.html')
+    relative_path_to_next = None
+    if next_reltpth is not None:
+        relative_path_to_next = path.relpath(next_reltpth, reltpth)
+    if manifest is not None:
+        manifest_key = 'html:' + reltpth
+        signature = _hash_signature(imgfiles, relative_path_to_next, bool(embed_images))
+        if assets is not None:
+            signature = _hash_signature(signature, assets)
+        if embed_images and defer_embedded:
+            signature = _hash_signature(signature, 'defer_embedded')
+        if tier_widths and not embed_images:
+            signature = _hash_signature(signature, 'tiers', list(tier_widths))
+        if (
+            manifest.is_current(manifest_key, signature)
+            and reltpth not in manifest.changed_dirs
+            and path.isfile(page_path)
+        ):
             if verbose:
-                dbg_p(
-                    f"\tLinking from source '{reltpth}' to next '{ordered_keys[idx+1]}' via '{relative_path_to_next}'"
+                dbg_p(f"\tskipping unchanged index.html in folder '{full_dir_path}'")
+            if stats is not None:
+                stats.count('pages_skipped')
+            if compressor is not None:
+                compressor.submit(page_path)
+            return
+    if verbose:
+        dbg_p(f"\tcreating index.html in folder '{full_dir_path}'")
+        if relative_path_to_next is not None:
+            dbg_p(
+                f"\tLinking from source '{reltpth}' to next '{next_reltpth}' via '{relative_path_to_next}'"
+            )
+    imagelist = _comic_display_imagelist(
+        full_dir_path,
+        imgfiles,
+        relative_path_to_next,
+        embed_images,
+        datauri_cache,
+        stats,
+        defer_embedded=defer_embedded,
+        tiers_dir=path.join(source_path, CACHE_DIRNAME, 'tiers', reltpth),
+        tier_widths=tier_widths,
+    )
+    preamble, post_index = _page_template(assets, reltpth)
+    with open(page_path, 'w+') as indexfile:
+        write_html_page(indexfile, reltpth, imagelist, post_index=post_index, preamble=preamble)
+        if stats is not None:
+            stats.count('pages_written')
+            stats.count('bytes_written', indexfile.tell())
+    if manifest is not None:
+        manifest.record(manifest_key, signature, [path.join(reltpth, 'index.html')])
+    if compressor is not None:
+        compressor.submit(page_path)
+
+
+def _comic_display_imagelist(
+    full_dir_path,
+    imgfiles,
+    relative_path_to_next,
+    embed_images,
+    datauri_cache=None,
+    stats=None,
+    defer_embedded=False,
+    tiers_dir=None,
+    tier_widths=None,
+):
+    '''Yields the pieces of the body of the "index.html" file for the images
+    `imgfiles` within `full_dir_path`, one image at a time, for
+    `write_html_page()`. Each image is given its width and height (when
+    `image_dimensions()` can tell them) so the page doesn't reflow as images
+    load, and those after the first `EAGER_PAGES` are loaded lazily. If
+    `defer_embedded` is set, the data URI of each embedded image is kept in an
+    inert element beside the image, which the page's script only moves into
+    the image as it's about to be viewed.
+
+    The smaller copies of each image of `tier_widths` found in `tiers_dir`
+    are listed in its 'srcset', with 'sizes' describing how wide the image is
+    shown: the full width of the viewport, unless the viewport is too wide for
+    the image to fit its height, in which case the width at that height.'''
+    before_img = '<div style="text-align:center;" class="imgbox"><img '
+    after_attrs = ' style="margin-top: 40px;" class="center-fit">'
+    before_label, after_label = '<p>', '</p></div>'
+    make_image_url = lambda imgpath: quote(imgpath)
+    if embed_images:
+        make_image_url = lambda imgpath: functools.partial(
+            write_image_datauri,
+            path.join(full_dir_path, imgpath),
+            cache=datauri_cache,
+            stats=stats,
+        )
+    for idx, imgpath in enumerate(imgfiles):
+        if idx:
+            yield '\n'
+        attrs = ' decoding="async"'
+        size = image_dimensions(path.join(full_dir_path, imgpath))
+        if size is not None:
+            attrs = f' width="{size[0]}" height="{size[1]}"{attrs}'
+        if idx >= EAGER_PAGES:
+            attrs += ' loading="lazy"'
+        if tier_widths and size is not None and not embed_images:
+            srcset = list()
+            for width in tier_widths:
+                full_tierpath = path.join(tiers_dir, _tier_name(imgpath, width))
+                if width < size[0] and path.isfile(full_tierpath):
+                    srcset.append(f'{quote(path.relpath(full_tierpath, full_dir_path))} {width}w')
+            if srcset:
+                srcset.append(f'{quote(imgpath)} {size[0]}w')
+                attrs += (
+                    f' srcset="{", ".join(srcset)}" sizes="(max-aspect-ratio: {size[0]}/{size[1]})'
+                    f' 100vw, {99 * size[0] / size[1]:.0f}vh"'
+                )
+        yield before_img
+        if embed_images and defer_embedded:
+            yield f'data-embedded="{idx}"{attrs}{after_attrs}'
+            yield f'<script type="text/plain" id="embedded-data-{idx}">'
+            yield make_image_url(imgpath)
+            yield '</script>'
+        else:
+            yield 'src="'
+            yield make_image_url(imgpath)
+            yield f'"{attrs}{after_attrs}'
+        yield before_label
+        yield imgpath
+        yield after_label
+    # Link to the next directory of comics if there are more
+    if relative_path_to_next is not None:
+        yield f'\n<h1><a href="{relative_path_to_next}/">NEXT >></a></h1>'
+
+
+def image_dimensions(full_imagepath):
+    '''Returns the `(width, height)` in pixels of the PNG, JPEG, GIF, BMP,
+    WebP or AVIF image at `full_imagepath`, read from the headers of the file
+    without decoding any pixels, or None if the file can't be read or isn't
+    one of those formats.'''
+    try:
+        with open(full_imagepath, 'rb') as imgfile:
+            head = imgfile.read(32)
+            if head[:3] == b'\xff\xd8\xff':
+                return _jpeg_dimensions(imgfile)
+            if head[4:12] in (b'ftypavif', b'ftypavis'):
+                # The size is in the 'ispe' property, near the start.
+                head += imgfile.read(4096)
+                idx = head.find(b'ispe')
+                if idx == -1 or len(head) < idx + 16:
+                    return None
+                return struct.unpack('>II', head[idx + 8:idx + 16])
+    except OSError:
+        return None
+    if head[:8] == b'\x89PNG\r\n\x1a\n' and head[12:16] == b'IHDR':
+        return struct.unpack('>II', head[16:24])
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return struct.unpack('<HH', head[6:10])
+    if head[:2] == b'BM' and len(head) >= 26:
+        if struct.unpack('<I', head[14:18])[0] == 12:
+            return struct.unpack('<HH', head[18:22])
+        width, height = struct.unpack('<ii', head[18:26])
+        # A negative height means the rows are stored top down.
+        return width, abs(height)
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP' and len(head) >= 30:
+        chunk = head[12:16]
+        if chunk == b'VP8 ':
+            width, height = struct.unpack('<HH', head[26:30])
+            return width & 0x3fff, height & 0x3fff
+        if chunk == b'VP8L':
+            bits = struct.unpack('<I', head[21:25])[0]
+            return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+        if chunk == b'VP8X':
+            return (
+                int.from_bytes(head[24:27], 'little') + 1,
+                int.from_bytes(head[27:30], 'little') + 1,
+            )
+    return None
+
+
+def _jpeg_dimensions(imgfile):
+    '''Returns the `(width, height)` from the start of frame segment of the
+    open JPEG file `imgfile`, skipping over the segments before it, or None
+    if there isn't one.'''
+    imgfile.seek(2)
+    while True:
+        marker = imgfile.read(2)
+        if len(marker) < 2 or marker[0] != 0xff:
+            return None
+        code = marker[1]
+        # Markers may be padded with any number of 0xff bytes.
+        while code == 0xff:
+            code = imgfile.read(1)
+            if not code:
+                return None
+            code = code[0]
+        if code == 0x01 or 0xd0 <= code <= 0xd8:
+            # These markers stand alone, without a segment following them.
+            continue
+        length = imgfile.read(2)
+        if len(length) < 2:
+            return None
+        length = struct.unpack('>H', length)[0]
+        # SOF0 to SOF15, other than DHT, JPG and DAC which share the range.
+        if 0xc0 <= code <= 0xcf and code not in (0xc4, 0xc8, 0xcc):
+            frame = imgfile.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack('>xHH', frame)
+            return width, height
+        imgfile.seek(length - 2, 1)
+
+
+def write_html_page(outfile, description, imagelist, post_index='', preamble=None):
+    '''Writes a page built from `preamble` (`PREAMBLE` unless it's provided)
+    and `INDEX_TEMPLATE` into the open text file `outfile`. The body of the
+    page, `imagelist`, is an iterable of pieces which are written one at a
+    time as they're produced, so a page is never held in memory all at once,
+    no matter how large it is. Each piece is either a string, or a callable
+    which is passed `outfile` to write itself (such as an image being written
+    as a data URI). The page ends with `post_index`.'''
+    if preamble is None:
+        preamble = PREAMBLE
+    before_imagelist, after_imagelist = INDEX_TEMPLATE.split('{imagelist}')
+    outfile.write(preamble)
+    outfile.write(before_imagelist.format(description=description))
+    for piece in imagelist:
+        if callable(piece):
+            piece(outfile)
+        else:
+            outfile.write(piece)
+    outfile.write(after_imagelist.format())
+    outfile.write(post_index)
+
+
+def write_shared_assets(dest_path, verbose=False, compressor=None):
+    '''Writes `STYLESHEET` and `VIEWER_SCRIPT` into the root of `dest_path`
+    as files named by a digest of their contents (such as
+    `chvg.0123456789abcdef.css`), for pages to link to rather than include
+    inline. As the name of each file changes whenever its contents do, the
+    files may be cached by browsers forever. Files left over from other
+    versions are deleted. Returns a `SharedAssets` tuple of the names of the
+    files, which may be passed as the `assets` parameter of the functions
+    writing pages. If a `PageCompressor` is provided as `compressor`, the
+    files are passed to it to be precompressed.'''
+    pathlib.Path(dest_path).mkdir(parents=True, exist_ok=True)
+    names = list()
+    for contents, suffix in [(STYLESHEET, '.css'), (VIEWER_SCRIPT, '.js')]:
+        data = contents.encode('utf-8')
+        name = f'chvg.{hashlib.sha256(data).hexdigest()[:16]}{suffix}'
+        full_path = path.join(dest_path, name)
+        if not path.isfile(full_path):
+            if verbose:
+                dbg_p(f"\twriting shared asset '{full_path}'")
+            tmp_path = f'{full_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as asset:
+                asset.write(data)
+            os.replace(tmp_path, full_path)
+        if compressor is not None:
+            compressor.submit(full_path)
+        names.append(name)
+    for entry in os.scandir(dest_path):
+        if SHARED_ASSET_PATTERN.match(entry.name) and entry.name not in names:
+            _remove_page(entry.path)
+    return SharedAssets(*names)
+
+
+def _page_template(assets, reltpth, script=True):
+    '''Returns a tuple of the `preamble` and `post_index` for
+    `write_html_page()` of a page in the folder `reltpth`, which link to the
+    shared `assets` if they aren't None. The JavaScript is only included if
+    `script` is set.'''
+    if assets is None:
+        return PREAMBLE, POST_INDEX if script else ''
+    to_root = path.relpath('.', reltpth or '.')
+    preamble = SHARED_PREAMBLE.format(stylesheet=quote(path.join(to_root, assets.stylesheet)))
+    post_index = ''
+    if script:
+        post_index = SHARED_POST_INDEX.format(script=quote(path.join(to_root, assets.script)))
+    return preamble, post_index
+
+
+class PageCompressor:
+    '''Writes precompressed copies of pages beside them (such as
+    `index.html.gz` beside `index.html`), for web servers to serve in place
+    of the pages themselves, such as nginx with `gzip_static`. Each page
+    passed to `submit()` is compressed in one of a pool of `jobs` threads, as
+    zlib and brotli don't hold the GIL while compressing, so pages are
+    compressed while the next ones are written. `wait()` waits for them to
+    finish, as does `close()`, which also shuts down the pool.
+
+    `formats` are names from `PRECOMPRESS_FORMATS`; 'brotli' is skipped if
+    the `brotli` module isn't installed. Each copy is given the modification
+    time of its page, and isn't written again while the page keeps that
+    time.
+
+    If a `Stats` is provided as `stats`, the work done is added to it.'''
+
+    def __init__(self, formats=('gzip', 'brotli'), jobs=1, verbose=False, stats=None):
+        for compression in formats:
+            if compression not in PRECOMPRESS_FORMATS:
+                raise ValueError(
+                    f"formats must be from {tuple(PRECOMPRESS_FORMATS)}, not {compression!r}"
                 )
-            imghtml += f'\n<h1><a href="{relative_path_to_next}/">NEXT >></a></h1>'
-        contents = PREAMBLE + INDEX_TEMPLATE.format(
-            imagelist=imghtml, description=reltpth
-        ) + POST_INDEX
-        with open(path.join(full_dir_path, 'index.html'), 'w+') as indexfile:
-            indexfile.write(contents)
+        self.formats = [x for x in formats if x != 'brotli' or brotli is not None]
+        self.verbose = verbose
+        self.stats = stats
+        self.pool = ThreadPoolExecutor(max_workers=max(jobs, 1))
+        self.futures = list()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, full_path):
+        '''Compresses the page at `full_path`, unless its copies are already
+        up to date.'''
+        self.futures.append(self.pool.submit(self._compress, full_path))
+
+    def wait(self):
+        '''Waits for every page submitted to be compressed, raising the first
+        error from any of them.'''
+        futures, self.futures = self.futures, list()
+        for future in futures:
+            future.result()
+
+    def close(self):
+        '''Waits for the pages, then shuts down the pool.'''
+        try:
+            self.wait()
+        finally:
+            self.pool.shutdown()
+
+    def _compress(self, full_path):
+        st = os.stat(full_path)
+        for compression in self.formats:
+            sidecar_path = full_path + PRECOMPRESS_FORMATS[compression]
+            if _sidecar_is_current(st, sidecar_path):
+                if self.stats is not None:
+                    self.stats.count('sidecars_skipped')
+                continue
+            if self.verbose:
+                dbg_p(f"\tcompressing '{full_path}' into '{sidecar_path}'")
+            start = time.perf_counter()
+            tmp_path = f'{sidecar_path}.{threading.get_ident()}.tmp'
+            with open(full_path, 'rb') as page, open(tmp_path, 'wb') as sidecar:
+                if compression == 'gzip':
+                    # A fixed mtime in the header keeps the output the same
+                    # from one run to the next.
+                    with gzip.GzipFile('', 'wb', 9, sidecar, mtime=0) as compressed:
+                        shutil.copyfileobj(page, compressed, 1024 * 1024)
+                else:
+                    compressor = brotli.Compressor()
+                    for chunk in iter(lambda: page.read(1024 * 1024), b''):
+                        sidecar.write(compressor.process(chunk))
+                    sidecar.write(compressor.finish())
+                written = sidecar.tell()
+            os.utime(tmp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+            os.replace(tmp_path, sidecar_path)
+            if self.stats is not None:
+                self.stats.count('sidecars_written')
+                self.stats.count('bytes_written', written)
+                self.stats.add_time('compress', time.perf_counter() - start)
+
+
+def _sidecar_is_current(st, sidecar_path):
+    '''Returns True if the precompressed copy at `sidecar_path` has the
+    modification time of the page whose `os.stat()` result is `st`, which
+    `PageCompressor` gives it when it's written. `Transcoder` does the same
+    for the images it transcodes.'''
+    try:
+        return os.stat(sidecar_path).st_mtime_ns == st.st_mtime_ns
+    except OSError:
+        return False
+
+
+def _remove_page(full_path):
+    '''Deletes the page at `full_path`, along with any precompressed copies
+    of it.'''
+    for suffix in [''] + list(PRECOMPRESS_FORMATS.values()):
+        if path.isfile(full_path + suffix):
+            os.remove(full_path + suffix)
+
+
+def generate_thumbnails(
+    source_path,
+    filetree=None,
+    thumbnail_dir=None,
+    size=300,
+    image_format='webp',
+    quality=80,
+    jobs=1,
+    verbose=False,
+    stats=None,
+):
+    '''Creates small thumbnails of the images previewed for each folder in
+    BROWSE_COMIC_HERE.html (the first few images of each folder found within
+    `source_path`), so the browse page needn't load full sized pages. Each
+    thumbnail is scaled down to fit within a `size` by `size` pixel box and
+    saved in `image_format` (one of `THUMBNAIL_FORMATS`) within
+    `thumbnail_dir`, which defaults to a directory within `CACHE_DIRNAME`.
+
+    A thumbnail is only created if it doesn't exist, or if it's older than
+    the image it's made from. When `jobs` is greater than 1, thumbnails are
+    created by a pool of processes.
+
+    Requires Pillow, which can be installed as an extra with: ::
+
+        pip install comic-html-view-generator[thumbnails]
+
+    Returns a dictionary mapping the relative path of each folder to a list of
+    the paths of its thumbnails, relative to `source_path`, suitable for the
+    `thumbnails` parameter of `create_comic_browse_htmlfiles()`.
+
+    If a `Stats` is provided as `stats`, the work done is added to it.
+    '''
+    if Image is None:
+        raise ImportError(
+            "generating thumbnails requires Pillow; install it with "
+            "'pip install comic-html-view-generator[thumbnails]'"
+        )
+    if image_format not in THUMBNAIL_FORMATS:
+        raise ValueError(
+            f"image_format must be one of {list(THUMBNAIL_FORMATS)}, not {image_format!r}"
+        )
+    source_path = path.abspath(source_path)
+    if thumbnail_dir is None:
+        thumbnail_dir = path.join(source_path, CACHE_DIRNAME, 'thumbnails')
+    if verbose:
+        dbg_p(f"creating thumbnails of images in '{source_path}' within '{thumbnail_dir}'")
+    image_folders = filetree
+    if image_folders is None:
+        image_folders = build_filetree(source_path, suffix_allowlist=DEFAULT_IMAGE_EXTENSIONS)
+
+    thumbnails = dict()
+    pending = list()
+    # The folder and position of the preview each pending thumbnail is for.
+    pending_previews = list()
+    for reltpth, imgfiles in image_folders.items():
+        thumbnails[reltpth] = list()
+        for idx, imgfname in enumerate(imgfiles[:BROWSE_PREVIEW_COUNT]):
+            full_imagepath = path.join(source_path, reltpth, imgfname)
+            full_thumbpath = path.join(
+                thumbnail_dir, reltpth, f'{imgfname}.{size}{THUMBNAIL_FORMATS[image_format]}'
+            )
+            thumbnails[reltpth].append(path.relpath(full_thumbpath, source_path))
+            if _is_newer(full_thumbpath, full_imagepath):
+                if stats is not None:
+                    stats.count('thumbnails_skipped')
+                continue
+            pending.append((full_imagepath, full_thumbpath, size, image_format, quality))
+            pending_previews.append((reltpth, idx))
+
+    if verbose:
+        dbg_p(f"\tcreating {len(pending)} thumbnails")
+    pool = None
+    if jobs is None or jobs <= 1 or len(pending) <= 1:
+        results = map(_make_thumbnail, pending)
+    else:
+        pool = ProcessPoolExecutor(max_workers=jobs)
+        results = pool.map(_make_thumbnail, pending, chunksize=16)
+    try:
+        for thumbnail, (reltpth, idx), error in zip(pending, pending_previews, results):
+            if error is None:
+                if stats is not None:
+                    stats.count('thumbnails_written')
+                continue
+            # Images which can't be read are previewed at their full size.
+            full_imagepath = thumbnail[0]
+            dbg_p(f"ERR: Cannot create thumbnail of {full_imagepath}: {error}")
+            thumbnails[reltpth][idx] = path.relpath(full_imagepath, source_path)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return thumbnails
+
 
+def _make_thumbnail(thumbnail):
+    '''Creates a single thumbnail; run within a worker of a pool by
+    `generate_thumbnails()`. Returns None on success, or a description of the
+    error if the image couldn't be read.'''
+    full_imagepath, full_thumbpath, size, image_format, quality = thumbnail
+    pathlib.Path(path.dirname(full_thumbpath)).mkdir(parents=True, exist_ok=True)
+    tmp_path = f'{full_thumbpath}.{os.getpid()}.tmp'
+    try:
+        with Image.open(full_imagepath) as img:
+            img.thumbnail((size, size))
+            if image_format == 'jpeg' and img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            img.save(tmp_path, format=image_format, quality=quality)
+    except (OSError, ValueError) as err:
+        if path.exists(tmp_path):
+            os.remove(tmp_path)
+        return str(err)
+    os.replace(tmp_path, full_thumbpath)
+    return None
+
+
+def _is_newer(full_path, than_path):
+    '''Returns True if the file at `full_path` exists and was modified no
+    earlier than the file at `than_path`.'''
+    try:
+        return os.stat(full_path).st_mtime_ns >= os.stat(than_path).st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+class Transcoder:
+    '''Re-encodes images which were mirrored into a destination directory
+    into a smaller format, so that pages download faster. Each image is saved
+    beside its original in `image_format` (one of `TRANSCODE_FORMATS`) at
+    `quality`, scaled down to fit within a `max_dimension` by
+    `max_dimension` pixel box if `max_dimension` is given, and named like
+    the original but with the suffix of `image_format` (so `page01.png`
+    becomes `page01.webp`). The originals are kept, so that unchanged CBZ
+    files and folders still needn't be extracted or copied again; the
+    destination therefore holds both.
+
+    A transcoded image is given the modification time of its original, and
+    isn't transcoded again while the original keeps that time and the
+    settings saved (as `TRANSCODE_SETTINGS_FILENAME` within `CACHE_DIRNAME`)
+    by the last build are the same. A build which transcodes a destination
+    over several calls to `transcode_tree()` brackets them with `begin()`
+    and `finish()`. When `jobs` is greater than 1, images are transcoded by
+    a pool of processes, which lasts until `close()`.
+
+    Requires Pillow, which can be installed as an extra with: ::
+
+        pip install comic-html-view-generator[thumbnails]
+
+    If a `Stats` is provided as `stats`, the work done is added to it.'''
+
+    def __init__(
+        self, image_format='webp', quality=80, max_dimension=None, jobs=1, verbose=False, stats=None
+    ):
+        if Image is None:
+            raise ImportError(
+                "transcoding images requires Pillow; install it with "
+                "'pip install comic-html-view-generator[thumbnails]'"
+            )
+        if image_format not in TRANSCODE_FORMATS:
+            raise ValueError(
+                f"image_format must be one of {list(TRANSCODE_FORMATS)}, not {image_format!r}"
+            )
+        Image.init()
+        if image_format.upper() not in Image.SAVE:
+            raise ValueError(f"this installation of Pillow can't save {image_format} images")
+        self.image_format = image_format
+        self.quality = quality
+        self.max_dimension = max_dimension
+        self.verbose = verbose
+        self.stats = stats
+        # The settings saved by the last build of each destination being
+        # built, keyed by the full path of the destination.
+        self._saved = dict()
+        self.pool = None
+        if jobs is not None and jobs > 1:
+            self.pool = ProcessPoolExecutor(max_workers=jobs)
 
-def create_comic_browse_htmlfiles(source_path, embed_images=False, verbose=False):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        '''Shuts down the pool of processes.'''
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    @property
+    def settings(self):
+        return {
+            'format': self.image_format,
+            'quality': self.quality,
+            'max_dimension': self.max_dimension,
+        }
+
+    def begin(self, dest_path):
+        '''Reads the settings the last build of `dest_path` transcoded images
+        with, for the calls to `transcode_tree()` of this build to compare
+        against. `finish()` saves the settings of this build once they're
+        all done; until then, every call compares against the same settings,
+        even when they're made at once by several threads.'''
+        settings_path = path.join(dest_path, CACHE_DIRNAME, TRANSCODE_SETTINGS_FILENAME)
+        try:
+            with open(settings_path, 'r') as settingsfile:
+                saved = json.load(settingsfile)
+        except (OSError, ValueError):
+            saved = None
+        self._saved[path.abspath(dest_path)] = saved
+
+    def finish(self, dest_path, save=True):
+        '''Saves the settings images within `dest_path` were transcoded with,
+        once every call to `transcode_tree()` since `begin()` is done. A
+        build which failed part way passes `save` as False, so that the next
+        build transcodes the images again if the settings have changed.'''
+        saved = self._saved.pop(path.abspath(dest_path), None)
+        if not save or saved == self.settings:
+            return
+        settings_path = path.join(dest_path, CACHE_DIRNAME, TRANSCODE_SETTINGS_FILENAME)
+        pathlib.Path(path.dirname(settings_path)).mkdir(parents=True, exist_ok=True)
+        tmp_path = f'{settings_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as settingsfile:
+            json.dump(self.settings, settingsfile)
+        os.replace(tmp_path, settings_path)
+
+    def transcode_tree(self, dest_path, filetree, manifest=None):
+        '''Transcodes the images in `filetree` (a dictionary in the form
+        returned by `build_filetree()`) within `dest_path`, returning a
+        dictionary of the same form listing the transcoded images in place of
+        their originals, in the same order. Images which can't be read are
+        listed as they are.
+
+        If a `BuildManifest` is provided as `manifest`, the transcoded images
+        of each folder are recorded in it, so that a folder is transcoded
+        again when the format, quality or maximum dimension change, and
+        transcoded images whose originals are gone are removed.
+
+        Unless it's called between `begin()` and `finish()`, it calls them
+        itself.'''
+        standalone = path.abspath(dest_path) not in self._saved
+        if standalone:
+            self.begin(dest_path)
+        suffix = TRANSCODE_FORMATS[self.image_format]
+        settings = self.settings
+        saved = self._saved[path.abspath(dest_path)]
+        old_suffix = None
+        if isinstance(saved, dict) and saved.get('format') in TRANSCODE_FORMATS:
+            old_suffix = TRANSCODE_FORMATS[saved['format']]
+        transcoded = dict()
+        pending = list()
+        for reltpth, imgfiles in filetree.items():
+            stems = collections.Counter(path.splitext(x)[0] for x in imgfiles)
+            names = transcoded[reltpth] = list()
+            previous = None
+            if manifest is not None:
+                previous = manifest.source_of(f'transcode:{reltpth}')
+            for imgfname in imgfiles:
+                stem = path.splitext(imgfname)[0]
+                # Images such as 'p1.png' and 'p1.jpg' would share a name.
+                newname = stem + suffix if stems[stem] == 1 else imgfname + suffix
+                names.append(newname)
+                full_imagepath = path.join(dest_path, reltpth, imgfname)
+                full_new_path = path.join(dest_path, reltpth, newname)
+                if old_suffix not in (None, suffix):
+                    # Remove what was transcoded into the format used before.
+                    oldname = stem + old_suffix if stems[stem] == 1 else imgfname + old_suffix
+                    full_old_path = path.join(dest_path, reltpth, oldname)
+                    if oldname not in imgfiles and path.isfile(full_old_path):
+                        _remove_page(full_old_path)
+                current = _sidecar_is_current(os.stat(full_imagepath), full_new_path)
+                if current and saved == settings and previous in (None, settings):
+                    if self.stats is not None:
+                        self.stats.count('transcodes_skipped')
+                    continue
+                job = (
+                    full_imagepath,
+                    full_new_path,
+                    self.image_format,
+                    self.quality,
+                    self.max_dimension,
+                )
+                pending.append(((reltpth, len(names) - 1, imgfname), job))
+        if self.verbose and pending:
+            dbg_p(f"\ttranscoding {len(pending)} images in '{dest_path}' to {self.image_format}")
+        jobs = [job for _, job in pending]
+        if self.pool is None or len(jobs) <= 1:
+            results = map(_transcode_image, jobs)
+        else:
+            results = self.pool.map(_transcode_image, jobs, chunksize=4)
+        for ((reltpth, idx, imgfname), job), (error, written) in zip(pending, results):
+            if error is not None:
+                dbg_p(f"ERR: Cannot transcode {job[0]}: {error}")
+                transcoded[reltpth][idx] = imgfname
+                continue
+            if manifest is not None:
+                manifest.mark_changed(reltpth)
+            if self.stats is not None:
+                self.stats.count('files_transcoded')
+                self.stats.count('bytes_written', written)
+        if manifest is not None:
+            for reltpth, names in transcoded.items():
+                outputs = [path.join(reltpth, x) for x in names if x not in filetree[reltpth]]
+                stale = manifest.record(f'transcode:{reltpth}', settings, outputs)
+                _remove_stale_outputs(manifest, stale)
+        if standalone:
+            self.finish(dest_path)
+        return transcoded
+
+
+def _transcode_image(job):
+    '''Transcodes a single image; run within a worker of a pool by
+    `Transcoder`. Returns a tuple of a description of the error if the image
+    couldn't be read (or None), and the size of the transcoded image.'''
+    full_imagepath, full_new_path, image_format, quality, max_dimension = job
+    tmp_path = f'{full_new_path}.{os.getpid()}.tmp'
+    try:
+        st = os.stat(full_imagepath)
+        with Image.open(full_imagepath) as img:
+            if max_dimension:
+                img.thumbnail((max_dimension, max_dimension))
+            img.save(tmp_path, format=image_format, quality=quality)
+    except (OSError, ValueError) as err:
+        if path.exists(tmp_path):
+            os.remove(tmp_path)
+        return str(err), 0
+    written = os.stat(tmp_path).st_size
+    os.utime(tmp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    os.replace(tmp_path, full_new_path)
+    return None, written
+
+
+class TierGenerator:
+    '''Creates smaller copies of the images in a destination directory, one
+    for each of `widths` narrower than the image, so that each page can offer
+    browsers a choice of sizes with 'srcset' and a small screen needn't
+    download a full sized scan. The copies are kept within `CACHE_DIRNAME`
+    (named as by `_tier_name()`) in the format of the image they're made
+    from if browsers can show it (see `TIER_WEB_SUFFIXES`), or as JPEGs if
+    not, saved at `quality` where that format has one. GIFs, which may be
+    animated, are left alone.
+
+    A copy is only created if it doesn't exist, or if it's older than the
+    image it's made from, and `prune()` removes the copies no longer
+    needed. When `jobs` is greater than 1, copies are created by a pool of
+    processes, which lasts until `close()`.
+
+    Requires Pillow, which can be installed as an extra with: ::
+
+        pip install comic-html-view-generator[thumbnails]
+
+    If a `Stats` is provided as `stats`, the work done is added to it.'''
+
+    def __init__(self, widths=DEFAULT_TIER_WIDTHS, quality=85, jobs=1, verbose=False, stats=None):
+        if Image is None:
+            raise ImportError(
+                "generating image tiers requires Pillow; install it with "
+                "'pip install comic-html-view-generator[thumbnails]'"
+            )
+        if not widths or min(widths) < 1:
+            raise ValueError(f"widths must be positive numbers of pixels, not {widths!r}")
+        self.widths = tuple(sorted(set(widths)))
+        self.quality = quality
+        self.verbose = verbose
+        self.stats = stats
+        self.pool = None
+        if jobs is not None and jobs > 1:
+            self.pool = ProcessPoolExecutor(max_workers=jobs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        '''Shuts down the pool of processes.'''
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def generate(self, dest_path, filetree=None, manifest=None):
+        '''Creates the copies of the images in `filetree` (a dictionary in the
+        form returned by `build_filetree()`) within `dest_path`, or of every
+        image in `dest_path` if it isn't given. The folders whose copies are
+        created are marked as changed in `manifest`, if it's provided, so that
+        their pages are written again to offer them.'''
+        if filetree is None:
+            filetree = build_filetree(dest_path, suffix_allowlist=DEFAULT_IMAGE_EXTENSIONS)
+        pending = list()
+        for reltpth, imgfiles in filetree.items():
+            for imgfname in imgfiles:
+                if imgfname.lower().endswith('.gif'):
+                    continue
+                full_imagepath = path.join(dest_path, reltpth, imgfname)
+                size = image_dimensions(full_imagepath)
+                if size is None:
+                    continue
+                tiers = list()
+                for width in self.widths:
+                    if width >= size[0]:
+                        break
+                    full_tierpath = path.join(
+                        dest_path, CACHE_DIRNAME, 'tiers', reltpth, _tier_name(imgfname, width)
+                    )
+                    if _is_newer(full_tierpath, full_imagepath):
+                        if self.stats is not None:
+                            self.stats.count('tiers_skipped')
+                        continue
+                    tiers.append((width, full_tierpath))
+                if tiers:
+                    pending.append((full_imagepath, tiers, self.quality))
+                    if manifest is not None:
+                        manifest.mark_changed(reltpth)
+        if self.verbose and pending:
+            dbg_p(f"\tcreating smaller copies of {len(pending)} images in '{dest_path}'")
+        if self.pool is None or len(pending) <= 1:
+            results = map(_make_tiers, pending)
+        else:
+            results = self.pool.map(_make_tiers, pending, chunksize=4)
+        for job, (error, written) in zip(pending, results):
+            if error is not None:
+                dbg_p(f"ERR: Cannot create smaller copies of {job[0]}: {error}")
+            if self.stats is not None and written:
+                self.stats.count('tiers_written', len(written))
+                self.stats.count('bytes_written', sum(written))
+
+    def prune(self, dest_path, filetree):
+        '''Deletes the copies within `dest_path` which aren't of an image in
+        `filetree` (a dictionary in the form returned by `build_filetree()`
+        which lists every image in `dest_path`) at one of `widths`, such as
+        those of deleted images or of widths no longer asked for. Returns the
+        number of copies deleted.'''
+        tiers_root = path.join(dest_path, CACHE_DIRNAME, 'tiers')
+        current = set(
+            path.join(reltpth, _tier_name(imgfname, width))
+            for reltpth, imgfiles in filetree.items()
+            for imgfname in imgfiles
+            for width in self.widths
+        )
+        removed = 0
+        for dirpath, _, filenames in os.walk(tiers_root, topdown=False):
+            for fname in filenames:
+                full_tierpath = path.join(dirpath, fname)
+                if path.relpath(full_tierpath, tiers_root) not in current:
+                    os.remove(full_tierpath)
+                    removed += 1
+            if dirpath != tiers_root and not os.listdir(dirpath):
+                os.rmdir(dirpath)
+        if self.stats is not None and removed:
+            self.stats.count('tiers_removed', removed)
+        return removed
+
+
+def _tier_name(imgfname, width):
+    '''Returns the name of the copy of the image `imgfname` which is `width`
+    pixels wide, as made by `TierGenerator`. The copies of the images of each
+    folder are kept in the same folder within `CACHE_DIRNAME`/tiers.'''
+    suffix = path.splitext(imgfname)[1]
+    if suffix.lower() not in TIER_WEB_SUFFIXES:
+        suffix = '.jpg'
+    return f'{imgfname}.{width}w{suffix}'
+
+
+def _make_tiers(job):
+    '''Creates the smaller copies of a single image; run within a worker of
+    a pool by `TierGenerator`. The image is decoded once, and scaled down from
+    the widest copy to the narrowest. Returns a tuple of a description of the
+    error if the image couldn't be read (or None), and the sizes of the copies
+    which were created.'''
+    full_imagepath, tiers, quality = job
+    written = list()
+    tmp_path = None
+    try:
+        with Image.open(full_imagepath) as img:
+            image_format = img.format
+            if path.splitext(full_imagepath)[1].lower() not in TIER_WEB_SUFFIXES:
+                image_format = 'JPEG'
+                if img.mode not in ('RGB', 'L'):
+                    img = img.convert('RGB')
+            for width, full_tierpath in sorted(tiers, reverse=True):
+                height = max(1, round(img.height * width / img.width))
+                img = img.resize((width, height), Image.LANCZOS)
+                pathlib.Path(full_tierpath).parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = f'{full_tierpath}.{os.getpid()}.tmp'
+                img.save(tmp_path, format=image_format, quality=quality)
+                os.replace(tmp_path, full_tierpath)
+                written.append(os.stat(full_tierpath).st_size)
+    except (OSError, ValueError) as err:
+        if tmp_path is not None and path.exists(tmp_path):
+            os.remove(tmp_path)
+        return str(err), written
+    return None, written
+
+
+def create_comic_browse_htmlfiles(
+    source_path,
+    embed_images=False,
+    verbose=False,
+    manifest=None,
+    filetree=None,
+    datauri_cache=None,
+    thumbnails=None,
+    browse_mode='single',
+    browse_page_size=BROWSE_PAGE_SIZE,
+    stats=None,
+    assets=None,
+    compressor=None,
+):
     '''Creates a "BROWSE_HERE.html" file at the top of source_path, which
     generates a kind of "overview" or "browsable list" page which links to all
-    the other index.html files in subdirectories of source_path. '''
+    the other index.html files in subdirectories of source_path.
+
+    For very large libraries, a single page listing every folder grows too
+    large to load. The `browse_mode` may instead split the listing into
+    several "shard" pages (named like `BROWSE_COMIC_HERE.<name>.html`), with
+    "BROWSE_COMIC_HERE.html" becoming a small index of the shards:
+
+    - `'single'` (the default) lists every folder in one page.
+    - `'toplevel'` creates one shard for each top level directory. Adding a
+      comic only changes the shard of the directory it's added to. Images at
+      the root of the tree are listed in the `TOPLEVEL_BROWSE_SHARD` shard.
+    - `'paged'` creates shards of `browse_page_size` folders each, in order.
+
+    If a `BuildManifest` is provided as `manifest`, each page is only written
+    if the folders or preview images it would list have changed since the
+    manifest was last saved.
+
+    The directories are found with `build_filetree()`, unless a dictionary of
+    that form is passed as `filetree`.
+
+    When `embed_images` is set, images are streamed into each page as data
+    URIs, reusing those already encoded in `datauri_cache` if it's provided.
+
+    If `thumbnails` (as returned by `generate_thumbnails()`) is provided, each
+    folder is previewed with its thumbnails rather than its full sized
+    images.
+
+    If `assets` (as returned by `write_shared_assets()`) is provided, each
+    page links to the shared stylesheet rather than including it.
+
+    If a `PageCompressor` is provided as `compressor`, each page is passed to
+    it to be precompressed.
+
+    If a `Stats` is provided as `stats`, the work done is added to it.'''
+    if browse_mode not in BROWSE_MODES:
+        raise ValueError(f"browse_mode must be one of {BROWSE_MODES}, not {browse_mode!r}")
+    if thumbnails is None:
+        thumbnails = dict()
     if verbose:
         dbg_p(f"creating BROWSE_COMIC_HERE.html browsing comic pages at '{source_path}'",)
 
     outfoldername = path.split(source_path)[-1]
     prvgrid = '<div class="preview-grid">{preview_rows}</div>'
+    prvgrid_start, prvgrid_end = prvgrid.split('{preview_rows}')
     linefmt = '''
         <a href="{folderpath}/" class="comic_page">
             {foldername}
@@ -734,33 +3533,798 @@ def create_comic_browse_htmlfiles(source_path, embed_images=False, verbose=False
         </div>
     '''
     imgsfmt = '<img src="{}" loading="lazy">'
+    shardfmt = '''
+        <a href="{shardpath}" class="comic_page">
+            {shardname}
+        </a>
+        <a href="{shardpath}" class="comic_page">
+            {count} comics
+        </a>
+    '''
+    backlink = '\n<h1><a href="BROWSE_COMIC_HERE.html">&lt;&lt; ALL COMICS</a></h1>'
+
+    before_images, after_images = linefmt.split('{images}')
+    before_src, after_src = imgsfmt.split('{}')
 
     def create_folderprev(foldername, imagefiles):
-        imgpaths = imagefiles[:3]
-        imgpaths = [path.join(foldername, x) for x in imgpaths]
+        imgpaths = thumbnails.get(foldername)
+        if imgpaths is None:
+            imgpaths = imagefiles[:BROWSE_PREVIEW_COUNT]
+            imgpaths = [path.join(foldername, x) for x in imgpaths]
         make_image_url = lambda imgpath: quote(imgpath)
         if embed_images:
-            make_image_url = lambda imgpath: create_image_datauri(path.join(source_path, imgpath))
-        imgshtml = '\n'.join([imgsfmt.format(make_image_url(x)) for x in imgpaths])
+            make_image_url = lambda imgpath: functools.partial(
+                write_image_datauri,
+                path.join(source_path, imgpath),
+                cache=datauri_cache,
+                stats=stats,
+            )
         folderpath = foldername
         foldername = foldername.replace('/', '/<br>')
-        return linefmt.format(folderpath=folderpath, foldername=foldername, images=imgshtml)
+        yield before_images.format(folderpath=folderpath, foldername=foldername)
+        for idx, imgpath in enumerate(imgpaths):
+            if idx:
+                yield '\n'
+            yield before_src
+            yield make_image_url(imgpath)
+            yield after_src
+        yield after_images.format(folderpath=folderpath)
+
+    def preview_grid(keys, footer=''):
+        yield prvgrid_start
+        for idx, k in enumerate(keys):
+            if idx:
+                yield '\n'
+            yield from create_folderprev(k, subdir_imgs[k])
+        yield prvgrid_end
+        yield footer
+
+    def shard_grid(shards):
+        yield prvgrid_start
+        for idx, (shardname, keys) in enumerate(shards):
+            if idx:
+                yield '\n'
+            yield shardfmt.format(
+                shardpath=quote(_browse_shard_filename(shardname)),
+                shardname=shardname,
+                count=len(keys),
+            )
+        yield prvgrid_end
+
+    def write_browse_page(filename, description, keys, signature, imagelist):
+        browse_path = path.join(source_path, filename)
+        if assets is not None:
+            signature = _hash_signature(signature, assets)
+        if manifest is not None:
+            manifest_key = 'browse:' + filename
+            if (
+                manifest.is_current(manifest_key, signature)
+                # Embedded previews must be rewritten whenever their images are.
+                and not (embed_images and manifest.changed_dirs.intersection(keys))
+                and path.isfile(browse_path)
+            ):
+                if verbose:
+                    dbg_p(f"\tskipping unchanged '{browse_path}'")
+                if stats is not None:
+                    stats.count('pages_skipped')
+                if compressor is not None:
+                    compressor.submit(browse_path)
+                return
+        if verbose:
+            dbg_p(f"\twriting '{browse_path}'")
+        with open(browse_path, 'w') as browse_file:
+            write_html_page(browse_file, description, imagelist, preamble=preamble)
+            if stats is not None:
+                stats.count('pages_written')
+                stats.count('bytes_written', browse_file.tell())
+        if manifest is not None:
+            manifest.record(manifest_key, signature, [filename])
+        if compressor is not None:
+            compressor.submit(browse_path)
+
+    def folders_signature(keys):
+        return _hash_signature(
+            [(k, subdir_imgs[k][:BROWSE_PREVIEW_COUNT], thumbnails.get(k)) for k in keys],
+            bool(embed_images),
+        )
+
+    subdir_imgs = filetree
+    if subdir_imgs is None:
+        subdir_imgs = build_filetree(source_path, suffix_allowlist=DEFAULT_IMAGE_EXTENSIONS)
+    ordered_keys = sort_nicely(subdir_imgs.keys(), memoize=True)
+    preamble, _ = _page_template(assets, '', script=False)
+
+    shards = list()
+    if browse_mode == 'single':
+        write_browse_page(
+            "BROWSE_COMIC_HERE.html",
+            outfoldername,
+            ordered_keys,
+            folders_signature(ordered_keys),
+            preview_grid(ordered_keys),
+        )
+    else:
+        shards = _browse_shards(ordered_keys, browse_mode, browse_page_size)
+        for shardname, keys in shards:
+            write_browse_page(
+                _browse_shard_filename(shardname),
+                f'{outfoldername}: {shardname}',
+                keys,
+                folders_signature(keys),
+                preview_grid(keys, footer=backlink),
+            )
+        write_browse_page(
+            "BROWSE_COMIC_HERE.html",
+            outfoldername,
+            list(),
+            _hash_signature([(shardname, len(keys)) for shardname, keys in shards]),
+            shard_grid(shards),
+        )
+    _remove_stale_browse_shards(source_path, [name for name, _ in shards], manifest)
+
+
+def _browse_shards(ordered_keys, browse_mode, browse_page_size):
+    '''Splits the relative paths of folders in `ordered_keys` into a list of
+    `(shardname, keys)` tuples, as described for `browse_mode` in
+    `create_comic_browse_htmlfiles()`.'''
+    if browse_mode == 'paged':
+        if browse_page_size < 1:
+            raise ValueError(f"browse_page_size must be at least 1, not {browse_page_size}")
+        return [
+            (f'{idx // browse_page_size + 1:04}', ordered_keys[idx:idx + browse_page_size])
+            for idx in range(0, len(ordered_keys), browse_page_size)
+        ]
+    shards = dict()
+    for k in ordered_keys:
+        shards.setdefault(k.split('/', 1)[0] or TOPLEVEL_BROWSE_SHARD, list()).append(k)
+    return list(shards.items())
 
-    subdir_imgs = build_filetree(source_path, suffix_allowlist=DEFAULT_IMAGE_EXTENSIONS)
 
-    rendered_rows = list()
-    for k in sort_nicely(subdir_imgs.keys()):
-        foldername = k
-        imagefiles = subdir_imgs[k]
-        rendered_rows.append(create_folderprev(foldername, imagefiles))
+def _browse_shard_filename(shardname):
+    return f'BROWSE_COMIC_HERE.{shardname}.html'
 
-    preview_rows = "\n".join(rendered_rows)
-    preview_grid = prvgrid.format(preview_rows=preview_rows)
-    browse_contents = PREAMBLE + INDEX_TEMPLATE.format(
-        description=outfoldername, imagelist=preview_grid
+
+def _remove_stale_browse_shards(source_path, shardnames, manifest=None):
+    '''Deletes shards of the browse page within `source_path` which are left
+    over from an earlier run but are no longer in `shardnames`.'''
+    current = set(_browse_shard_filename(x) for x in shardnames)
+    for entry in os.scandir(source_path):
+        if (
+            entry.name.startswith('BROWSE_COMIC_HERE.')
+            and entry.name.endswith('.html')
+            and entry.name != 'BROWSE_COMIC_HERE.html'
+            and entry.name not in current
+        ):
+            _remove_page(entry.path)
+            if manifest is not None:
+                manifest.entries.pop('browse:' + entry.name, None)
+
+
+def run_pipeline(
+    source_path,
+    dest_path,
+    maintain_existing_images=False,
+    embed_images=False,
+    verbose=False,
+    manifest=None,
+    filetrees=None,
+    extract=True,
+    link_mode='copy',
+    datauri_cache=None,
+    stats=None,
+    extract_jobs=1,
+    executor='process',
+    copy_jobs=1,
+    render_jobs=1,
+    queue_size=PIPELINE_QUEUE_SIZE,
+    assets=None,
+    defer_embedded=False,
+    compressor=None,
+    transcoder=None,
+    tiers=None,
+    store=None,
+    split_size=SPLIT_ARCHIVE_SIZE,
+    bufsize=COPY_BUFFER_SIZE,
+    use_mmap=False,
+):
+    '''Does the work of `mirror_unzip_cbz()`, `mirror_images_directory()`
+    and `create_comic_display_htmlfiles()` as a pipeline, so that the stages
+    overlap rather than running one after another. Each CBZ file and each
+    folder of images is an item which flows from the scan, through
+    extraction or copying, to the writing of its "index.html" files as soon
+    as it's ready, so the first comics can be read while the rest of a large
+    library is still being imported.
+
+    The stages are joined by queues holding at most `queue_size` items, so a
+    fast stage waits for a slow one rather than getting ahead of it. CBZ
+    files are extracted by `extract_jobs` workers (in a pool of processes or
+    threads according to `executor`, and split between them when they're at
+    least `split_size` bytes, as in `mirror_unzip_cbz()`), folders of
+    images are copied by `copy_jobs` threads, and pages are written by
+    `render_jobs` threads.
+
+    Items are fed through in the order their folders sort in, so the NEXT
+    link of each page is usually known by the time it's written; the last
+    folder of each item is written once the item after it is done. Pages
+    which another item might still have a folder to insert before (such as
+    when a CBZ file and a folder of images put images in the same folder)
+    are written once every item is done. The pages are the same as those
+    of the separate stages, and `assets`, `defer_embedded` and `compressor`
+    are as for `create_comic_display_htmlfiles()`. If a `Transcoder` is
+    passed as `transcoder`, the images of each item are transcoded as soon as
+    the item is extracted or copied, and its pages list the transcoded images.
+    Likewise if a `TierGenerator` is passed as `tiers`, the smaller copies of
+    the images of each item are created before its pages are written, and
+    offered by them. Images are extracted and copied by way of `store`, and
+    according to `bufsize` and `use_mmap`, as in `mirror_unzip_cbz()` and
+    `mirror_images_directory()`.
+
+    The source is scanned with `scan_filetrees()`, unless its result is
+    passed as `filetrees`. Returns a dictionary in the form returned by
+    `build_filetree()` of the images in `dest_path`, suitable for the
+    `filetree` parameter of `create_comic_browse_htmlfiles()`.
+    '''
+    if executor not in EXECUTOR_KINDS:
+        raise ValueError(f"executor must be one of {EXECUTOR_KINDS}, not {executor!r}")
+    if queue_size < 1:
+        raise ValueError(f"queue_size must be at least 1, not {queue_size}")
+    source_path = path.abspath(source_path)
+    dest_path = path.abspath(dest_path)
+    if filetrees is None:
+        filetrees = scan_filetrees(source_path)
+    items = list()
+    for reltpth, zfiles in filetrees.archives.items():
+        for zfname in zfiles:
+            folder = path.join(reltpth, '.'.join(zfname.split('.')[:-1]))
+            items.append((folder, 'cbz', reltpth, zfname))
+    for reltpth, imgfiles in filetrees.images.items():
+        items.append((reltpth, 'images', reltpth, imgfiles))
+    items.sort(key=lambda item: natural_sort_key(item[0]))
+
+    pool_cls = ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+    pools = (
+        pool_cls(max_workers=max(extract_jobs, 1)),
+        ThreadPoolExecutor(max_workers=max(copy_jobs, 1)),
+        ThreadPoolExecutor(max_workers=max(render_jobs, 1)),
     )
-    with open(path.join(source_path, "BROWSE_COMIC_HERE.html"), 'w') as browse_file:
-        browse_file.write(browse_contents)
+    settings = dict(
+        maintain_existing_images=maintain_existing_images,
+        embed_images=embed_images,
+        verbose=verbose,
+        manifest=manifest,
+        extract=extract,
+        link_mode=link_mode,
+        datauri_cache=datauri_cache,
+        stats=stats,
+        assets=assets,
+        defer_embedded=defer_embedded,
+        compressor=compressor,
+        transcoder=transcoder,
+        tiers=tiers,
+        store=store,
+        split_size=split_size,
+        bufsize=bufsize,
+        use_mmap=use_mmap,
+    )
+    if verbose:
+        dbg_p(f"running pipeline of {len(items)} items from '{source_path}' into '{dest_path}'")
+    worker_counts = {'cbz': max(extract_jobs, 1), 'images': max(copy_jobs, 1)}
+    if transcoder is not None:
+        transcoder.begin(dest_path)
+    completed = False
+    try:
+        dest_tree = asyncio.run(
+            _run_pipeline(
+                source_path,
+                dest_path,
+                items,
+                pools,
+                worker_counts,
+                max(render_jobs, 1),
+                settings,
+                queue_size,
+            )
+        )
+        completed = True
+        return dest_tree
+    finally:
+        if transcoder is not None:
+            transcoder.finish(dest_path, save=completed)
+        for pool in pools:
+            pool.shutdown()
+
+
+async def _run_pipeline(
+    source_path, dest_path, items, pools, worker_counts, render_jobs, settings, queue_size
+):
+    '''The body of `run_pipeline()`, run within an event loop. The scan gives
+    each item a sequence number, and the render stage puts finished items
+    back into sequence before linking their folders together.'''
+    loop = asyncio.get_running_loop()
+    extract_pool, copy_pool, render_pool = pools
+    manifest = settings['manifest']
+    stats = settings['stats']
+    verbose = settings['verbose']
+    queues = {kind: asyncio.Queue(maxsize=queue_size) for kind in worker_counts}
+    done = asyncio.Queue(maxsize=queue_size)
+
+    async def scan():
+        for seq, item in enumerate(items):
+            await queues[item[1]].put((seq, item))
+        for kind, queue in queues.items():
+            for _ in range(worker_counts[kind]):
+                await queue.put(None)
+
+    async def mirror_item(item):
+        '''Extracts or copies a single item in the pool for its stage,
+        returning a file tree of the images now in `dest_path`.'''
+        _, kind, reltpth, name = item
+        if kind == 'images':
+            if source_path == dest_path:
+                # The images are already where they need to be.
+                return {reltpth: list(name)}
+            await loop.run_in_executor(
+                copy_pool,
+                functools.partial(
+                    _mirror_image_folder,
+                    source_path,
+                    dest_path,
+                    reltpth,
+                    name,
+                    maintain_existing_images=settings['maintain_existing_images'],
+                    verbose=verbose,
+                    manifest=manifest,
+                    link_mode=settings['link_mode'],
+                    stats=stats,
+                    store=settings['store'],
+                    bufsize=settings['bufsize'],
+                ),
+            )
+            return {reltpth: list(name)}
+        # Checking the manifest may hash the CBZ file, so it's kept out of
+        # the event loop's thread.
+        extraction, manifest_entry, outputs = await loop.run_in_executor(
+            None,
+            functools.partial(
+                _plan_cbz_extraction,
+                source_path,
+                dest_path,
+                reltpth,
+                name,
+                maintain_existing_images=settings['maintain_existing_images'],
+                verbose=verbose,
+                manifest=manifest,
+                extract=settings['extract'],
+                stats=stats,
+                store=settings['store'],
+                bufsize=settings['bufsize'],
+                use_mmap=settings['use_mmap'],
+            ),
+        )
+        if extraction is not None:
+            parts = await loop.run_in_executor(
+                None, _split_extraction, extraction, settings['split_size'], worker_counts['cbz']
+            )
+            results = await asyncio.gather(
+                *(loop.run_in_executor(extract_pool, _extract_cbz_buffered, x) for x in parts)
+            )
+            outputs = _finish_cbz_extraction(
+                path.join(reltpth, name),
+                manifest_entry,
+                _merge_extraction_results(results),
+                manifest,
+                stats,
+            )
+        return _filetree_from_paths(dest_path, outputs)
+
+    async def mirror_worker(queue):
+        while True:
+            entry = await queue.get()
+            if entry is None:
+                return
+            seq, item = entry
+            tree = await mirror_item(item)
+            if settings['transcoder'] is not None:
+                tree = await loop.run_in_executor(
+                    None, settings['transcoder'].transcode_tree, dest_path, tree, manifest
+                )
+            if settings['tiers'] is not None:
+                await loop.run_in_executor(
+                    None, settings['tiers'].generate, dest_path, tree, manifest
+                )
+            await done.put((seq, tree))
+
+    trees = list()
+    # The images and NEXT link each page was written with.
+    rendered = dict()
+    # Bounds the number of pages waiting for a render worker.
+    render_slots = asyncio.Semaphore(render_jobs * 2)
+    render_futures = list()
+    tier_widths = None
+    if settings['tiers'] is not None:
+        tier_widths = settings['tiers'].widths
+
+    async def render(reltpth, imgfiles, next_reltpth):
+        await render_slots.acquire()
+        rendered[reltpth] = (imgfiles, next_reltpth)
+        future = loop.run_in_executor(
+            render_pool,
+            functools.partial(
+                _write_display_page,
+                dest_path,
+                reltpth,
+                imgfiles,
+                next_reltpth,
+                embed_images=settings['embed_images'],
+                verbose=verbose,
+                manifest=manifest,
+                datauri_cache=settings['datauri_cache'],
+                stats=stats,
+                assets=settings['assets'],
+                defer_embedded=settings['defer_embedded'],
+                compressor=settings['compressor'],
+                tier_widths=tier_widths,
+            ),
+        )
+        future.add_done_callback(lambda _: render_slots.release())
+        render_futures.append(future)
+
+    # The sort key of the folder of the item after each item; no later item
+    # can have a folder which sorts before it.
+    bounds = [natural_sort_key(item[0]) for item in items[1:]] + [None]
+
+    async def render_stage():
+        finished = dict()
+        next_seq = 0
+        # The sort key of the greatest folder of the items so far.
+        greatest = None
+        # The last folder of the previous item, which links to the first
+        # folder of the next item with any folders.
+        held = None
+        for _ in range(len(items)):
+            seq, tree = await done.get()
+            finished[seq] = tree
+            while next_seq in finished:
+                tree = finished.pop(next_seq)
+                bound = bounds[next_seq]
+                next_seq += 1
+                trees.append(tree)
+                keys = sort_nicely(tree.keys(), memoize=True)
+                if not keys:
+                    continue
+                # A page is only written now if no other item can have a
+                # folder between it and the folder it links to. Otherwise it's
+                # left for the end, once every folder is known.
+                settled = lambda key: bound is None or natural_sort_key(key) < bound
+                after_earlier = greatest is None or natural_sort_key(keys[0]) > greatest
+                if held is not None and after_earlier and settled(keys[0]):
+                    await render(*held, keys[0])
+                held = None
+                if after_earlier:
+                    for key, next_key in zip(keys, keys[1:]):
+                        if not settled(next_key):
+                            break
+                        await render(key, tree[key], next_key)
+                    else:
+                        held = (keys[-1], tree[keys[-1]])
+                greatest = max(x for x in (greatest, natural_sort_key(keys[-1])) if x is not None)
+        if held is not None:
+            await render(*held, None)
+        await asyncio.gather(*render_futures)
+
+    mirror_workers = [
+        mirror_worker(queue) for kind, queue in queues.items() for _ in range(worker_counts[kind])
+    ]
+    await asyncio.gather(scan(), render_stage(), *mirror_workers)
+
+    # Put the trees of the items together, and write the pages which were
+    # left for the end, or which turned out to need a different list of
+    # images or NEXT link.
+    dest_tree = merge_filetrees(*trees)
+    ordered_keys = sort_nicely(dest_tree.keys(), memoize=True)
+    render_futures.clear()
+    for idx, reltpth in enumerate(ordered_keys):
+        next_reltpth = ordered_keys[idx + 1] if idx < len(ordered_keys) - 1 else None
+        if rendered.get(reltpth) != (dest_tree[reltpth], next_reltpth):
+            await render(reltpth, dest_tree[reltpth], next_reltpth)
+    await asyncio.gather(*render_futures)
+    return dest_tree
+
+
+class SourceWatcher:
+    '''Keeps a destination directory, built from `source_path` by the other
+    functions, up to date as CBZ files and folders of images are added to,
+    changed within, or removed from `source_path`.
+
+    Each CBZ file and each folder of images is an item, and the source is
+    watched by scanning it every `interval` seconds and comparing the size
+    and modification time of every item with those of the scan before. Only
+    the items which differ are handled: a new or changed CBZ file is
+    extracted again and a folder of images copied again, while the images of
+    a removed item are deleted. Then the "index.html" files of the folders
+    which changed are written, along with those of the folders before them,
+    whose NEXT links may now lead somewhere else, and `on_update` is called
+    with the new file tree of `dest_path` (such as to write the browse page
+    again). Once a change is seen, nothing is handled until the source has
+    gone `debounce` seconds without changing again, so a burst of changes
+    (such as a batch of CBZ files being copied in) is handled all at once.
+
+    What each item produced is learned from `manifest`, a `BuildManifest`
+    which must have been used to build `dest_path`, and which is saved after
+    each update. `filetrees` and `snapshot` may be passed if they were taken
+    (by `scan()`) before `dest_path` was built, so that changes made during
+    the build aren't missed. If a `Transcoder` is passed as `transcoder`,
+    the images of changed items are transcoded, and the transcoded images of
+    removed folders deleted, and if a `TierGenerator` is passed as `tiers`,
+    the smaller copies of the images of changed items are created. If a
+    `ContentStore` is passed as `store`, images are extracted and copied by
+    way of it, and stored images which are no longer linked to are deleted
+    after each update. The other parameters are as for
+    `mirror_unzip_cbz()`, `mirror_images_directory()` and
+    `create_comic_display_htmlfiles()`.
+    '''
+
+    def __init__(
+        self,
+        source_path,
+        dest_path,
+        manifest,
+        filetrees=None,
+        snapshot=None,
+        on_update=None,
+        maintain_existing_images=False,
+        embed_images=False,
+        verbose=False,
+        extract=True,
+        link_mode='copy',
+        datauri_cache=None,
+        stats=None,
+        interval=WATCH_INTERVAL,
+        debounce=WATCH_DEBOUNCE,
+        assets=None,
+        defer_embedded=False,
+        compressor=None,
+        transcoder=None,
+        tiers=None,
+        store=None,
+        bufsize=COPY_BUFFER_SIZE,
+        use_mmap=False,
+    ):
+        self.source_path = path.abspath(source_path)
+        self.dest_path = path.abspath(dest_path)
+        self.manifest = manifest
+        self.on_update = on_update
+        self.maintain_existing_images = maintain_existing_images
+        self.embed_images = embed_images
+        self.verbose = verbose
+        self.extract = extract
+        self.link_mode = link_mode
+        self.datauri_cache = datauri_cache
+        self.stats = stats
+        self.interval = interval
+        self.debounce = debounce
+        self.assets = assets
+        self.defer_embedded = defer_embedded
+        self.compressor = compressor
+        self.transcoder = transcoder
+        self.tiers = tiers
+        self.store = store
+        self.bufsize = bufsize
+        self.use_mmap = use_mmap
+        if filetrees is None:
+            filetrees, snapshot = self.scan()
+        elif snapshot is None:
+            snapshot = _snapshot_source(self.source_path, filetrees)
+        self.filetrees = filetrees
+        self.snapshot = snapshot
+        self.dest_tree = self._dest_tree(filetrees)
+
+    def scan(self):
+        '''Returns a tuple of `(filetrees, snapshot)`, where `filetrees` is
+        the result of `scan_filetrees()` for the source, and `snapshot` holds
+        the signature of each item within it.'''
+        filetrees = scan_filetrees(self.source_path)
+        return filetrees, _snapshot_source(self.source_path, filetrees)
+
+    def run(self, sleep=time.sleep):
+        '''Watches the source until interrupted, handling changes as they
+        settle with `update()`.'''
+        if self.verbose:
+            dbg_p(f"watching '{self.source_path}' for changes every {self.interval}s")
+        try:
+            while True:
+                sleep(self.interval)
+                filetrees, snapshot = self.scan()
+                if snapshot == self.snapshot:
+                    continue
+                quiet_since = time.monotonic()
+                while time.monotonic() - quiet_since < self.debounce:
+                    sleep(self.interval)
+                    later = self.scan()
+                    if later[1] != snapshot:
+                        filetrees, snapshot = later
+                        quiet_since = time.monotonic()
+                self.update(filetrees, snapshot)
+        except KeyboardInterrupt:
+            pass
+
+    def update(self, filetrees, snapshot):
+        '''Brings the destination up to date with the source described by
+        `filetrees` and `snapshot` (as returned by `scan()`), handling only
+        the items whose signatures differ from those last seen. Returns the
+        new file tree of the destination, or None if nothing changed.'''
+        changed = [
+            key for key in set(self.snapshot).union(snapshot)
+            if self.snapshot.get(key) != snapshot.get(key)
+        ]
+        if not changed:
+            return None
+        if self.verbose:
+            dbg_p(f"handling {len(changed)} changed items in '{self.source_path}'")
+        self.manifest.changed_dirs = set()
+        for key in sort_nicely(changed):
+            kind, relpath = key.split(':', 1)
+            try:
+                if key not in snapshot:
+                    self._remove_item(kind, relpath)
+                elif kind == 'cbz':
+                    self._extract_item(relpath)
+                elif self.source_path != self.dest_path:
+                    self._copy_item(relpath, filetrees.images[relpath])
+            except (OSError, zipfile.BadZipFile) as err:
+                # It'll be tried again once it changes again, such as when
+                # it's finished being copied into the source.
+                dbg_p(f"ERR: Cannot update '{relpath}': {err}")
+        dest_tree = self._dest_tree(filetrees)
+        self._write_pages(self.dest_tree, dest_tree)
+        self.filetrees = filetrees
+        self.snapshot = snapshot
+        self.dest_tree = dest_tree
+        if self.on_update is not None:
+            self.on_update(dest_tree)
+        if self.compressor is not None:
+            self.compressor.wait()
+        if self.store is not None:
+            self.store.prune()
+        self.manifest.save()
+        return dest_tree
+
+    def _dest_tree(self, filetrees):
+        '''Returns the file tree of the destination, in the form returned by
+        `build_filetree()`, from the outputs recorded in the manifest.'''
+        trees = [filetrees.images]
+        for reltpth, zfiles in filetrees.archives.items():
+            for zfname in zfiles:
+                outputs = self.manifest.outputs_of('cbz:' + path.join(reltpth, zfname))
+                trees.append(
+                    _filetree_from_paths(
+                        self.dest_path, [path.join(self.manifest.root, x) for x in outputs]
+                    )
+                )
+        dest_tree = merge_filetrees(*trees)
+        if self.transcoder is not None:
+            for key in list(self.manifest.entries):
+                if key.startswith('transcode:') and key.split(':', 1)[1] not in dest_tree:
+                    _remove_stale_outputs(self.manifest, self.manifest.outputs_of(key))
+                    self.manifest.entries.pop(key)
+            dest_tree = self.transcoder.transcode_tree(self.dest_path, dest_tree, self.manifest)
+        if self.tiers is not None:
+            self.tiers.generate(self.dest_path, dest_tree, self.manifest)
+            self.tiers.prune(self.dest_path, dest_tree)
+        return dest_tree
+
+    def _remove_item(self, kind, relpath):
+        key = f'{kind}:{relpath}'
+        if self.verbose:
+            dbg_p(f"\tremoving images of '{relpath}'")
+        _remove_stale_outputs(self.manifest, self.manifest.outputs_of(key))
+        self.manifest.entries.pop(key, None)
+        if kind == 'cbz':
+            archive_index = path.join(
+                self.dest_path, '.'.join(relpath.split('.')[:-1]), ARCHIVE_INDEX_FILENAME
+            )
+            if path.isfile(archive_index):
+                os.remove(archive_index)
+
+    def _extract_item(self, relpath):
+        reltpth, zfname = path.split(relpath)
+        pathlib.Path(self.dest_path, reltpth).mkdir(parents=True, exist_ok=True)
+        extraction, manifest_entry, _ = _plan_cbz_extraction(
+            self.source_path,
+            self.dest_path,
+            reltpth,
+            zfname,
+            maintain_existing_images=self.maintain_existing_images,
+            verbose=self.verbose,
+            manifest=self.manifest,
+            extract=self.extract,
+            stats=self.stats,
+            store=self.store,
+            bufsize=self.bufsize,
+            use_mmap=self.use_mmap,
+        )
+        if extraction is not None:
+            result = _extract_cbz_buffered(extraction, log=dbg_p)
+            _finish_cbz_extraction(relpath, manifest_entry, result, self.manifest, self.stats)
+
+    def _copy_item(self, reltpth, imgfiles):
+        _mirror_image_folder(
+            self.source_path,
+            self.dest_path,
+            reltpth,
+            imgfiles,
+            maintain_existing_images=self.maintain_existing_images,
+            verbose=self.verbose,
+            manifest=self.manifest,
+            link_mode=self.link_mode,
+            stats=self.stats,
+            store=self.store,
+            bufsize=self.bufsize,
+        )
+
+    def _write_pages(self, old_tree, new_tree):
+        '''Writes the "index.html" files of the folders which differ between
+        `old_tree` and `new_tree`, or whose images were written to, and of the
+        folders now before them; the pages of folders which are gone are
+        deleted.'''
+        ordered_keys = sort_nicely(new_tree.keys(), memoize=True)
+        sort_keys = [natural_sort_key(k) for k in ordered_keys]
+        differ = set(
+            k for k in set(old_tree).union(new_tree) if old_tree.get(k) != new_tree.get(k)
+        )
+        to_write = differ.union(self.manifest.changed_dirs).intersection(new_tree)
+        for reltpth in differ:
+            idx = bisect.bisect_left(sort_keys, natural_sort_key(reltpth))
+            if idx:
+                to_write.add(ordered_keys[idx - 1])
+            if reltpth not in new_tree:
+                _remove_page(path.join(self.dest_path, reltpth, 'index.html'))
+                self.manifest.entries.pop('html:' + reltpth, None)
+        for idx, reltpth in enumerate(ordered_keys):
+            if reltpth not in to_write:
+                continue
+            _write_display_page(
+                self.dest_path,
+                reltpth,
+                new_tree[reltpth],
+                ordered_keys[idx + 1] if idx < len(ordered_keys) - 1 else None,
+                embed_images=self.embed_images,
+                verbose=self.verbose,
+                manifest=self.manifest,
+                datauri_cache=self.datauri_cache,
+                stats=self.stats,
+                assets=self.assets,
+                defer_embedded=self.defer_embedded,
+                compressor=self.compressor,
+                tier_widths=self.tiers.widths if self.tiers is not None else None,
+            )
+
+
+def _snapshot_source(source_path, filetrees):
+    '''Returns a dictionary of the signature of each item in `filetrees`,
+    keyed like the entries of a `BuildManifest`: the size and modification
+    time of each CBZ file, and of each image in each folder of images. Files
+    which can't be read (such as those removed since the scan) are left out,
+    so they're seen as changed once they can.'''
+    def signature(full_path):
+        try:
+            st = os.stat(full_path)
+        except OSError:
+            return None
+        return (st.st_size, st.st_mtime_ns)
+
+    snapshot = dict()
+    for reltpth, zfiles in filetrees.archives.items():
+        for zfname in zfiles:
+            sig = signature(path.join(source_path, reltpth, zfname))
+            if sig is not None:
+                snapshot['cbz:' + path.join(reltpth, zfname)] = sig
+    for reltpth, imgfiles in filetrees.images.items():
+        full_dir_path = path.join(source_path, reltpth)
+        snapshot['images:' + reltpth] = tuple(
+            (fname, signature(path.join(full_dir_path, fname))) for fname in imgfiles
+        )
+    return snapshot
 
 
 def main():
@@ -803,36 +4367,579 @@ def main():
         HTML files as base64 encoded data URIs. Grows page size, but improves
         portability.'''
     )
+    parser.add_argument(
+        '--defer-embedded-images',
+        action='count',
+        help='''Only used with '--embed-images'. If provided, each embedded
+        image is only decoded once it's scrolled near to or viewed, rather
+        than every image being decoded as soon as a page is opened.'''
+    )
     parser.add_argument(
         '--maintain-existing-images',
         action='count',
         help='''If provided, then images (in folders and CBZ files) will only
-        be copied into the 'destination' directory if there isn't already a
-        file with the same name in the destination directory. If an image file
-        would be copied from source to destination, but it exists in
-        destination already, then it is not copied if this argument is
-        provided.
+        be copied into the 'destination' directory if there isn't already an
+        up to date copy of them there. An image from a CBZ file is up to date
+        if it has the size and CRC recorded in the CBZ file; any other image
+        is up to date if it has the same size and modification time as the
+        original.
         '''
     )
+    parser.add_argument(
+        '--datauri-cache',
+        action='count',
+        help=f'''Only used with '--embed-images'. If provided, each image is
+        base64 encoded only once and the result is kept in the
+        '{CACHE_DIRNAME}' directory within the destination directory, to be
+        reused by later pages and later runs.'''
+    )
+    parser.add_argument(
+        '--thumbnails',
+        action='count',
+        help=f'''If provided, BROWSE_COMIC_HERE.html previews each comic with
+        small thumbnails, kept in the '{CACHE_DIRNAME}' directory within the
+        destination directory, instead of with full sized pages. Thumbnails are
+        only recreated when the page they show changes. Requires Pillow.'''
+    )
+    parser.add_argument(
+        '--thumbnail-size',
+        type=int,
+        default=300,
+        help='''The size in pixels of the box each thumbnail is scaled to fit
+        within. Defaults to 300.'''
+    )
+    parser.add_argument(
+        '--thumbnail-format',
+        choices=list(THUMBNAIL_FORMATS),
+        default='webp',
+        help='''The image format thumbnails are saved as. Defaults to webp.'''
+    )
+    parser.add_argument(
+        '--browse-mode',
+        choices=BROWSE_MODES,
+        default='single',
+        help='''How comics are listed for browsing. 'single' (the default)
+        lists every comic in BROWSE_COMIC_HERE.html. 'toplevel' creates a page
+        for each top level directory, and 'paged' creates a page for every
+        '--browse-page-size' comics, with BROWSE_COMIC_HERE.html linking to
+        each page. Suits very large libraries.'''
+    )
+    parser.add_argument(
+        '--browse-page-size',
+        type=int,
+        default=BROWSE_PAGE_SIZE,
+        help=f'''The number of comics listed on each page when '--browse-mode'
+        is 'paged'. Defaults to {BROWSE_PAGE_SIZE}.'''
+    )
+    parser.add_argument(
+        '--asset-mode',
+        choices=ASSET_MODES,
+        default='inline',
+        help='''How the CSS and JavaScript of each page are included. 'inline'
+        (the default) includes them within every page. 'shared' writes them
+        once into the destination directory, as files named by a digest of
+        their contents so browsers may cache them forever, and every page
+        links to them. Ignored with '--embed-images', whose pages are always
+        'inline' so each one stands alone.'''
+    )
+    parser.add_argument(
+        '--precompress',
+        nargs='*',
+        choices=list(PRECOMPRESS_FORMATS),
+        metavar='FORMAT',
+        default=None,
+        help=f'''If provided, a precompressed copy of each page is written
+        beside it (such as 'index.html.gz'), for web servers such as nginx
+        with 'gzip_static' to serve. Takes the formats to write, from
+        {', '.join(PRECOMPRESS_FORMATS)}; defaults to all of them. 'brotli'
+        is only written if the brotli module is installed. Pages are
+        compressed by '--jobs' threads, and copies which are already up to
+        date are skipped.'''
+    )
+    parser.add_argument(
+        '--transcode',
+        choices=list(TRANSCODE_FORMATS),
+        default=None,
+        help='''If provided, each image is transcoded into the given format
+        (such as 'page01.png' into 'page01.webp') once it's extracted or
+        copied, and the pages show the transcoded images, which are usually
+        far smaller. The originals are kept beside the transcoded images (so
+        the destination takes up more space, not less), so that unchanged CBZ
+        files and folders needn't be extracted or copied again. Images are
+        only transcoded again once their originals or the transcoding options
+        change. Images are transcoded by '--jobs' processes. Requires Pillow to
+        be installed, with AVIF support for 'avif'.'''
+    )
+    parser.add_argument(
+        '--transcode-quality',
+        type=int,
+        default=80,
+        help='''With '--transcode', the quality (from 0 to 100) to transcode
+        images at. Defaults to 80.'''
+    )
+    parser.add_argument(
+        '--transcode-max-dimension',
+        type=int,
+        default=None,
+        help='''With '--transcode', the size in pixels of the box transcoded
+        images are scaled down to fit within. By default images keep their
+        size.'''
+    )
+    parser.add_argument(
+        '--srcset',
+        nargs='*',
+        type=int,
+        metavar='WIDTH',
+        default=None,
+        help=f'''If provided, smaller copies of each image are created at the
+        given widths in pixels (defaulting to
+        {', '.join(str(x) for x in DEFAULT_TIER_WIDTHS)}), kept in the
+        '{CACHE_DIRNAME}' directory within the destination, and each page
+        offers them with 'srcset' so browsers download the size which suits
+        the screen. Only widths narrower than each image are created, copies
+        which are already up to date are skipped, and copies no longer needed
+        are removed. Copies of images browsers can't show, such as BMPs, are
+        made as JPEGs. Copies are created by '--jobs' processes. Requires
+        Pillow to be installed, and cannot be combined with '--embed-images'.'''
+    )
+    parser.add_argument(
+        '--dedup',
+        action='count',
+        help=f'''If provided, each distinct image is stored once in the
+        '{CACHE_DIRNAME}' directory within the destination, named by the
+        SHA-256 of its contents (worked out as the image is extracted or
+        copied), and the images of each comic are hard links to the stored
+        copies. Credit pages, adverts and covers repeated across volumes then
+        only take up space once; the space saved is reported at the end of
+        the run. Cannot be combined with a '--link-mode' other than 'copy'.'''
+    )
+    parser.add_argument(
+        '--link-mode',
+        choices=LINK_MODES,
+        default='copy',
+        help='''How images in image folders are copied into the destination.
+        'copy' (the default) copies every byte. 'hardlink' and 'symlink'
+        create links to the source images, and 'reflink' creates copy-on-write
+        clones (on filesystems such as btrfs and XFS); all three are instant
+        and use no extra space. 'auto' tries a reflink, then a copy within the
+        kernel, then falls back to 'copy'.'''
+    )
+    parser.add_argument(
+        '--no-extract',
+        action='count',
+        help=f'''If provided, CBZ files are not extracted. Instead, an index of
+        the images in each CBZ file is saved as '{ARCHIVE_INDEX_FILENAME}'
+        where the images would have been extracted to, and the generated pages
+        refer to the images as though they had been. The pages must then be
+        viewed through '--serve', which reads images out of the CBZ files.
+        Cannot be combined with '--embed-images' or '--thumbnails'.'''
+    )
+    parser.add_argument(
+        '--serve',
+        action='count',
+        help='''If provided, once the HTML files are created the destination
+        directory is served over HTTP until interrupted.'''
+    )
+    parser.add_argument(
+        '--host',
+        default='127.0.0.1',
+        help="The address to serve on with '--serve'. Defaults to 127.0.0.1."
+    )
+    parser.add_argument(
+        '--port',
+        type=int,
+        default=8000,
+        help="The port to serve on with '--serve'. Defaults to 8000."
+    )
+    parser.add_argument(
+        '--incremental',
+        action='count',
+        help=f'''If provided, a manifest of what was built is kept in the
+        destination directory as '{MANIFEST_FILENAME}'. On later runs, CBZ
+        files, image folders and HTML files which haven't changed since the
+        previous run are skipped entirely.'''
+    )
+    parser.add_argument(
+        '--hash-contents',
+        action='count',
+        help='''Only used with '--incremental'. If provided, the contents of
+        source files are hashed, so that a file whose modification time changed
+        but whose contents did not is still skipped.'''
+    )
+    parser.add_argument(
+        '--stats-json',
+        metavar='PATH',
+        default=None,
+        help='''If provided, counters and timings of the work done during the
+        run (such as bytes read and written, files skipped, and the time spent
+        in each stage, in decompression, copying and base64 encoding) are
+        written to PATH as JSON once the run finishes.'''
+    )
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=1,
+        help='''The number of CBZ files to extract at the same time. Defaults to
+        1, which extracts each CBZ file one after another.'''
+    )
+    parser.add_argument(
+        '--executor',
+        choices=EXECUTOR_KINDS,
+        default='process',
+        help='''The kind of worker pool used to extract CBZ files when '--jobs'
+        is greater than 1. 'process' (the default) suits compressed CBZ files,
+        where decompression is CPU bound. 'thread' suits stored (uncompressed)
+        CBZ files, where copying the bytes out is I/O bound.'''
+    )
+    parser.add_argument(
+        '--split-archive-size',
+        type=int,
+        default=SPLIT_ARCHIVE_SIZE // 2**20,
+        help=f'''With '--jobs' greater than 1, CBZ files of at least this many
+        MiB have their images split between the workers, each extracting a
+        slice of them, so that one huge CBZ file doesn't hold up the run.
+        Defaults to {SPLIT_ARCHIVE_SIZE // 2**20}; 0 never splits a CBZ file.'''
+    )
+    parser.add_argument(
+        '--buffer-size',
+        type=int,
+        default=COPY_BUFFER_SIZE // 1024,
+        help=f'''The size in KiB of the buffer images are copied through as
+        they're extracted or copied. Defaults to {COPY_BUFFER_SIZE // 1024}.'''
+    )
+    parser.add_argument(
+        '--mmap',
+        action='count',
+        help='''If provided, each CBZ file is memory mapped while it's
+        extracted, and each stored (uncompressed) image is written straight
+        out of the map in one call, rather than read through 'zipfile' a
+        buffer at a time. Most CBZ files are stored, so this can make
+        extraction much faster.'''
+    )
+    parser.add_argument(
+        '--pipeline',
+        action='count',
+        help='''If provided, CBZ files and folders of images are extracted or
+        copied, and their index.html files written, as a pipeline: each comic
+        is written as soon as it's ready, rather than after every comic has
+        been extracted and copied, so the first comics can be read while the
+        rest are still being imported. '--jobs' sets the number of CBZ files
+        extracted at once.'''
+    )
+    parser.add_argument(
+        '--copy-jobs',
+        type=int,
+        default=1,
+        help="With '--pipeline', the number of folders of images copied at once. Defaults to 1."
+    )
+    parser.add_argument(
+        '--render-jobs',
+        type=int,
+        default=1,
+        help="With '--pipeline', the number of index.html files written at once. Defaults to 1."
+    )
+    parser.add_argument(
+        '--pipeline-queue-size',
+        type=int,
+        default=PIPELINE_QUEUE_SIZE,
+        help=f'''With '--pipeline', the number of comics which may wait between
+        one stage of the pipeline and the next. Defaults to {PIPELINE_QUEUE_SIZE}.'''
+    )
+    parser.add_argument(
+        '--watch',
+        action='count',
+        help=f'''If provided, once the HTML files are created the source
+        directory is watched for CBZ files and folders of images being added,
+        changed or removed, until interrupted. Only the comics which changed
+        are extracted or copied again, and only their index.html files, those
+        linking to them, and BROWSE_COMIC_HERE.html are written again. Keeps
+        a manifest as '--incremental' does.'''
+    )
+    parser.add_argument(
+        '--watch-interval',
+        type=float,
+        default=WATCH_INTERVAL,
+        help=f'''With '--watch', how often in seconds to check the source
+        directory for changes. Defaults to {WATCH_INTERVAL}.'''
+    )
+    parser.add_argument(
+        '--watch-debounce',
+        type=float,
+        default=WATCH_DEBOUNCE,
+        help=f'''With '--watch', how long in seconds the source directory must
+        go without changing before changes are handled, so that a burst of
+        changes is handled at once. Defaults to {WATCH_DEBOUNCE}.'''
+    )
     args = parser.parse_args()
+    if args.thumbnails and Image is None:
+        parser.error("--thumbnails requires Pillow to be installed")
+    if args.no_extract and (args.embed_images or args.thumbnails):
+        parser.error("--no-extract cannot be combined with --embed-images or --thumbnails")
+    if args.transcode and args.no_extract:
+        parser.error("--no-extract cannot be combined with --transcode")
+    if args.dedup and args.no_extract:
+        parser.error("--no-extract cannot be combined with --dedup")
+    if args.dedup and args.link_mode != 'copy':
+        parser.error(f"--dedup cannot be combined with --link-mode {args.link_mode}")
+    if args.srcset is not None and (args.no_extract or args.embed_images):
+        parser.error("--srcset cannot be combined with --no-extract or --embed-images")
     verbose = bool(args.verbose)
     source = path.abspath(args.source)
     dest = path.abspath(args.destination)
     embed_images = bool(args.embed_images)
     maintain_existing_images = bool(args.maintain_existing_images)
+    datauri_cache = None
+    if embed_images and args.datauri_cache:
+        datauri_cache = DataURICache(path.join(dest, CACHE_DIRNAME, 'datauri'))
+    manifest = None
+    if args.incremental or args.watch:
+        manifest = BuildManifest.load(dest, hash_contents=bool(args.hash_contents))
+    stats = None
+    if args.stats_json:
+        stats = Stats()
+    compressor = None
+    if args.precompress is not None:
+        compressor = PageCompressor(
+            formats=args.precompress or tuple(PRECOMPRESS_FORMATS),
+            jobs=args.jobs,
+            verbose=verbose,
+            stats=stats,
+        )
+    transcoder = None
+    if args.transcode:
+        try:
+            transcoder = Transcoder(
+                image_format=args.transcode,
+                quality=args.transcode_quality,
+                max_dimension=args.transcode_max_dimension,
+                jobs=args.jobs,
+                verbose=verbose,
+                stats=stats,
+            )
+        except (ImportError, ValueError) as err:
+            parser.error(f"--transcode {args.transcode}: {err}")
+    split_size = args.split_archive_size * 2**20 if args.split_archive_size > 0 else None
+    if args.buffer_size < 1:
+        parser.error("--buffer-size must be at least 1")
+    bufsize = args.buffer_size * 1024
+    use_mmap = bool(args.mmap)
+    store = None
+    if args.dedup:
+        store = ContentStore(path.join(dest, CACHE_DIRNAME, 'store'))
+    tiers = None
+    if args.srcset is not None:
+        try:
+            tiers = TierGenerator(
+                widths=args.srcset or DEFAULT_TIER_WIDTHS,
+                jobs=args.jobs,
+                verbose=verbose,
+                stats=stats,
+            )
+        except (ImportError, ValueError) as err:
+            parser.error(f"--srcset: {err}")
 
-    mirror_unzip_cbz(
-        source, dest, maintain_existing_images=maintain_existing_images, verbose=verbose
-    )
-    # If source and destination are the same folder, we'd end up opening the
-    # same file in both read and write mode, and copying itself, which is bad
-    # since it could corrupt or delete the image files.
-    if source != dest:
-        mirror_images_directory(
-            source, dest, maintain_existing_images=maintain_existing_images, verbose=verbose
+    def finish_build(dest_tree, assets=None):
+        '''Creates the thumbnails and browse pages of the comics in
+        `dest_tree`, after each build and each update while watching.'''
+        if tiers is not None:
+            tiers.prune(dest, dest_tree)
+        thumbnails = None
+        if args.thumbnails:
+            with _stage(stats, 'generate_thumbnails', verbose):
+                thumbnails = generate_thumbnails(
+                    dest,
+                    filetree=dest_tree,
+                    size=args.thumbnail_size,
+                    image_format=args.thumbnail_format,
+                    jobs=args.jobs,
+                    verbose=verbose,
+                    stats=stats,
+                )
+        with _stage(stats, 'create_comic_browse_htmlfiles', verbose):
+            create_comic_browse_htmlfiles(
+                dest,
+                embed_images=embed_images,
+                verbose=verbose,
+                manifest=manifest,
+                filetree=dest_tree,
+                datauri_cache=datauri_cache,
+                thumbnails=thumbnails,
+                browse_mode=args.browse_mode,
+                browse_page_size=args.browse_page_size,
+                stats=stats,
+                assets=assets,
+                compressor=compressor,
+            )
+
+    # Entries are only recorded in the manifest once their outputs have been
+    # written, so saving it even after a failure keeps it accurate.
+    try:
+        # Walk the source once, and learn what's in the destination from what
+        # gets written to it rather than by walking it as well.
+        assets = None
+        if args.asset_mode == 'shared' and not embed_images:
+            with _stage(stats, 'write_shared_assets', verbose):
+                assets = write_shared_assets(dest, verbose=verbose, compressor=compressor)
+        with _stage(stats, 'scan', verbose):
+            source_trees = scan_filetrees(source)
+            if args.watch:
+                snapshot = _snapshot_source(source, source_trees)
+        if args.pipeline:
+            with _stage(stats, 'run_pipeline', verbose):
+                dest_tree = run_pipeline(
+                    source,
+                    dest,
+                    maintain_existing_images=maintain_existing_images,
+                    embed_images=embed_images,
+                    verbose=verbose,
+                    manifest=manifest,
+                    filetrees=source_trees,
+                    extract=not args.no_extract,
+                    link_mode=args.link_mode,
+                    datauri_cache=datauri_cache,
+                    stats=stats,
+                    extract_jobs=args.jobs,
+                    executor=args.executor,
+                    copy_jobs=args.copy_jobs,
+                    render_jobs=args.render_jobs,
+                    queue_size=args.pipeline_queue_size,
+                    assets=assets,
+                    defer_embedded=bool(args.defer_embedded_images),
+                    compressor=compressor,
+                    transcoder=transcoder,
+                    tiers=tiers,
+                    store=store,
+                    split_size=split_size,
+                    bufsize=bufsize,
+                    use_mmap=use_mmap,
+                )
+        else:
+            with _stage(stats, 'mirror_unzip_cbz', verbose):
+                dest_tree = mirror_unzip_cbz(
+                    source,
+                    dest,
+                    maintain_existing_images=maintain_existing_images,
+                    verbose=verbose,
+                    jobs=args.jobs,
+                    executor=args.executor,
+                    manifest=manifest,
+                    filetree=source_trees.archives,
+                    extract=not args.no_extract,
+                    stats=stats,
+                    store=store,
+                    split_size=split_size,
+                    bufsize=bufsize,
+                    use_mmap=use_mmap,
+                )
+            # If source and destination are the same folder, we'd end up opening the
+            # same file in both read and write mode, and copying itself, which is bad
+            # since it could corrupt or delete the image files.
+            if source != dest:
+                with _stage(stats, 'mirror_images_directory', verbose):
+                    copied_tree = mirror_images_directory(
+                        source,
+                        dest,
+                        maintain_existing_images=maintain_existing_images,
+                        verbose=verbose,
+                        manifest=manifest,
+                        filetree=source_trees.images,
+                        link_mode=args.link_mode,
+                        stats=stats,
+                        store=store,
+                        bufsize=bufsize,
+                    )
+            else:
+                copied_tree = source_trees.images
+            dest_tree = merge_filetrees(dest_tree, copied_tree)
+            if transcoder is not None:
+                with _stage(stats, 'transcode_images', verbose):
+                    dest_tree = transcoder.transcode_tree(dest, dest_tree, manifest=manifest)
+            if tiers is not None:
+                with _stage(stats, 'generate_tiers', verbose):
+                    tiers.generate(dest, dest_tree, manifest=manifest)
+            with _stage(stats, 'create_comic_display_htmlfiles', verbose):
+                create_comic_display_htmlfiles(
+                    dest,
+                    embed_images=embed_images,
+                    verbose=verbose,
+                    manifest=manifest,
+                    filetree=dest_tree,
+                    datauri_cache=datauri_cache,
+                    stats=stats,
+                    assets=assets,
+                    defer_embedded=bool(args.defer_embedded_images),
+                    compressor=compressor,
+                    tier_widths=tiers.widths if tiers is not None else None,
+                )
+        finish_build(dest_tree, assets)
+        if compressor is not None:
+            with _stage(stats, 'precompress', verbose):
+                compressor.wait()
+        if store is not None:
+            with _stage(stats, 'prune_store', verbose):
+                store.prune()
+                shared, saved = store.savings()
+            dbg_p(
+                f"{shared} images share stored copies with another, "
+                f"saving {saved} bytes ({saved / 2**30:.2f} GiB)"
+            )
+    finally:
+        if manifest is not None:
+            manifest.save()
+        if stats is not None:
+            stats.save(args.stats_json)
+    if args.watch:
+        if args.serve:
+            threading.Thread(
+                target=serve, args=(dest, ), kwargs={'host': args.host, 'port': args.port},
+                daemon=True
+            ).start()
+        watcher = SourceWatcher(
+            source,
+            dest,
+            manifest,
+            filetrees=source_trees,
+            snapshot=snapshot,
+            on_update=functools.partial(finish_build, assets=assets),
+            maintain_existing_images=maintain_existing_images,
+            embed_images=embed_images,
+            verbose=verbose,
+            extract=not args.no_extract,
+            link_mode=args.link_mode,
+            datauri_cache=datauri_cache,
+            stats=stats,
+            interval=args.watch_interval,
+            debounce=args.watch_debounce,
+            assets=assets,
+            defer_embedded=bool(args.defer_embedded_images),
+            compressor=compressor,
+            transcoder=transcoder,
+            tiers=tiers,
+            store=store,
+            bufsize=bufsize,
+            use_mmap=use_mmap,
         )
-    create_comic_display_htmlfiles(dest, embed_images=embed_images, verbose=verbose)
-    create_comic_browse_htmlfiles(dest, embed_images=embed_images, verbose=verbose)
+        try:
+            watcher.run()
+        finally:
+            if compressor is not None:
+                compressor.close()
+            if transcoder is not None:
+                transcoder.close()
+            if tiers is not None:
+                tiers.close()
+            if stats is not None:
+                stats.save(args.stats_json)
+    else:
+        if compressor is not None:
+            compressor.close()
+        if transcoder is not None:
+            transcoder.close()
+        if tiers is not None:
+            tiers.close()
+        if args.serve:
+            serve(dest, host=args.host, port=args.port)
 
 
 if __name__ == '__main__':
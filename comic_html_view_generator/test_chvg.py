@@ -1,8 +1,47 @@
 import unittest
+import tempfile
+import io
+import gzip
+import json
+import zipfile
+import os
+import struct
+import time
+import functools
 from os import path
 from random import sample
+from unittest import mock
 
-from .chvg import mirror_unzip_cbz, sort_nicely
+from . import chvg
+from .chvg import mirror_unzip_cbz, merge_filetrees, sort_nicely, BuildManifest
+
+
+def make_cbz(zpath, members, compression=zipfile.ZIP_DEFLATED):
+    '''Writes a zip file at `zpath` holding each of the (name, bytes) pairs in
+    `members`.'''
+    os.makedirs(path.dirname(zpath), exist_ok=True)
+    with zipfile.ZipFile(zpath, 'w', compression=compression) as zfp:
+        for name, data in members:
+            zfp.writestr(name, data)
+
+
+def read_tree(root):
+    '''Returns a dict of every file beneath `root`, keyed by relative path,
+    with the contents of each file as the value.'''
+    contents = dict()
+    for dirpath, _, files in os.walk(root):
+        for f in files:
+            full = path.join(dirpath, f)
+            with open(full, 'rb') as fp:
+                contents[path.relpath(full, root)] = fp.read()
+    return contents
+
+
+def png_header(width, height):
+    '''Returns the start of a PNG file of `width` by `height` pixels, as far
+    as the end of its IHDR chunk.'''
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + struct.pack('>I', len(ihdr)) + b'IHDR' + ihdr + b'\0' * 4
 
 
 class TestMirrorUnzipCBZ(unittest.TestCase):
@@ -20,6 +59,1197 @@ class TestMirrorUnzipCBZ(unittest.TestCase):
         mirror_unzip_cbz(basepath, testout, verbose=True)
 
 
+class TestParallelMirrorUnzipCBZ(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.source = path.join(self.tmpdir.name, 'source')
+        for vol in range(4):
+            members = [(f'issue{vol}/img{i:02}.png', os.urandom(2048)) for i in range(5)]
+            members.append(('__MACOSX/._img01.png', b'junk'))
+            make_cbz(path.join(self.source, 'series', f'volume{vol:02}.cbz'), members)
+        make_cbz(
+            path.join(self.source, 'stored.zip'),
+            [('page1.jpg', os.urandom(512)), ('notes.txt', b'text')],
+            compression=zipfile.ZIP_STORED,
+        )
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def testParallelMatchesSerial(self):
+        serial = path.join(self.tmpdir.name, 'serial')
+        mirror_unzip_cbz(self.source, serial)
+        expected = read_tree(serial)
+        self.assertIn(path.join('series', 'volume02', 'issue2', 'img04.png'), expected)
+        self.assertIn(path.join('stored', 'page1.jpg'), expected)
+        self.assertNotIn(path.join('stored', 'notes.txt'), expected)
+        for executor in ['process', 'thread']:
+            dest = path.join(self.tmpdir.name, executor)
+            mirror_unzip_cbz(self.source, dest, jobs=3, executor=executor)
+            self.assertEqual(expected, read_tree(dest))
+
+    def testUnknownExecutor(self):
+        with self.assertRaises(ValueError):
+            mirror_unzip_cbz(self.source, self.tmpdir.name, jobs=2, executor='fiber')
+
+    def testLargeArchivesAreSplit(self):
+        serial = path.join(self.tmpdir.name, 'serial')
+        expected_tree = mirror_unzip_cbz(self.source, serial)
+        for executor in ['process', 'thread']:
+            dest = path.join(self.tmpdir.name, executor)
+            stats = chvg.Stats()
+            tree = mirror_unzip_cbz(
+                self.source, dest, jobs=3, executor=executor, stats=stats, split_size=1
+            )
+            self.assertEqual(expected_tree, tree)
+            self.assertEqual(read_tree(serial), read_tree(dest))
+            # Each volume of 5 images is split 3 ways; 'stored.zip' has 1.
+            self.assertEqual(4 * 3 + 1, stats.counters['archives_opened'])
+            self.assertEqual(21, stats.counters['files_extracted'])
+
+
+class TestIncrementalManifest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.source = path.join(self.tmpdir.name, 'source')
+        self.dest = path.join(self.tmpdir.name, 'dest')
+        self.cbz = path.join(self.source, 'volume01.cbz')
+        make_cbz(self.cbz, [('p1.png', b'one'), ('p2.png', b'two')])
+        os.makedirs(path.join(self.source, 'loose'))
+        with open(path.join(self.source, 'loose', 'a.png'), 'wb') as fp:
+            fp.write(b'loose')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def build(self):
+        manifest = BuildManifest.load(self.dest)
+        mirror_unzip_cbz(self.source, self.dest, manifest=manifest)
+        chvg.mirror_images_directory(self.source, self.dest, manifest=manifest)
+        chvg.create_comic_display_htmlfiles(self.dest, manifest=manifest)
+        chvg.create_comic_browse_htmlfiles(self.dest, manifest=manifest)
+        manifest.save()
+        return manifest
+
+    def testUnchangedIsSkipped(self):
+        self.build()
+        with mock.patch.object(chvg, 'extract_cbz') as extract, \
+                mock.patch.object(chvg.shutil, 'copyfileobj') as copy, \
+                mock.patch.object(chvg, 'PREAMBLE', 'XX-NEW-PREAMBLE-XX'):
+            self.build()
+            extract.assert_not_called()
+            copy.assert_not_called()
+        with open(path.join(self.dest, 'volume01', 'index.html')) as fp:
+            self.assertNotIn('XX-NEW-PREAMBLE-XX', fp.read())
+
+    def testMissingImagesAreCopied(self):
+        self.build()
+        image = path.join(self.dest, 'loose', 'a.png')
+        os.remove(image)
+        self.build()
+        with open(image, 'rb') as fp:
+            self.assertEqual(b'loose', fp.read())
+        with open(image, 'wb') as fp:
+            fp.write(b'lo')
+        self.build()
+        with open(image, 'rb') as fp:
+            self.assertEqual(b'loose', fp.read())
+
+    def testChangedArchiveIsRebuilt(self):
+        self.build()
+        make_cbz(self.cbz, [('p1.png', b'ONE'), ('p3.png', b'three')])
+        os.utime(self.cbz, ns=(1, 1))
+        manifest = self.build()
+        written = read_tree(path.join(self.dest, 'volume01'))
+        self.assertEqual(b'ONE', written['p1.png'])
+        self.assertNotIn('p2.png', written)
+        self.assertIn('p3.png', written['index.html'].decode('utf-8'))
+        self.assertIn('volume01', manifest.changed_dirs)
+
+
+class TestSharedScan(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.source = path.join(self.tmpdir.name, 'source')
+        self.dest = path.join(self.tmpdir.name, 'dest')
+        make_cbz(path.join(self.source, 'a', 'vol1.cbz'), [('x/p1.png', b'1'), ('p2.JPG', b'2')])
+        make_cbz(path.join(self.source, 'vol2.zip'), [('p10.png', b'10'), ('p9.png', b'9')])
+        for name in ['a/b/img2.png', 'a/b/img10.png', 'a/notes.txt', 'c.gif']:
+            os.makedirs(path.dirname(path.join(self.source, name)), exist_ok=True)
+            with open(path.join(self.source, name), 'wb') as fp:
+                fp.write(name.encode('utf-8'))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def testScanMatchesBuildFiletree(self):
+        trees = chvg.scan_filetrees(self.source)
+        self.assertEqual(trees.archives, chvg.build_filetree(self.source, ['.cbz', '.zip']))
+        self.assertEqual(trees.images, chvg.build_filetree(self.source))
+        self.assertEqual({'': ['c.gif'], 'a/b': ['img2.png', 'img10.png']}, trees.images)
+
+    def testMirrorsReturnWhatTheyWrote(self):
+        trees = chvg.scan_filetrees(self.source)
+        unzipped = mirror_unzip_cbz(self.source, self.dest, filetree=trees.archives)
+        copied = chvg.mirror_images_directory(self.source, self.dest, filetree=trees.images)
+        self.assertEqual(chvg.build_filetree(self.dest), chvg.merge_filetrees(unzipped, copied))
+
+
+class TestWriteHtmlPage(unittest.TestCase):
+    def testMatchesTemplate(self):
+        pieces = ['<p>one</p>', '\n', '<p>{two}</p>']
+        outfile = io.StringIO()
+        chvg.write_html_page(outfile, 'a/b', iter(pieces), post_index=chvg.POST_INDEX)
+        expected = chvg.PREAMBLE + chvg.INDEX_TEMPLATE.format(
+            description='a/b', imagelist=''.join(pieces)
+        ) + chvg.POST_INDEX
+        self.assertEqual(expected, outfile.getvalue())
+
+
+class TestWriteImageDatauri(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.image = path.join(self.tmpdir.name, 'page.png')
+        with open(self.image, 'wb') as fp:
+            fp.write(os.urandom(1000))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def testMatchesCreateImageDatauri(self):
+        for chunk_size in [3, 999, 3000]:
+            outfile = io.StringIO()
+            chvg.write_image_datauri(self.image, outfile, chunk_size=chunk_size)
+            self.assertEqual(chvg.create_image_datauri(self.image), outfile.getvalue())
+        with self.assertRaises(ValueError):
+            chvg.write_image_datauri(self.image, io.StringIO(), chunk_size=4)
+
+    def testCacheEncodesOnce(self):
+        cache = chvg.DataURICache(path.join(self.tmpdir.name, 'cache'))
+        first = io.StringIO()
+        chvg.write_image_datauri(self.image, first, cache=cache)
+        self.assertTrue(path.isfile(cache.entry_path(self.image)))
+        second = io.StringIO()
+        with mock.patch.object(chvg.base64, 'b64encode') as encode:
+            chvg.write_image_datauri(self.image, second, cache=cache)
+            encode.assert_not_called()
+        self.assertEqual(chvg.create_image_datauri(self.image), second.getvalue())
+        self.assertEqual(first.getvalue(), second.getvalue())
+
+
+class TestThumbnails(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dest = self.tmpdir.name
+        os.makedirs(path.join(self.dest, 'vol'))
+        for i in range(5):
+            with open(path.join(self.dest, 'vol', f'p{i}.png'), 'wb') as fp:
+                fp.write(b'not really a png')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def testBrowseUsesThumbnails(self):
+        thumbs = {'vol': ['.chvg_cache/thumbnails/vol/p0.png.300.webp']}
+        chvg.create_comic_browse_htmlfiles(self.dest, thumbnails=thumbs)
+        with open(path.join(self.dest, 'BROWSE_COMIC_HERE.html')) as fp:
+            contents = fp.read()
+        self.assertIn('<img src=".chvg_cache/thumbnails/vol/p0.png.300.webp"', contents)
+        self.assertNotIn('vol/p1.png', contents)
+
+    def testScanSkipsCacheDir(self):
+        os.makedirs(path.join(self.dest, chvg.CACHE_DIRNAME, 'thumbnails'))
+        with open(path.join(self.dest, chvg.CACHE_DIRNAME, 'thumbnails', 'a.png'), 'wb'):
+            pass
+        self.assertEqual(['vol'], list(chvg.build_filetree(self.dest)))
+
+    @unittest.skipIf(chvg.Image is not None, 'Pillow is installed')
+    def testRequiresPillow(self):
+        with self.assertRaises(ImportError):
+            chvg.generate_thumbnails(self.dest)
+
+    @unittest.skipIf(chvg.Image is None, 'Pillow is not installed')
+    def testGeneratesThumbnails(self):
+        for i in range(5):
+            chvg.Image.new('RGB', (1200, 1800)).save(path.join(self.dest, 'vol', f'p{i}.png'))
+        thumbs = chvg.generate_thumbnails(self.dest, size=100, image_format='jpeg')
+        self.assertEqual(3, len(thumbs['vol']))
+        with chvg.Image.open(path.join(self.dest, thumbs['vol'][0])) as img:
+            self.assertEqual((67, 100), img.size)
+        with mock.patch.object(chvg, '_make_thumbnail') as make:
+            chvg.generate_thumbnails(self.dest, size=100, image_format='jpeg')
+            make.assert_not_called()
+
+    @unittest.skipIf(chvg.Image is None, 'Pillow is not installed')
+    def testUnreadableImagesArePreviewedWhole(self):
+        with open(path.join(self.dest, 'bad.png'), 'wb') as fp:
+            fp.write(b'not really a png')
+        with mock.patch.object(chvg, 'dbg_p'):
+            thumbs = chvg.generate_thumbnails(self.dest)
+        self.assertEqual(['bad.png'], thumbs[''])
+        self.assertEqual([path.join('vol', f'p{i}.png') for i in range(3)], thumbs['vol'])
+
+
+class TestShardedBrowse(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dest = self.tmpdir.name
+        self.tree = {
+            'a/v1': ['p1.png'], 'a/v2': ['p1.png'], 'b/v1': ['p1.png'], 'c': ['p1.png'],
+        }
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def browse(self, manifest=None, **kwargs):
+        chvg.create_comic_browse_htmlfiles(
+            self.dest, filetree=self.tree, manifest=manifest, **kwargs
+        )
+        return sorted(x for x in os.listdir(self.dest) if x.startswith('BROWSE'))
+
+    def testToplevel(self):
+        self.assertEqual([
+            'BROWSE_COMIC_HERE.a.html', 'BROWSE_COMIC_HERE.b.html',
+            'BROWSE_COMIC_HERE.c.html', 'BROWSE_COMIC_HERE.html'
+        ], self.browse(browse_mode='toplevel'))
+        with open(path.join(self.dest, 'BROWSE_COMIC_HERE.a.html')) as fp:
+            contents = fp.read()
+        self.assertIn('href="a/v2/"', contents)
+        self.assertNotIn('href="b/v1/"', contents)
+
+    def testToplevelImagesAtRoot(self):
+        self.tree[''] = ['cover.png']
+        self.assertIn('BROWSE_COMIC_HERE.(top level).html', self.browse(browse_mode='toplevel'))
+        with open(path.join(self.dest, 'BROWSE_COMIC_HERE.html')) as fp:
+            contents = fp.read()
+        self.assertIn('href="BROWSE_COMIC_HERE.%28top%20level%29.html"', contents)
+        self.assertIn('(top level)', contents)
+
+    def testPagedRemovesStaleShards(self):
+        self.assertEqual(3, len(self.browse(browse_mode='paged', browse_page_size=3)))
+        self.assertEqual(['BROWSE_COMIC_HERE.html'], self.browse())
+
+    def testOnlyChangedShardRewritten(self):
+        manifest = BuildManifest(self.dest)
+        self.browse(manifest, browse_mode='toplevel')
+        self.tree['b/v2'] = ['p1.png']
+        with mock.patch.object(chvg, 'write_html_page') as write:
+            self.browse(manifest, browse_mode='toplevel')
+        written = [c.args[0].name for c in write.call_args_list]
+        self.assertEqual([
+            path.join(self.dest, 'BROWSE_COMIC_HERE.b.html'),
+            path.join(self.dest, 'BROWSE_COMIC_HERE.html'),
+        ], written)
+
+
+class TestCopyImageFile(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.src = path.join(self.tmpdir.name, 'src.png')
+        self.dst = path.join(self.tmpdir.name, 'dst.png')
+        self.data = os.urandom(100000)
+        with open(self.src, 'wb') as fp:
+            fp.write(self.data)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def read(self, fpath):
+        with open(fpath, 'rb') as fp:
+            return fp.read()
+
+    def testModes(self):
+        for mode in ['copy', 'hardlink', 'symlink', 'auto']:
+            chvg.copy_image_file(self.src, self.dst, link_mode=mode)
+            self.assertEqual(self.data, self.read(self.dst), mode)
+            self.assertEqual(mode == 'symlink', path.islink(self.dst))
+        chvg.copy_image_file(self.src, self.dst, link_mode='hardlink')
+        self.assertTrue(path.samefile(self.src, self.dst))
+
+    def testReflink(self):
+        try:
+            chvg.copy_image_file(self.src, self.dst, link_mode='reflink')
+        except OSError:
+            self.assertFalse(path.exists(self.dst))
+            self.skipTest('reflinks are not supported here')
+        self.assertEqual(self.data, self.read(self.dst))
+
+    def testCopyOverLinkLeavesSource(self):
+        chvg.copy_image_file(self.src, self.dst, link_mode='hardlink')
+        chvg.copy_image_file(self.src, self.dst)
+        with open(self.dst, 'wb') as fp:
+            fp.write(b'changed')
+        self.assertEqual(self.data, self.read(self.src))
+
+
+class TestServeFromArchive(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.source = path.join(self.tmpdir.name, 'source')
+        self.dest = path.join(self.tmpdir.name, 'dest')
+        self.members = {
+            'issue1/img01.png': os.urandom(3000),
+            'issue1/img02.png': b'compressible ' * 5000,
+        }
+        make_cbz(path.join(self.source, 'volume1.cbz'), list(self.members.items()))
+        make_cbz(
+            path.join(self.source, 'stored.cbz'),
+            [('page1.jpg', os.urandom(70000))],
+            compression=zipfile.ZIP_STORED,
+        )
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def testIndexInsteadOfExtract(self):
+        written = mirror_unzip_cbz(self.source, self.dest, extract=False)
+        self.assertEqual(
+            sorted(written[path.join('volume1', 'issue1')]), ['img01.png', 'img02.png']
+        )
+        self.assertTrue(path.isdir(path.join(self.dest, 'volume1', 'issue1')))
+        self.assertFalse(path.exists(path.join(self.dest, 'volume1', 'issue1', 'img01.png')))
+        self.assertTrue(path.isfile(path.join(self.dest, 'volume1', chvg.ARCHIVE_INDEX_FILENAME)))
+
+    def testSwitchingModeRebuilds(self):
+        image = path.join(self.dest, 'volume1', 'issue1', 'img01.png')
+        archive_index = path.join(self.dest, 'volume1', chvg.ARCHIVE_INDEX_FILENAME)
+        manifest = BuildManifest.load(self.dest)
+        mirror_unzip_cbz(self.source, self.dest, extract=False, manifest=manifest)
+        manifest.save()
+        manifest = BuildManifest.load(self.dest)
+        mirror_unzip_cbz(self.source, self.dest, manifest=manifest)
+        manifest.save()
+        with open(image, 'rb') as fp:
+            self.assertEqual(self.members['issue1/img01.png'], fp.read())
+        self.assertFalse(path.exists(archive_index))
+        manifest = BuildManifest.load(self.dest)
+        mirror_unzip_cbz(self.source, self.dest, extract=False, manifest=manifest)
+        self.assertTrue(path.isfile(archive_index))
+
+    def testMissingImagesAreExtracted(self):
+        manifest = BuildManifest.load(self.dest)
+        mirror_unzip_cbz(self.source, self.dest, manifest=manifest)
+        image = path.join(self.dest, 'volume1', 'issue1', 'img02.png')
+        os.remove(image)
+        mirror_unzip_cbz(self.source, self.dest, manifest=manifest)
+        self.assertTrue(path.isfile(image))
+
+    def testOpenArchiveMember(self):
+        mirror_unzip_cbz(self.source, self.dest, extract=False)
+        found = chvg._find_archive_member(
+            self.dest, path.join(self.dest, 'volume1', 'issue1', 'img02.png')
+        )
+        archive_index, member = found
+        with chvg.open_archive_member(archive_index, member) as fp:
+            self.assertEqual(self.members['issue1/img02.png'], fp.read())
+        with zipfile.ZipFile(path.join(self.source, 'stored.cbz')) as zfp:
+            expected = zfp.read('page1.jpg')
+        archive_index, member = chvg._find_archive_member(
+            self.dest, path.join(self.dest, 'stored', 'page1.jpg')
+        )
+        with chvg.open_archive_member(archive_index, member) as fp:
+            self.assertEqual(expected, fp.read())
+        self.assertIsNone(chvg._find_archive_member(
+            self.dest, path.join(self.dest, 'volume1', 'issue1', 'missing.png')
+        ))
+
+    def testOpenArchiveMemberRange(self):
+        mirror_unzip_cbz(self.source, self.dest, extract=False)
+        for name in ['img01.png', 'img02.png']:
+            image = path.join(self.dest, 'volume1', 'issue1', name)
+            archive_index, member = chvg._find_archive_member(self.dest, image)
+            data = self.members[member]
+            for start, stop in [(0, 10), (1000, 2500), (2999, None)]:
+                with chvg.open_archive_member(archive_index, member, start, stop) as fp:
+                    self.assertEqual(data[start:stop], fp.read())
+        self.assertEqual((10, 20), chvg._parse_byte_range('bytes=10-19', 100))
+        self.assertEqual((90, 100), chvg._parse_byte_range('bytes=-10', 100))
+        self.assertEqual((90, 100), chvg._parse_byte_range('bytes=90-200', 100))
+        self.assertIsNone(chvg._parse_byte_range('bytes=0-1, 5-6', 100))
+        with self.assertRaises(ValueError):
+            chvg._parse_byte_range('bytes=100-', 100)
+
+    def testBadCRC(self):
+        zpath = path.join(self.source, 'stored.cbz')
+        mirror_unzip_cbz(self.source, self.dest, extract=False)
+        st = os.stat(zpath)
+        with open(zpath, 'r+b') as fp:
+            fp.seek(1000)
+            fp.write(b'corrupt')
+        os.utime(zpath, ns=(st.st_atime_ns, st.st_mtime_ns))
+        archive_index, member = chvg._find_archive_member(
+            self.dest, path.join(self.dest, 'stored', 'page1.jpg')
+        )
+        with chvg.open_archive_member(archive_index, member) as fp:
+            with self.assertRaises(zipfile.BadZipFile):
+                fp.read()
+        with chvg.open_archive_member(archive_index, member, stop=100) as fp:
+            self.assertEqual(100, len(fp.read()))
+
+    def testServe(self):
+        import functools
+        import http.server
+        import threading
+        import urllib.error
+        import urllib.request
+        mirror_unzip_cbz(self.source, self.dest, extract=False)
+        handler = functools.partial(chvg.ArchiveRequestHandler, directory=self.dest)
+        handler.log_message = lambda *args: None
+        with http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler) as httpd:
+            thread = threading.Thread(target=httpd.serve_forever)
+            thread.start()
+            try:
+                url = f'http://127.0.0.1:{httpd.server_address[1]}/volume1/issue1/img01.png'
+                with urllib.request.urlopen(url) as resp:
+                    self.assertEqual('image/png', resp.headers['Content-Type'])
+                    self.assertEqual(self.members['issue1/img01.png'], resp.read())
+                request = urllib.request.Request(url, headers={'Range': 'bytes=100-199'})
+                with urllib.request.urlopen(request) as resp:
+                    self.assertEqual(206, resp.status)
+                    self.assertEqual('bytes 100-199/3000', resp.headers['Content-Range'])
+                    self.assertEqual(self.members['issue1/img01.png'][100:200], resp.read())
+                request = urllib.request.Request(url, headers={'Range': 'bytes=5000-'})
+                with self.assertRaises(urllib.error.HTTPError) as cm:
+                    urllib.request.urlopen(request)
+                cm.exception.close()
+                self.assertEqual(416, cm.exception.code)
+            finally:
+                httpd.shutdown()
+                thread.join()
+
+
+class TestMaintainExistingImages(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.source = path.join(self.tmpdir.name, 'source')
+        self.dest = path.join(self.tmpdir.name, 'dest')
+        self.page = os.urandom(4096)
+        make_cbz(path.join(self.source, 'volume1.cbz'), [('img01.png', self.page)])
+        os.makedirs(path.join(self.source, 'loose'))
+        self.loose = path.join(self.source, 'loose', 'img01.png')
+        with open(self.loose, 'wb') as fp:
+            fp.write(self.page)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def mirror(self):
+        mirror_unzip_cbz(self.source, self.dest, maintain_existing_images=True)
+        chvg.mirror_images_directory(self.source, self.dest, maintain_existing_images=True)
+
+    def testCurrentImagesAreKept(self):
+        self.mirror()
+        with mock.patch.object(chvg.zipfile.ZipFile, 'open') as zopen, \
+                mock.patch.object(chvg, 'copy_image_file') as copy:
+            self.mirror()
+        zopen.assert_not_called()
+        copy.assert_not_called()
+
+    def testTruncatedImagesAreReplaced(self):
+        self.mirror()
+        for relpath in [path.join('volume1', 'img01.png'), path.join('loose', 'img01.png')]:
+            with open(path.join(self.dest, relpath), 'wb') as fp:
+                fp.write(self.page[:100])
+        self.mirror()
+        self.assertEqual(
+            {'volume1/img01.png': self.page, 'loose/img01.png': self.page},
+            {k.replace(os.sep, '/'): v for k, v in read_tree(self.dest).items()},
+        )
+
+    def testSameSizeChangesAreCaught(self):
+        self.mirror()
+        changed = bytes(reversed(self.page))
+        make_cbz(path.join(self.source, 'volume1.cbz'), [('img01.png', changed)])
+        with open(self.loose, 'wb') as fp:
+            fp.write(changed)
+        os.utime(self.loose, ns=(0, 0))
+        self.mirror()
+        self.assertEqual(
+            {'volume1/img01.png': changed, 'loose/img01.png': changed},
+            {k.replace(os.sep, '/'): v for k, v in read_tree(self.dest).items()},
+        )
+
+
+class TestStats(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.source = path.join(self.tmpdir.name, 'source')
+        self.pages = [(f'img{i:02}.png', os.urandom(1000)) for i in range(3)]
+        for vol in range(3):
+            make_cbz(path.join(self.source, f'volume{vol}.cbz'), self.pages)
+        os.makedirs(path.join(self.source, 'loose'))
+        for name, data in self.pages:
+            with open(path.join(self.source, 'loose', name), 'wb') as fp:
+                fp.write(data)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def testPoolWorkersReportCounters(self):
+        results = list()
+        for jobs in [1, 2]:
+            stats = chvg.Stats()
+            dest = path.join(self.tmpdir.name, f'dest{jobs}')
+            mirror_unzip_cbz(self.source, dest, jobs=jobs, executor='thread', stats=stats)
+            self.assertIn('archive:volume1.cbz', stats.timers)
+            results.append(stats.counters)
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(3, results[0]['archives_opened'])
+        self.assertEqual(9, results[0]['files_extracted'])
+        self.assertEqual(9000, results[0]['bytes_written'])
+
+    def testCountsSkipsAndHooks(self):
+        dest = path.join(self.tmpdir.name, 'dest')
+        chvg.mirror_images_directory(self.source, dest)
+        stats = chvg.Stats()
+        seen = list()
+        stats.add_hook(lambda kind, name, value: seen.append((kind, name)))
+        chvg.mirror_images_directory(
+            self.source, dest, maintain_existing_images=True, stats=stats
+        )
+        chvg.create_comic_display_htmlfiles(dest, stats=stats)
+        self.assertEqual(3, stats.counters['files_skipped'])
+        self.assertEqual(0, stats.counters['files_copied'])
+        self.assertEqual(1, stats.counters['pages_written'])
+        self.assertIn(('count', 'pages_written'), seen)
+
+    def testSave(self):
+        stats = chvg.Stats()
+        with stats.timer('copy'):
+            stats.count('files_copied', 2)
+        stats.merge({'files_copied': 1}, {'copy': 1.0})
+        stats_path = path.join(self.tmpdir.name, 'stats.json')
+        stats.save(stats_path)
+        with open(stats_path) as fp:
+            saved = chvg.json.load(fp)
+        self.assertEqual({'files_copied': 3}, saved['counters'])
+        self.assertGreaterEqual(saved['timers']['copy'], 1.0)
+
+
+class TestNameFilter(unittest.TestCase):
+    def testCleanNamelist(self):
+        names = [
+            'issue1/img01.PNG',
+            'issue1/img02.jpeg',
+            '__MACOSX/issue1/._img01.png',
+            'issue1/Thumbs.db',
+            'issue1/notes.txt',
+            'issue1.d/readme',
+            'issue1/img03.png.txt',
+        ]
+        self.assertEqual(['issue1/img01.PNG', 'issue1/img02.jpeg'], chvg.clean_namelist(names))
+
+    def testOtherSuffixes(self):
+        name_filter = chvg.NameFilter(['.tar.gz', 'PNG'], blocked_names=[])
+        self.assertTrue(name_filter.allows('a.TAR.GZ'))
+        self.assertTrue(name_filter.allows('apng'))
+        self.assertFalse(name_filter.allows('a.gz'))
+
+    def testScanListsEachFileOnce(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for name in ['a.png', 'b.JPG', 'c.txt']:
+                open(path.join(tmpdir, name), 'wb').close()
+            tree = chvg.build_filetree(tmpdir, suffix_allowlist=['.png', '.PNG', '.jpg'])
+        self.assertEqual({'': ['a.png', 'b.JPG']}, tree)
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.source = path.join(self.tmpdir.name, 'source')
+        # The folders of 'a.cbz' sort on either side of the loose folder
+        # 'a/m', and 'c' holds both a CBZ file's images and loose images.
+        make_cbz(
+            path.join(self.source, 'a.cbz'),
+            [('b/img1.png', os.urandom(100)), ('z/img1.png', os.urandom(100))],
+        )
+        make_cbz(path.join(self.source, 'c.cbz'), [('img1.png', os.urandom(100))])
+        for folder, name in [('a/m', 'img1.png'), ('c', 'img2.png'), ('d', 'img1.png')]:
+            os.makedirs(path.join(self.source, folder), exist_ok=True)
+            with open(path.join(self.source, folder, name), 'wb') as fp:
+                fp.write(os.urandom(100))
+        for vol in range(5):
+            make_cbz(path.join(self.source, 'e', f'vol{vol}.cbz'), [('img1.png', os.urandom(100))])
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def build_serially(self, dest):
+        tree = merge_filetrees(
+            mirror_unzip_cbz(self.source, dest), chvg.mirror_images_directory(self.source, dest)
+        )
+        chvg.create_comic_display_htmlfiles(dest, filetree=tree)
+        return tree
+
+    def testSameAsSerialStages(self):
+        expected_dest = path.join(self.tmpdir.name, 'serial')
+        expected_tree = self.build_serially(expected_dest)
+        for jobs in [1, 3]:
+            dest = path.join(self.tmpdir.name, f'pipeline{jobs}')
+            tree = chvg.run_pipeline(
+                self.source,
+                dest,
+                extract_jobs=jobs,
+                executor='thread',
+                copy_jobs=jobs,
+                render_jobs=jobs,
+                queue_size=1,
+                split_size=1,
+            )
+            self.assertEqual(expected_tree, tree)
+            self.assertEqual(read_tree(expected_dest), read_tree(dest))
+
+    def testIncrementalRunWritesNothing(self):
+        dest = path.join(self.tmpdir.name, 'dest')
+        manifest = BuildManifest(dest)
+        chvg.run_pipeline(self.source, dest, manifest=manifest)
+        manifest.save()
+        stats = chvg.Stats()
+        chvg.run_pipeline(self.source, dest, manifest=BuildManifest.load(dest), stats=stats)
+        self.assertEqual(0, stats.counters['pages_written'])
+        self.assertEqual(0, stats.counters['files_extracted'])
+
+
+class TestSourceWatcher(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.source = path.join(self.tmpdir.name, 'source')
+        self.dest = path.join(self.tmpdir.name, 'dest')
+        for vol in [1, 3]:
+            make_cbz(path.join(self.source, f'vol{vol}.cbz'), [('img1.png', os.urandom(100))])
+        self.add_image('vol2', 'img1.png')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def add_image(self, folder, name):
+        os.makedirs(path.join(self.source, folder), exist_ok=True)
+        with open(path.join(self.source, folder, name), 'wb') as fp:
+            fp.write(os.urandom(100))
+
+    def build(self, dest):
+        manifest = BuildManifest.load(dest)
+        tree = merge_filetrees(
+            mirror_unzip_cbz(self.source, dest, manifest=manifest),
+            chvg.mirror_images_directory(self.source, dest, manifest=manifest),
+        )
+        chvg.create_comic_display_htmlfiles(dest, manifest=manifest, filetree=tree)
+        chvg.create_comic_browse_htmlfiles(dest, manifest=manifest, filetree=tree)
+        manifest.save()
+        return manifest
+
+    def make_watcher(self, **kwargs):
+        manifest = self.build(self.dest)
+        on_update = lambda tree: chvg.create_comic_browse_htmlfiles(
+            self.dest, manifest=manifest, filetree=tree, stats=kwargs.get('stats')
+        )
+        return chvg.SourceWatcher(self.source, self.dest, manifest, on_update=on_update, **kwargs)
+
+    def testUpdateMatchesFullBuild(self):
+        stats = chvg.Stats()
+        watcher = self.make_watcher(stats=stats)
+        os.remove(path.join(self.source, 'vol3.cbz'))
+        make_cbz(path.join(self.source, 'vol4.cbz'), [('img1.png', os.urandom(100))])
+        self.add_image('vol2', 'img2.png')
+        tree = watcher.update(*watcher.scan())
+        self.assertNotIn('vol3', tree)
+        # The browse page is titled with the name of the destination.
+        expected_dest = path.join(self.tmpdir.name, 'expected', 'dest')
+        self.build(expected_dest)
+        written = read_tree(self.dest)
+        expected = read_tree(expected_dest)
+        for contents in [written, expected]:
+            del contents[chvg.MANIFEST_FILENAME]
+        self.assertEqual(expected, written)
+        # The pages of 'vol2' and 'vol4', and the browse page; 'vol1' still
+        # links to 'vol2'.
+        self.assertEqual(3, stats.counters['pages_written'])
+        self.assertEqual(1, stats.counters['files_extracted'])
+        self.assertIsNone(watcher.update(*watcher.scan()))
+
+    def testBurstIsHandledTogether(self):
+        watcher = self.make_watcher(interval=0, debounce=0.05)
+        update = mock.patch.object(watcher, 'update', wraps=watcher.update).start()
+        self.addCleanup(mock.patch.stopall)
+        sleeps = list()
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            if len(sleeps) <= 2:
+                make_cbz(
+                    path.join(self.source, f'new{len(sleeps)}.cbz'),
+                    [('img1.png', os.urandom(100))],
+                )
+            if update.called:
+                raise KeyboardInterrupt
+            time.sleep(0.01)
+
+        watcher.run(sleep=sleep)
+        update.assert_called_once()
+        self.assertIn('new1', watcher.dest_tree)
+        self.assertIn('new2', watcher.dest_tree)
+
+
+class TestSharedAssets(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dest = self.tmpdir.name
+        os.makedirs(path.join(self.dest, 'series', 'vol1'))
+        with open(path.join(self.dest, 'series', 'vol1', 'img1.png'), 'wb') as fp:
+            fp.write(b'image')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def read(self, *parts):
+        with open(path.join(self.dest, *parts)) as fp:
+            return fp.read()
+
+    def testPagesLinkToAssets(self):
+        assets = chvg.write_shared_assets(self.dest)
+        self.assertEqual(chvg.STYLESHEET, self.read(assets.stylesheet))
+        self.assertEqual(chvg.VIEWER_SCRIPT, self.read(assets.script))
+        chvg.create_comic_display_htmlfiles(self.dest, assets=assets)
+        chvg.create_comic_browse_htmlfiles(self.dest, assets=assets)
+        page = self.read('series', 'vol1', 'index.html')
+        self.assertIn(f'href="../../{assets.stylesheet}"', page)
+        self.assertIn(f'src="../../{assets.script}"', page)
+        self.assertNotIn(chvg.STYLESHEET, page)
+        browse = self.read('BROWSE_COMIC_HERE.html')
+        self.assertIn(f'href="./{assets.stylesheet}"', browse)
+        self.assertNotIn(assets.script, browse)
+
+    def testChangedAssetsReplaceOldOnes(self):
+        manifest = BuildManifest(self.dest)
+        old = chvg.write_shared_assets(self.dest)
+        chvg.create_comic_display_htmlfiles(self.dest, manifest=manifest, assets=old)
+        with mock.patch.object(chvg, 'STYLESHEET', 'body {}'):
+            new = chvg.write_shared_assets(self.dest)
+        self.assertNotEqual(old.stylesheet, new.stylesheet)
+        self.assertEqual(old.script, new.script)
+        self.assertFalse(path.exists(path.join(self.dest, old.stylesheet)))
+        chvg.create_comic_display_htmlfiles(self.dest, manifest=manifest, assets=new)
+        self.assertIn(new.stylesheet, self.read('series', 'vol1', 'index.html'))
+        # Going back to inline pages writes the pages again as well.
+        chvg.create_comic_display_htmlfiles(self.dest, manifest=manifest)
+        self.assertIn(chvg.STYLESHEET, self.read('series', 'vol1', 'index.html'))
+
+
+class TestImageDimensions(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.folder = path.join(self.tmpdir.name, 'vol1')
+        os.makedirs(self.folder)
+        for idx in range(chvg.EAGER_PAGES + 2):
+            with open(path.join(self.folder, f'img{idx}.png'), 'wb') as fp:
+                fp.write(png_header(100 + idx, 200))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    @unittest.skipIf(chvg.Image is None, 'Pillow is not installed')
+    def testFormats(self):
+        for image_format, options in [
+            ('PNG', {}),
+            ('GIF', {}),
+            ('BMP', {}),
+            ('JPEG', {}),
+            ('JPEG', {'progressive': True}),
+            ('WEBP', {'lossless': False}),
+            ('WEBP', {'lossless': True}),
+            ('WEBP', {'exif': b'Exif\0\0'}),
+        ] + [('AVIF', {})] * ('AVIF' in chvg.Image.SAVE):
+            full_path = path.join(self.tmpdir.name, 'image')
+            chvg.Image.new('RGB', (123, 457)).save(full_path, image_format, **options)
+            self.assertEqual((123, 457), tuple(chvg.image_dimensions(full_path)), image_format)
+
+    def testUnknownFormat(self):
+        full_path = path.join(self.tmpdir.name, 'image.tiff')
+        with open(full_path, 'wb') as fp:
+            fp.write(b'II*\0' + b'\0' * 40)
+        self.assertIsNone(chvg.image_dimensions(full_path))
+        self.assertIsNone(chvg.image_dimensions(path.join(self.tmpdir.name, 'missing.png')))
+
+    def read_page(self, **kwargs):
+        chvg.create_comic_display_htmlfiles(self.tmpdir.name, **kwargs)
+        with open(path.join(self.folder, 'index.html')) as fp:
+            return [x for x in fp.read().split('\n') if 'class="imgbox"' in x]
+
+    def testPagesHaveSizesAndLoadLazily(self):
+        lines = self.read_page()
+        for idx, line in enumerate(lines):
+            self.assertIn(f'width="{100 + idx}" height="200" decoding="async"', line)
+            self.assertEqual(idx >= chvg.EAGER_PAGES, 'loading="lazy"' in line)
+
+    def testDeferredEmbeddedImages(self):
+        lines = self.read_page(embed_images=True, defer_embedded=True)
+        for idx, line in enumerate(lines):
+            self.assertIn(f'<img data-embedded="{idx}" width="{100 + idx}"', line)
+            self.assertNotIn('src=', line)
+            self.assertIn(f'<script type="text/plain" id="embedded-data-{idx}">data:', line)
+
+
+class TestPageCompressor(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dest = self.tmpdir.name
+        for folder in ['vol1', 'vol2']:
+            os.makedirs(path.join(self.dest, folder))
+            with open(path.join(self.dest, folder, 'img1.png'), 'wb') as fp:
+                fp.write(png_header(10, 20))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def testPagesAreCompressed(self):
+        stats = chvg.Stats()
+        with chvg.PageCompressor(formats=['gzip'], jobs=2, stats=stats) as compressor:
+            chvg.create_comic_display_htmlfiles(self.dest, compressor=compressor)
+            chvg.create_comic_browse_htmlfiles(self.dest, compressor=compressor)
+        for page in ['vol1/index.html', 'vol2/index.html', 'BROWSE_COMIC_HERE.html']:
+            full_path = path.join(self.dest, page)
+            with open(full_path, 'rb') as fp, gzip.open(full_path + '.gz') as compressed:
+                self.assertEqual(fp.read(), compressed.read())
+        self.assertEqual(3, stats.counters['sidecars_written'])
+
+    def testCurrentSidecarsAreSkipped(self):
+        page = path.join(self.dest, 'vol1', 'index.html')
+        chvg.create_comic_display_htmlfiles(self.dest)
+        with chvg.PageCompressor(formats=['gzip']) as compressor:
+            compressor.submit(page)
+        stats = chvg.Stats()
+        with chvg.PageCompressor(formats=['gzip'], stats=stats) as compressor:
+            compressor.submit(page)
+            compressor.wait()
+            self.assertEqual(1, stats.counters['sidecars_skipped'])
+            with open(page, 'a') as fp:
+                fp.write('changed')
+            os.utime(page, ns=(1, 1))
+            compressor.submit(page)
+        self.assertEqual(1, stats.counters['sidecars_written'])
+        with gzip.open(page + '.gz') as compressed:
+            self.assertTrue(compressed.read().endswith(b'changed'))
+
+    def testBrotliNeedsModule(self):
+        with mock.patch.object(chvg, 'brotli', None):
+            with chvg.PageCompressor() as compressor:
+                self.assertEqual(['gzip'], compressor.formats)
+        with self.assertRaises(ValueError):
+            chvg.PageCompressor(formats=['zstd'])
+
+    def testStaleShardSidecarsAreRemoved(self):
+        with chvg.PageCompressor(formats=['gzip']) as compressor:
+            chvg.create_comic_browse_htmlfiles(
+                self.dest, browse_mode='toplevel', compressor=compressor
+            )
+        shard = path.join(self.dest, 'BROWSE_COMIC_HERE.vol2.html')
+        self.assertTrue(path.isfile(shard + '.gz'))
+        chvg.create_comic_browse_htmlfiles(
+            self.dest, browse_mode='toplevel', filetree={'vol1': ['img1.png']}
+        )
+        self.assertFalse(path.exists(shard))
+        self.assertFalse(path.exists(shard + '.gz'))
+
+
+@unittest.skipIf(chvg.Image is None, 'Pillow is not installed')
+class TestTranscoder(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dest = self.tmpdir.name
+        os.makedirs(path.join(self.dest, 'vol1'))
+        for name in ['p1.png', 'p2.png', 'p2.jpg']:
+            chvg.Image.new('RGB', (400, 800)).save(path.join(self.dest, 'vol1', name))
+        with open(path.join(self.dest, 'vol1', 'broken.png'), 'wb') as fp:
+            fp.write(b'not an image')
+        self.tree = {'vol1': ['p1.png', 'p2.png', 'p2.jpg', 'broken.png']}
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def testTranscodesTree(self):
+        stats = chvg.Stats()
+        with chvg.Transcoder(max_dimension=200, jobs=2, stats=stats) as transcoder:
+            tree = transcoder.transcode_tree(self.dest, self.tree)
+        self.assertEqual({'vol1': ['p1.webp', 'p2.png.webp', 'p2.jpg.webp', 'broken.png']}, tree)
+        with chvg.Image.open(path.join(self.dest, 'vol1', 'p1.webp')) as img:
+            self.assertEqual(('WEBP', (100, 200)), (img.format, img.size))
+        self.assertEqual(3, stats.counters['files_transcoded'])
+        chvg.create_comic_display_htmlfiles(self.dest, filetree=tree)
+        with open(path.join(self.dest, 'vol1', 'index.html')) as fp:
+            contents = fp.read()
+        self.assertIn('src="p1.webp" width="100" height="200"', contents)
+        self.assertNotIn('src="p1.png"', contents)
+
+    def testOnlyChangedImagesAreTranscoded(self):
+        manifest = BuildManifest(self.dest)
+        chvg.Transcoder().transcode_tree(self.dest, self.tree, manifest)
+        stats = chvg.Stats()
+        transcoder = chvg.Transcoder(stats=stats)
+        transcoder.transcode_tree(self.dest, self.tree, manifest)
+        self.assertNotIn('files_transcoded', stats.counters)
+        self.assertEqual(3, stats.counters['transcodes_skipped'])
+        os.utime(path.join(self.dest, 'vol1', 'p1.png'), ns=(1, 1))
+        transcoder.transcode_tree(self.dest, self.tree, manifest)
+        self.assertEqual(1, stats.counters['files_transcoded'])
+        # New settings transcode everything again.
+        chvg.Transcoder(quality=50, stats=stats).transcode_tree(self.dest, self.tree, manifest)
+        self.assertEqual(4, stats.counters['files_transcoded'])
+        # Transcoded images whose originals are gone are removed.
+        chvg.Transcoder().transcode_tree(self.dest, {'vol1': ['p1.png']}, manifest)
+        self.assertEqual(
+            ['broken.png', 'p1.png', 'p1.webp', 'p2.jpg', 'p2.png'],
+            sorted(os.listdir(path.join(self.dest, 'vol1')))
+        )
+
+    def testNewSettingsWithoutManifest(self):
+        chvg.Transcoder().transcode_tree(self.dest, self.tree)
+        stats = chvg.Stats()
+        chvg.Transcoder(stats=stats).transcode_tree(self.dest, self.tree)
+        self.assertNotIn('files_transcoded', stats.counters)
+        chvg.Transcoder(quality=50, stats=stats).transcode_tree(self.dest, self.tree)
+        self.assertEqual(3, stats.counters['files_transcoded'])
+        try:
+            transcoder = chvg.Transcoder(image_format='avif')
+        except ValueError:
+            self.skipTest("this installation of Pillow can't save AVIF images")
+        transcoder.transcode_tree(self.dest, self.tree)
+        self.assertEqual(
+            ['broken.png', 'p1.avif', 'p1.png', 'p2.jpg', 'p2.jpg.avif', 'p2.png', 'p2.png.avif'],
+            sorted(os.listdir(path.join(self.dest, 'vol1')))
+        )
+
+    def testPipelinePicksUpNewSettings(self):
+        source = path.join(self.tmpdir.name, 'source')
+        dest = path.join(self.tmpdir.name, 'dest')
+        for folder in 'abcd':
+            os.makedirs(path.join(source, folder))
+            chvg.Image.frombytes('RGB', (64, 64), os.urandom(64 * 64 * 3)).save(
+                path.join(source, folder, 'p1.png')
+            )
+
+        def build(quality):
+            chvg.run_pipeline(
+                source,
+                dest,
+                copy_jobs=4,
+                executor='thread',
+                transcoder=chvg.Transcoder(quality=quality),
+            )
+            return {x: v for x, v in read_tree(dest).items() if x.endswith('.webp')}
+
+        before = build(90)
+        after = build(5)
+        self.assertEqual(4, len(before))
+        for name, data in before.items():
+            self.assertNotEqual(data, after[name], name)
+        with open(path.join(dest, chvg.CACHE_DIRNAME, chvg.TRANSCODE_SETTINGS_FILENAME)) as fp:
+            self.assertEqual(5, json.load(fp)['quality'])
+
+    def testUnknownFormat(self):
+        with self.assertRaises(ValueError):
+            chvg.Transcoder(image_format='tiff')
+
+
+@unittest.skipIf(chvg.Image is None, 'Pillow is not installed')
+class TestTierGenerator(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dest = self.tmpdir.name
+        os.makedirs(path.join(self.dest, 'vol 1'))
+        chvg.Image.new('RGB', (1000, 1500)).save(path.join(self.dest, 'vol 1', 'p1.png'))
+        chvg.Image.new('RGB', (300, 300)).save(path.join(self.dest, 'vol 1', 'p2.jpg'))
+        self.tiers_dir = path.join(self.dest, chvg.CACHE_DIRNAME, 'tiers', 'vol 1')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def testCreatesNarrowerCopies(self):
+        stats = chvg.Stats()
+        with chvg.TierGenerator(widths=[960, 480, 2000], jobs=2, stats=stats) as tiers:
+            tiers.generate(self.dest)
+        self.assertEqual(['p1.png.480w.png', 'p1.png.960w.png'], sorted(os.listdir(self.tiers_dir)))
+        with chvg.Image.open(path.join(self.tiers_dir, 'p1.png.480w.png')) as img:
+            self.assertEqual((480, 720), img.size)
+        self.assertEqual(2, stats.counters['tiers_written'])
+        stats = chvg.Stats()
+        chvg.TierGenerator(stats=stats).generate(self.dest)
+        self.assertNotIn('tiers_written', stats.counters)
+        self.assertEqual(2, stats.counters['tiers_skipped'])
+        # Copies aren't taken to be images of the comic.
+        self.assertEqual(['vol 1'], list(chvg.build_filetree(self.dest)))
+
+    def testPagesOfferCopies(self):
+        tiers = chvg.TierGenerator(widths=[480])
+        tiers.generate(self.dest)
+        chvg.create_comic_display_htmlfiles(self.dest, tier_widths=tiers.widths)
+        with open(path.join(self.dest, 'vol 1', 'index.html')) as fp:
+            lines = [x for x in fp.read().split('\n') if 'class="imgbox"' in x]
+        self.assertIn(
+            ' srcset="../.chvg_cache/tiers/vol%201/p1.png.480w.png 480w, p1.png 1000w"'
+            ' sizes="(max-aspect-ratio: 1000/1500) 100vw, 66vh"', lines[0]
+        )
+        self.assertNotIn('srcset', lines[1])
+
+    def testOtherFormatsAreCopiedAsJPEG(self):
+        chvg.Image.new('RGB', (1000, 1500)).save(path.join(self.dest, 'vol 1', 'p3.bmp'))
+        chvg.TierGenerator(widths=[480]).generate(self.dest)
+        with chvg.Image.open(path.join(self.tiers_dir, 'p3.bmp.480w.jpg')) as img:
+            self.assertEqual(('JPEG', (480, 720)), (img.format, img.size))
+
+    def testPruneRemovesUnusedCopies(self):
+        chvg.Image.new('RGB', (1000, 1500)).save(path.join(self.dest, 'vol 1', 'p3.png'))
+        chvg.TierGenerator(widths=[480, 960]).generate(self.dest)
+        stats = chvg.Stats()
+        tiers = chvg.TierGenerator(widths=[480], stats=stats)
+        self.assertEqual(3, tiers.prune(self.dest, {'vol 1': ['p1.png', 'p2.jpg']}))
+        self.assertEqual(['p1.png.480w.png'], os.listdir(self.tiers_dir))
+        self.assertEqual(3, stats.counters['tiers_removed'])
+        tiers.prune(self.dest, dict())
+        self.assertFalse(path.exists(self.tiers_dir))
+
+
+class TestMappedExtraction(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.zpath = path.join(self.tmpdir.name, 'vol.cbz')
+        self.pages = {f'p{i}.png': os.urandom(5000) for i in range(4)}
+        with zipfile.ZipFile(self.zpath, 'w') as zfp:
+            for idx, (name, data) in enumerate(self.pages.items()):
+                compression = zipfile.ZIP_DEFLATED if idx == 1 else zipfile.ZIP_STORED
+                zfp.writestr(name, data, compress_type=compression)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def extract(self, dest, **kwargs):
+        return chvg.extract_cbz(self.zpath, path.join(self.tmpdir.name, dest), **kwargs)
+
+    def testMatchesZipfile(self):
+        expected = self.extract('plain')
+        for dest, kwargs in [
+            ('mapped', {'use_mmap': True, 'bufsize': 1000}),
+            ('stored', {
+                'use_mmap': True,
+                'store': chvg.ContentStore(path.join(self.tmpdir.name, 'store')),
+            }),
+        ]:
+            stats = chvg.Stats()
+            outputs = self.extract(dest, stats=stats, **kwargs)
+            self.assertEqual([x.replace('plain', dest) for x in expected], outputs)
+            self.assertEqual(self.pages, read_tree(path.join(self.tmpdir.name, dest)))
+            self.assertEqual(4 * 5000, stats.counters['bytes_written'])
+
+    def testBadCRC(self):
+        with open(self.zpath, 'r+b') as fp:
+            contents = fp.read()
+            fp.seek(contents.index(self.pages['p2.png']))
+            fp.write(b'corrupt')
+        with self.assertRaises(zipfile.BadZipFile):
+            self.extract('mapped', use_mmap=True)
+
+    @unittest.skipIf(not path.isdir('/proc/self/fd'), 'open files cannot be listed')
+    def testArchiveIsClosed(self):
+        before = len(os.listdir('/proc/self/fd'))
+        self.extract('plain')
+        self.extract('mapped', use_mmap=True)
+        self.assertEqual(before, len(os.listdir('/proc/self/fd')))
+
+
+class TestContentStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.source = path.join(self.tmpdir.name, 'source')
+        self.dest = path.join(self.tmpdir.name, 'dest')
+        self.credits = b'credits' * 1000
+        for vol in range(3):
+            make_cbz(
+                path.join(self.source, f'vol{vol}.cbz'),
+                [('credits.png', self.credits), ('p1.png', b'page %d' % vol)],
+            )
+        os.makedirs(path.join(self.source, 'extras'))
+        with open(path.join(self.source, 'extras', 'credits.png'), 'wb') as fp:
+            fp.write(self.credits)
+        self.store = chvg.ContentStore(path.join(self.dest, chvg.CACHE_DIRNAME, 'store'))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def testIdenticalImagesAreStoredOnce(self):
+        stats = chvg.Stats()
+        mirror_unzip_cbz(self.source, self.dest, store=self.store, stats=stats)
+        chvg.mirror_images_directory(self.source, self.dest, store=self.store, stats=stats)
+        credits = [
+            os.stat(path.join(self.dest, x, 'credits.png'))
+            for x in ['vol0', 'vol1', 'vol2', 'extras']
+        ]
+        self.assertEqual(1, len(set((st.st_dev, st.st_ino) for st in credits)))
+        self.assertEqual(5, credits[0].st_nlink)
+        with open(path.join(self.dest, 'vol1', 'p1.png'), 'rb') as fp:
+            self.assertEqual(b'page 1', fp.read())
+        self.assertEqual(3, stats.counters['files_deduplicated'])
+        self.assertEqual(3 * len(self.credits), stats.counters['bytes_deduplicated'])
+        self.assertEqual((4, 3 * len(self.credits)), self.store.savings())
+        # Builds without the store replace the links rather than writing
+        # through them.
+        make_cbz(path.join(self.source, 'vol0.cbz'), [('credits.png', b'changed')])
+        mirror_unzip_cbz(self.source, self.dest)
+        with open(path.join(self.dest, 'vol1', 'credits.png'), 'rb') as fp:
+            self.assertEqual(self.credits, fp.read())
+
+    def testDuplicatesAreKept(self):
+        mirror_unzip_cbz(self.source, self.dest, store=self.store)
+        mirror = functools.partial(
+            chvg.mirror_images_directory,
+            self.source,
+            self.dest,
+            maintain_existing_images=True,
+            store=self.store,
+        )
+        mirror()
+        credits = path.join(self.dest, 'extras', 'credits.png')
+        self.assertNotEqual(
+            os.stat(path.join(self.source, 'extras', 'credits.png')).st_mtime_ns,
+            os.stat(credits).st_mtime_ns,
+        )
+        with mock.patch.object(chvg, 'copy_image_file') as copy:
+            mirror()
+            copy.assert_not_called()
+        with open(path.join(self.source, 'extras', 'credits.png'), 'wb') as fp:
+            fp.write(b'CREDITS' * 1000)
+        mirror()
+        with open(credits, 'rb') as fp:
+            self.assertEqual(b'CREDITS' * 1000, fp.read())
+
+    def testConcurrentPutsShareOneCopy(self):
+        first = path.join(self.dest, 'first.png')
+        second = path.join(self.dest, 'second.png')
+        real_link = os.link
+        stored = list()
+
+        def link(src, dst):
+            # Another worker stores the same image just before this one does.
+            if not stored and dst.startswith(self.store.root):
+                stored.append(dst)
+                self.store.put(io.BytesIO(self.credits), second)
+            return real_link(src, dst)
+
+        os.makedirs(self.dest)
+        stats = chvg.Stats()
+        with mock.patch.object(chvg.os, 'link', side_effect=link):
+            self.store.put(io.BytesIO(self.credits), first, stats=stats)
+        self.assertTrue(path.samefile(first, second))
+        self.assertTrue(path.samefile(first, stored[0]))
+        self.assertEqual(1, stats.counters['files_deduplicated'])
+        self.assertEqual((2, len(self.credits)), self.store.savings())
+
+    def testPruneRemovesUnlinkedImages(self):
+        mirror_unzip_cbz(self.source, self.dest, store=self.store)
+        os.remove(path.join(self.dest, 'vol0', 'p1.png'))
+        self.assertEqual(1, self.store.prune())
+        self.assertEqual(0, self.store.prune())
+        self.assertEqual(3, sum(1 for _ in self.store._stored_files()))
+
+
 class TestSortNicely(unittest.TestCase):
     def testSortPurenums(self):
         lst = ['1', '2', '3', '10', '11', '20', '31']
@@ -36,6 +1266,17 @@ class TestSortNicely(unittest.TestCase):
         nice_lst = sort_nicely(sample(lst, k=len(lst)))
         assert lst == nice_lst
 
+    def testMixedTextAndNumbers(self):
+        lst = ['a', 'a1', 'a01b', 'a1b', 'a2', 'a10', 'ab', 'b', '²', '١']
+        for memoize in [False, True]:
+            nice_lst = sort_nicely(sample(lst, k=len(lst)), memoize=memoize)
+            self.assertEqual(lst, nice_lst)
+
+    def testLeadingZerosAndLongNumbers(self):
+        lst = ['p0', 'p000', 'p007', 'p7', 'p99999999999999999999', 'p100000000000000000000']
+        nice_lst = sort_nicely(sample(lst, k=len(lst)))
+        self.assertEqual(lst, nice_lst)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -27,6 +27,9 @@ setup(
     long_description=_read('README.rst'),
     packages=find_packages(),
     install_requires=[],
+    extras_require={
+        'thumbnails': ['Pillow>=8.0'],
+    },
     classifiers=[
         'Environment :: Console',
         'License :: OSI Approved :: GNU General Public License v3 or later (GPLv3+)',